@@ -1,14 +1,19 @@
 # app.py
+import startup
+startup.track_imports()
+
 from aiogram import Bot, Dispatcher, types
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.utils import executor
-from config import BOT_TOKEN, REPORT_CHAT_IDS  # ← импортируем REPORT_CHAT_IDS здесь
-from database import init_db
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+from config import BOT_TOKEN, REPORT_CHAT_IDS, METRICS_HOST, METRICS_PORT, TELEGRAM_API_URL, FAST_STARTUP, REPORT_REFRESH_SECONDS, REPORT_SCHEDULE, WEBHOOK_URL, WEBHOOK_PATH, WEBAPP_HOST, WEBAPP_PORT, LEADER_LOCK_KEY, LEADER_POLL_SECONDS, RECENT_UPDATES_CACHE, LEADERBOARD_CHAT_IDS, LEADERBOARD_INTERVAL  # ← импортируем REPORT_CHAT_IDS здесь
+from database import init_db, background_init, maintain_partitions, compact_storage, SQL_DIALECT
 from handlers import (
     IsAdminFilter,
     IsAllowedChatFilter,
     command_start_handler,
     today_stats_handler,
+    my_stats_handler,
     handle_text_messages,
     handle_photo_messages,
     handle_unsupported_content,
@@ -16,56 +21,158 @@ from handlers import (
     delete_scooter_handler,
     export_excel_handler,
     service_report_handler,
-    monthly_report_handler # <-- Добавляем импорт новой функции
+    monthly_report_handler, # <-- Добавляем импорт новой функции
+    perf_stats_handler,
+    profile_next_handler,
+    backup_now_handler,
+    import_document_handler
 )
+from profiling import ProfilingMiddleware, instrument_bot
+from logs import LogContextMiddleware
+from dedup import RecentUpdatesMiddleware
+from leader import LeaderElection
+import metrics
+from watchdog import watchdog, spawn, supervised
 import asyncio
 import logging
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+startup.mark("imports")
 
-bot = Bot(token=BOT_TOKEN, parse_mode="HTML")
+# Логирование настраивается при импорте config (logs.setup_logging)
+
+api_server = TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else TELEGRAM_PRODUCTION
+bot = Bot(token=BOT_TOKEN, parse_mode="HTML", server=api_server)
+instrument_bot(bot)
 storage = MemoryStorage()
 dp = Dispatcher(bot, storage=storage)
+# Повтор апдейта отсекается первым, до логирования и разбора
+dp.middleware.setup(RecentUpdatesMiddleware(RECENT_UPDATES_CACHE))
+dp.middleware.setup(LogContextMiddleware())
+dp.middleware.setup(ProfilingMiddleware())
+
+metrics_runner = None
+election = None
 
 # Глобальный обработчик необработанных исключений
 @dp.errors_handler()
 async def errors_handler(update, exception):
-    logging.exception(f"Update {update} вызвал ошибку: {exception}")
+    # Сам апдейт не логируем: update_id, chat_id и хендлер добавляет LogContextMiddleware
+    logging.error(f"❌ Ошибка при обработке апдейта: {exception!r}", exc_info=(type(exception), exception, exception.__traceback__))
     return True
 
 async def on_startup(dispatcher: Dispatcher):
-    await init_db()
-    
-    from reports import scheduler, send_scheduled_report
+    global metrics_runner, election
+    watchdog.start()
+    with startup.phase("init_db"):
+        await init_db()
+
+    if METRICS_PORT:
+        with startup.phase("metrics_server"):
+            metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+    from reports import scheduler, send_scheduled_report, refresh_shift_reports
+    metrics.track_scheduler(scheduler)
 
     # Привязываем бота к scheduler (на случай, если понадобится внутри)
     scheduler.bot = bot
 
-    # Добавляем запланированные задачи
+    # Добавляем запланированные задачи. Запоздавший отчет (смена лидера, перезапуск)
+    # еще отправляется в пределах misfire_grace_time, повтор отсекает отметка доставки
+    for shift_type, at in REPORT_SCHEDULE.items():
+        scheduler.add_job(
+            send_scheduled_report,
+            'cron',
+            hour=at.hour,
+            minute=at.minute,
+            second=at.second,
+            args=[shift_type, bot],
+            id=f'{shift_type}_report',
+            replace_existing=True,
+            misfire_grace_time=900,
+            coalesce=True
+        )
+    # Данные отчетов за смену копятся заранее, к 15:00/23:00 остается дочитать хвост
     scheduler.add_job(
-        send_scheduled_report,
+        refresh_shift_reports,
+        'interval',
+        seconds=REPORT_REFRESH_SECONDS,
+        id='shift_report_refresh',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
+    # Закрытые месяцы уходят в архив между сменами, когда запись почти не идет
+    scheduler.add_job(
+        supervised("maintain_partitions")(maintain_partitions),
         'cron',
-        hour=15,
-        minute=0,
-        args=['morning', bot],
-        id='morning_report',
-        replace_existing=True
+        hour=4,
+        minute=30,
+        id='maintain_partitions',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
     )
+    # Сводка старых строк и освобождение места — после архивации, до начала утренней смены
     scheduler.add_job(
-        send_scheduled_report,
+        supervised("compact_storage")(compact_storage),
         'cron',
-        hour=23,
+        hour=5,
         minute=0,
-        args=['evening', bot],
-        id='evening_report',
-        replace_existing=True
+        id='compact_storage',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
     )
+    # Таблицы лидеров редактируются не чаще раза в LEADERBOARD_INTERVAL и только при изменениях
+    if LEADERBOARD_CHAT_IDS:
+        from leaderboard import leaderboards
+        scheduler.add_job(
+            supervised("leaderboard_refresh")(leaderboards.refresh),
+            'interval',
+            seconds=LEADERBOARD_INTERVAL,
+            args=[bot],
+            id='leaderboard_refresh',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
+        )
+    # Закрытые дни отчетов за месяц и по сервисам читаются из представлений агрегатов (PostgreSQL)
+    if SQL_DIALECT == "postgres":
+        from config import AGGREGATE_REFRESH_MINUTES
+        from reports import refresh_aggregates
+        scheduler.add_job(
+            refresh_aggregates,
+            'interval',
+            minutes=AGGREGATE_REFRESH_MINUTES,
+            id='refresh_aggregates',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
+        )
+    # Бэкап файла базы — только для SQLite: в config PostgreSQL этих настроек нет
+    if SQL_DIALECT == "sqlite":
+        from config import BACKUP_INTERVAL_HOURS
+        if BACKUP_INTERVAL_HOURS > 0:
+            from backup import backup_database
+            scheduler.add_job(
+                backup_database,
+                'interval',
+                hours=BACKUP_INTERVAL_HOURS,
+                id='sqlite_backup',
+                replace_existing=True,
+                max_instances=1,
+                coalesce=True
+            )
+
+    # Задачи выполняет только лидер: планировщик стартует на паузе и снимается с нее при избрании
+    scheduler.start(paused=True)
+    election = LeaderElection(LEADER_LOCK_KEY, LEADER_POLL_SECONDS, on_elected=scheduler.resume, on_lost=scheduler.pause)
+    spawn(election.run(), "leader_election")
+    startup.mark("scheduler")
 
-    scheduler.start()
+    if WEBHOOK_URL:
+        await dispatcher.bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH)
+        logging.info(f"🌐 Вебхук: {WEBHOOK_URL + WEBHOOK_PATH}")
 
     logging.info(f"✅ Планировщик запущен. Задачи: {[job.id for job in scheduler.get_jobs()]}")
     logging.info(f"📤 REPORT_CHAT_IDS: {REPORT_CHAT_IDS}")
@@ -82,41 +189,88 @@ async def on_startup(dispatcher: Dispatcher):
        # except Exception as e:
            # logging.error(f"❌ НЕ УДАЛОСЬ отправить сообщение в чат {chat_id}: {e}")
 
+    # Миграция и регистрация команд не нужны для приема сообщений:
+    # в быстром режиме polling стартует, не дожидаясь их
+    if FAST_STARTUP:
+        spawn(_deferred("background_init", background_init()), "background_init")
+        spawn(_deferred("set_my_commands", register_commands(dispatcher.bot)), "set_my_commands")
+    else:
+        await _deferred("background_init", background_init())
+        await _deferred("set_my_commands", register_commands(dispatcher.bot))
+
+    startup.stop_tracking_imports()
+    startup.log_report()
+
+async def _deferred(name: str, coro):
+    with startup.phase(name):
+        await coro
+    logging.info(f"✅ {name} завершено ({startup.phase_ms(name):.0f} мс)")
+
+async def register_commands(bot_instance: Bot):
     # Устанавливаем команды для админов
     admin_commands = [
         types.BotCommand(command="start", description="Начало работы"),
         types.BotCommand(command="today_stats", description="Статистика за текущую смену"),
+        types.BotCommand(command="my_stats", description="Мои итоги за смену или месяц"),
         types.BotCommand(command="export_today_excel", description="Экспорт Excel за текущую смену"),
-        types.BotCommand(command="export_all_excel", description="Экспорт Excel за все время"),
+        types.BotCommand(command="export_all_excel", description="Экспорт за все время: xlsx, csv или zip"),
         types.BotCommand(command="service_report", description="Отчет по сервисам за период"),
         types.BotCommand(command="monthly_report", description="Ежемесячный отчет по сотрудникам"),
         types.BotCommand(command="delete_scooter", description="Удалить номер самоката по username"),
         types.BotCommand(command="find_scooter", description="Найти историю по номеру самоката"),
+        types.BotCommand(command="perf_stats", description="Задержки хендлеров и медленные запросы"),
+        types.BotCommand(command="profile_next", description="Снять cProfile следующей команды"),
+        types.BotCommand(command="backup_now", description="Сделать бэкап базы сейчас"),
     ]
-    await dispatcher.bot.set_my_commands(admin_commands)
+    await bot_instance.set_my_commands(admin_commands)
     logging.info("✅ Команды бота обновлены")
 
 async def on_shutdown(dispatcher: Dispatcher):
-    from reports import scheduler
+    from reports import scheduler, shutdown_export_pool
+    watchdog.stop()
+    if election is not None:
+        await election.stop()
     try:
         if hasattr(scheduler, 'running') and scheduler.running:
             scheduler.shutdown(wait=False)
             logging.info("⏹️ Планировщик остановлен")
     except Exception as e:
         logging.warning(f"⚠️ Ошибка при остановке планировщика: {e}")
+    await shutdown_export_pool()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
 
 def register_handlers():
     dp.register_message_handler(command_start_handler, IsAllowedChatFilter(), commands="start")
     dp.register_message_handler(today_stats_handler, IsAdminFilter(), commands="today_stats")
+    dp.register_message_handler(my_stats_handler, IsAllowedChatFilter(), commands="my_stats")
     dp.register_message_handler(export_excel_handler, IsAdminFilter(), commands=["export_today_excel", "export_all_excel"])
     dp.register_message_handler(service_report_handler, IsAdminFilter(), commands=["service_report"])
     dp.register_message_handler(monthly_report_handler, IsAdminFilter(), commands=["monthly_report"]) # <-- Регистрируем новый обработчик
     dp.register_message_handler(find_scooter_handler, IsAdminFilter(), commands=["find_scooter"])
     dp.register_message_handler(delete_scooter_handler, IsAdminFilter(), commands=["delete_scooter"])
+    dp.register_message_handler(perf_stats_handler, IsAdminFilter(), commands=["perf_stats"])
+    dp.register_message_handler(profile_next_handler, IsAdminFilter(), commands=["profile_next"])
+    dp.register_message_handler(backup_now_handler, IsAdminFilter(), commands=["backup_now"])
+    # Файл от админа в личке — импорт истории (CSV/XLSX в формате выгрузки)
+    dp.register_message_handler(import_document_handler, IsAdminFilter(), chat_type=types.ChatType.PRIVATE, content_types=types.ContentTypes.DOCUMENT)
     dp.register_message_handler(handle_text_messages, IsAllowedChatFilter(), content_types=types.ContentTypes.TEXT)
     dp.register_message_handler(handle_photo_messages, IsAllowedChatFilter(), content_types=types.ContentTypes.PHOTO)
     dp.register_message_handler(handle_unsupported_content, IsAllowedChatFilter(), content_types=types.ContentTypes.ANY)
 
 if __name__ == "__main__":
     register_handlers()
-    executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown, skip_updates=True)
+    if WEBHOOK_URL:
+        # Несколько процессов за балансировщиком делят поток апдейтов. skip_updates снял бы
+        # вебхук и сбросил очередь при перезапуске любого из них, поэтому здесь он выключен
+        executor.start_webhook(
+            dp,
+            WEBHOOK_PATH,
+            on_startup=on_startup,
+            on_shutdown=on_shutdown,
+            skip_updates=False,
+            host=WEBAPP_HOST,
+            port=WEBAPP_PORT
+        )
+    else:
+        executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown, skip_updates=True)
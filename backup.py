@@ -0,0 +1,206 @@
+# backup.py
+# Онлайн-бэкап SQLite через backup API: база копируется порциями страниц с паузами
+# между ними, так что запись в WAL не останавливается. Снимки ротируются, рядом
+# с каждым лежит .sha256 в формате sha256sum. Архивы закрытых месяцев (ARCHIVE_DIR)
+# неизменяемы: они копируются как обычные файлы в каталог <снимок>.archive со своими .sha256
+# и ротируются вместе со снимком. Архив, не изменившийся с прошлого снимка, не копируется
+# заново, а связывается жесткой ссылкой с его копией. Для восстановления файлы из
+# <снимок>.archive кладутся в ARCHIVE_DIR.
+from config import DB_NAME, ARCHIVE_DIR, BACKUP_DIR, BACKUP_KEEP, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP
+from metrics import (
+    BACKUP_SECONDS, BACKUP_SIZE_BYTES, BACKUP_LAST_SUCCESS, BACKUP_RESTARTS,
+    WAL_CHECKPOINT_PAGES, WAL_CHECKPOINT_BUSY, WAL_SIZE_BYTES,
+)
+from watchdog import supervised
+import asyncio
+import datetime
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import time
+
+# Сколько раз пошаговое копирование может начаться заново из-за записи в базу,
+# прежде чем снимок будет снят за один шаг (в WAL это тоже не блокирует запись)
+MAX_RESTARTS = 3
+
+_SNAPSHOT_PREFIX = "scooters_"
+_lock = asyncio.Lock()
+
+def _wal_size() -> int:
+    try:
+        return os.path.getsize(DB_NAME + "-wal")
+    except OSError:
+        return 0
+
+WAL_SIZE_BYTES.set_function(_wal_size)
+
+class _TooManyRestarts(Exception):
+    pass
+
+def _copy(dest: str, pages: int) -> int:
+    """
+    Копирует базу в dest. Возвращает число перезапусков копирования.
+    """
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        # Запись в базу другим соединением заставляет SQLite начать копирование заново
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            BACKUP_RESTARTS.inc()
+            if restarts > MAX_RESTARTS:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+        if remaining:
+            time.sleep(BACKUP_STEP_SLEEP)
+
+    source = sqlite3.connect(DB_NAME)
+    target = sqlite3.connect(dest)
+    try:
+        source.backup(target, pages=pages, progress=progress)
+    finally:
+        target.close()
+        source.close()
+    return restarts
+
+def _checkpoint() -> tuple[int, int, int]:
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        busy, log_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE);").fetchone()
+    finally:
+        conn.close()
+    WAL_CHECKPOINT_PAGES.labels("log").set(log_pages)
+    WAL_CHECKPOINT_PAGES.labels("checkpointed").set(checkpointed)
+    if busy:
+        WAL_CHECKPOINT_BUSY.inc()
+    return busy, log_pages, checkpointed
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def snapshots() -> list[str]:
+    """
+    Снимки в BACKUP_DIR, от старых к новым.
+    """
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    names = sorted(name for name in os.listdir(BACKUP_DIR) if name.startswith(_SNAPSHOT_PREFIX) and name.endswith(".db"))
+    return [os.path.join(BACKUP_DIR, name) for name in names]
+
+def _copy_archives(dest_dir: str, previous_dir: str = None) -> int:
+    """
+    Копирует архивы закрытых месяцев в dest_dir, рядом с каждым — .sha256.
+    Возвращает число архивов.
+    """
+    # Имена как в database.archived_months; .rolling — архив, который сворачивается прямо сейчас
+    names = sorted(name for name in os.listdir(ARCHIVE_DIR) if name.endswith(".db")) if os.path.isdir(ARCHIVE_DIR) else []
+    os.makedirs(dest_dir, exist_ok=True)
+    for name in names:
+        source = os.path.join(ARCHIVE_DIR, name)
+        target = os.path.join(dest_dir, name)
+        stat = os.stat(source)
+        previous = os.path.join(previous_dir, name) if previous_dir else None
+        if previous and os.path.exists(previous) and os.path.exists(previous + ".sha256"):
+            kept = os.stat(previous)
+            if (kept.st_size, kept.st_mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                os.link(previous, target)
+                os.link(previous + ".sha256", target + ".sha256")
+                continue
+        shutil.copy2(source, target + ".partial")
+        sha256 = _sha256(target + ".partial")
+        os.replace(target + ".partial", target)
+        with open(target + ".sha256", 'w', encoding='utf-8') as f:
+            f.write(f"{sha256}  {name}\n")
+    return len(names)
+
+def _rotate():
+    for path in snapshots()[:-BACKUP_KEEP] if BACKUP_KEEP > 0 else []:
+        for stale in (path, path + ".sha256"):
+            if os.path.exists(stale):
+                os.remove(stale)
+        shutil.rmtree(path + ".archive", ignore_errors=True)
+        logging.info(f"🗑 Удален старый снимок {path}")
+
+def _backup_sync() -> dict:
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    name = f"{_SNAPSHOT_PREFIX}{stamp}.db"
+    suffix = 1
+    while os.path.exists(os.path.join(BACKUP_DIR, name)):
+        suffix += 1
+        name = f"{_SNAPSHOT_PREFIX}{stamp}_{suffix}.db"
+    path = os.path.join(BACKUP_DIR, name)
+    partial = path + ".partial"
+    previous = snapshots()
+
+    started = time.perf_counter()
+    try:
+        try:
+            restarts = _copy(partial, BACKUP_PAGES_PER_STEP)
+        except _TooManyRestarts:
+            logging.warning(f"⚠️ Бэкап перезапускался больше {MAX_RESTARTS} раз из-за записи — снимаю за один шаг")
+            restarts = MAX_RESTARTS + 1
+            _copy(partial, -1)
+
+        check = sqlite3.connect(partial)
+        try:
+            result = check.execute("PRAGMA quick_check;").fetchone()[0]
+        finally:
+            check.close()
+        if result != "ok":
+            raise RuntimeError(f"снимок не прошел quick_check: {result}")
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+    sha256 = _sha256(partial)
+    # Архивы копируются до появления снимка: снимок без своих архивов не попадает в ротацию
+    try:
+        archives = _copy_archives(path + ".archive", previous[-1] + ".archive" if previous else None)
+    except Exception:
+        os.remove(partial)
+        shutil.rmtree(path + ".archive", ignore_errors=True)
+        raise
+    os.replace(partial, path)
+    with open(path + ".sha256", 'w', encoding='utf-8') as f:
+        f.write(f"{sha256}  {name}\n")
+    seconds = time.perf_counter() - started
+
+    busy, log_pages, checkpointed = _checkpoint()
+    _rotate()
+    return {
+        "path": path,
+        "size": os.path.getsize(path),
+        "sha256": sha256,
+        "seconds": seconds,
+        "restarts": restarts,
+        "archives": archives,
+        "wal_pages": log_pages,
+        "wal_checkpointed": checkpointed,
+        "wal_busy": bool(busy),
+    }
+
+@supervised("sqlite_backup")
+async def backup_database() -> dict:
+    """
+    Снимает снимок базы в потоке. Бэкапы по расписанию и по команде не пересекаются.
+    """
+    async with _lock:
+        result = await asyncio.to_thread(_backup_sync)
+    BACKUP_SECONDS.observe(result["seconds"])
+    BACKUP_SIZE_BYTES.set(result["size"])
+    BACKUP_LAST_SUCCESS.set(time.time())
+    logging.info(
+        f"💾 Бэкап {result['path']}: {result['size'] / 1024 / 1024:.1f} МБ за {result['seconds']:.1f} с, "
+        f"архивов {result['archives']}, перезапусков {result['restarts']}, WAL {result['wal_checkpointed']}/{result['wal_pages']} страниц"
+    )
+    return result
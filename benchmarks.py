@@ -0,0 +1,390 @@
+# benchmarks.py
+# Бенчмарки горячих путей на объемах продакшена (SQLite).
+#
+#   python benchmarks.py                          # 100k, 1M, 10M строк
+#   python benchmarks.py --sizes 100k --repeat 5
+#   python benchmarks.py --compare bench_results/<прошлый>.json
+#
+# Базы с синтетическими данными кэшируются в bench_data/, результаты пишутся в bench_results/.
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import resource
+import sqlite3
+import statistics
+import string
+import subprocess
+import sys
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(REPO_DIR, "bench_data")
+RESULTS_DIR = os.path.join(REPO_DIR, "bench_results")
+ADMIN_ID = 1000
+REPORT_CHAT_ID = -100999
+SERVICES = ("Яндекс", "Whoosh", "Jet", "Bolt")
+USERS = 500
+CHATS = (-1001000000001, -1001000000002, -1001000000003)
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip("km")) * multiplier)
+
+def configure_env(db_path: str):
+    # До импорта config: бот должен видеть тестовую базу и фиктивный токен
+    os.environ["BOT_TOKEN"] = os.environ.get("BENCH_BOT_TOKEN", "123456:BENCHMARK")
+    os.environ["ADMIN_IDS"] = str(ADMIN_ID)
+    os.environ["ALLOWED_CHAT_IDS"] = ",".join(map(str, CHATS))
+    os.environ["REPORT_CHAT_IDS"] = str(REPORT_CHAT_ID)
+    os.environ["DB_NAME"] = db_path
+
+class RSSSampler:
+    """
+    Пиковый RSS процесса во время замера (VmRSS из /proc, иначе ru_maxrss).
+    """
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def current_rss() -> int:
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current_rss())
+
+    def __enter__(self):
+        self.peak = self.current_rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current_rss())
+        return False
+
+# --- синтетические данные ---
+
+def _scooter_number(rng: random.Random, service: str) -> str:
+    if service == "Яндекс":
+        return "".join(rng.choices(string.digits, k=8))
+    if service == "Whoosh":
+        return "".join(rng.choices(string.ascii_uppercase, k=2)) + "".join(rng.choices(string.digits, k=4))
+    if service == "Jet":
+        return "".join(rng.choices(string.digits, k=6))
+    return "".join(rng.choices(string.digits, k=4))
+
+def seed_rows(size: int, days: int, now: datetime.datetime, seed: int = 1):
+    rng = random.Random(seed)
+    span_seconds = days * 24 * 3600
+    for _ in range(size):
+        service = rng.choice(SERVICES)
+        user_id = rng.randint(1, USERS)
+        ts = now - datetime.timedelta(seconds=rng.randint(0, span_seconds))
+        yield (
+            _scooter_number(rng, service),
+            service,
+            user_id,
+            f"courier{user_id}",
+            f"Курьер {user_id}",
+            ts.strftime("%Y-%m-%d %H:%M:%S"),
+            rng.choice(CHATS),
+        )
+
+def seed_database(db_path: str, size: int, days: int, now: datetime.datetime):
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=OFF;")
+    batch = []
+    for row in seed_rows(size, days, now):
+        batch.append(row)
+        if len(batch) >= 50_000:
+            conn.executemany(
+                "INSERT OR IGNORE INTO accepted_scooters (scooter_number, service, accepted_by_user_id, accepted_by_username, accepted_by_fullname, timestamp, chat_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                batch
+            )
+            conn.commit()
+            batch = []
+    if batch:
+        conn.executemany(
+            "INSERT OR IGNORE INTO accepted_scooters (scooter_number, service, accepted_by_user_id, accepted_by_username, accepted_by_fullname, timestamp, chat_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            batch
+        )
+        conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    conn.execute("ANALYZE;")
+    conn.close()
+
+# --- заглушки aiogram ---
+
+class FakeBot:
+    def __init__(self):
+        self.sent_messages = 0
+        self.sent_documents = 0
+        self.document_bytes = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent_messages += 1
+
+    async def send_document(self, chat_id, document, **kwargs):
+        self.sent_documents += 1
+        data = document.file.read() if hasattr(document, "file") else b""
+        self.document_bytes += len(data)
+
+    async def edit_message_text(self, *args, **kwargs):
+        return True
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.username = f"user{user_id}"
+        self.full_name = f"User {user_id}"
+
+class FakeChat:
+    def __init__(self, chat_id: int, chat_type: str):
+        self.id = chat_id
+        self.type = chat_type
+
+class FakeMessage:
+    _next_id = 1
+
+    def __init__(self, bot: FakeBot, text: str, user_id: int = ADMIN_ID, chat_id: int = ADMIN_ID, chat_type: str = "private"):
+        self.bot = bot
+        self.text = text
+        self.caption = None
+        self.photo = None
+        self.from_user = FakeUser(user_id)
+        self.chat = FakeChat(chat_id, chat_type)
+        self.message_id = FakeMessage._next_id
+        self.date = datetime.datetime.now()
+        FakeMessage._next_id += 1
+
+    def is_command(self) -> bool:
+        return self.text.startswith("/")
+
+    def get_command(self) -> str:
+        return self.text.split()[0] if self.is_command() else None
+
+    def get_args(self) -> str:
+        parts = self.text.split(maxsplit=1)
+        return parts[1] if self.is_command() and len(parts) > 1 else ""
+
+    async def answer(self, text, **kwargs):
+        await self.bot.send_message(self.chat.id, text)
+        return self
+
+    async def reply(self, text, **kwargs):
+        await self.bot.send_message(self.chat.id, text)
+        return self
+
+# --- сценарии ---
+
+def build_cases(now: datetime.datetime):
+    import handlers
+    import reports
+    from database import db_write_batch, db_fetch_all
+
+    bot = FakeBot()
+    rng = random.Random(7)
+    today = now.date()
+    month_start = today.replace(day=1)
+    prev_month = (month_start - datetime.timedelta(days=1)).replace(day=1)
+
+    async def write_batch():
+        user_id = rng.randint(1, USERS)
+        stamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        message_id = FakeMessage._next_id
+        FakeMessage._next_id += 1
+        rows = [(_scooter_number(rng, "Яндекс"), "Яндекс", user_id, f"courier{user_id}", f"Курьер {user_id}", stamp, CHATS[0], message_id, index) for index in range(10)]
+        await db_write_batch(rows)
+
+    async def today_stats():
+        await handlers.today_stats_handler(FakeMessage(bot, "/today_stats"))
+
+    def service_report(days: int):
+        async def case():
+            start = today - datetime.timedelta(days=days - 1)
+            await handlers.service_report_handler(FakeMessage(bot, f"/service_report {start.isoformat()} {today.isoformat()}"))
+        return case
+
+    async def monthly_report():
+        await handlers.monthly_report_handler(FakeMessage(bot, f"/monthly_report {prev_month.month:02d} {prev_month.year}"))
+
+    async def find_scooter():
+        row = await db_fetch_all("SELECT scooter_number FROM accepted_scooters ORDER BY id DESC LIMIT 1")
+        await handlers.find_scooter_handler(FakeMessage(bot, f"/find_scooter {row[0][0]}"))
+
+    async def create_excel():
+        start_time, end_time, _ = handlers.get_shift_time_range()
+        records = await db_fetch_all(
+            "SELECT id, scooter_number, service, accepted_by_user_id, accepted_by_username, accepted_by_fullname, timestamp, chat_id FROM accepted_scooters WHERE timestamp >= ? AND timestamp < ?",
+            (start_time.strftime("%Y-%m-%d %H:%M:%S"), end_time.strftime("%Y-%m-%d %H:%M:%S"))
+        )
+        report = reports.create_excel_report(records)
+        if hasattr(report, "close"):
+            report.close()
+
+    async def scheduled_report():
+        await reports.send_scheduled_report("morning", bot)
+
+    return bot, [
+        ("db_write_batch", write_batch),
+        ("today_stats_handler", today_stats),
+        ("service_report_30d", service_report(30)),
+        ("service_report_90d", service_report(90)),
+        ("service_report_365d", service_report(365)),
+        ("monthly_report_handler", monthly_report),
+        ("find_scooter_handler", find_scooter),
+        ("create_excel_report", create_excel),
+        ("send_scheduled_report", scheduled_report),
+    ]
+
+async def run_cases(cases, repeat: int, only: set) -> dict:
+    import profiling
+
+    results = {}
+    for name, case in cases:
+        if only and name not in only:
+            continue
+        times = []
+        peak_rss = 0
+        queries_before = sum(profiling.query_calls.values())
+        for _ in range(repeat):
+            with RSSSampler() as sampler:
+                started = time.perf_counter()
+                await case()
+                times.append(time.perf_counter() - started)
+            peak_rss = max(peak_rss, sampler.peak)
+        queries = (sum(profiling.query_calls.values()) - queries_before) / repeat
+        results[name] = {
+            "wall_ms_median": round(statistics.median(times) * 1000, 2),
+            "wall_ms_min": round(min(times) * 1000, 2),
+            "peak_rss_mb": round(peak_rss / 1024 / 1024, 1),
+            "queries": queries,
+        }
+        print(f"  {name:<26} {results[name]['wall_ms_median']:>10.1f} мс  {results[name]['peak_rss_mb']:>7.1f} MB  {queries:>5.0f} запросов", flush=True)
+    return results
+
+def run_size(size: int, args) -> dict:
+    """
+    Прогон в отдельном процессе на каждый объем: модули бота читают DB_NAME при импорте.
+    """
+    command = [sys.executable, __file__, "--worker", str(size), "--repeat", str(args.repeat), "--days", str(args.days)]
+    if args.only:
+        command += ["--only", args.only]
+    if args.reseed:
+        command.append("--reseed")
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+    for line in output.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+        print(line)
+    raise RuntimeError(f"Нет результата для {size} строк")
+
+def worker(size: int, args):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    db_path = os.path.join(DATA_DIR, f"seed_{size}.db")
+    now = datetime.datetime.now()
+    if args.reseed:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    configure_env(db_path)
+    sys.path.insert(0, REPO_DIR)
+
+    from database import init_db
+    seeded = os.path.exists(db_path)
+    asyncio.run(init_db())
+    if not seeded:
+        print(f"Заполняю {db_path}: {size} строк за {args.days} дн...", flush=True)
+        started = time.perf_counter()
+        seed_database(db_path, size, args.days, now)
+        print(f"  готово за {time.perf_counter() - started:.1f} с", flush=True)
+
+    async def run():
+        _, cases = build_cases(now)
+        return await run_cases(cases, args.repeat, set(args.only.split(",")) if args.only else set())
+
+    print(f"== {size} строк ==", flush=True)
+    results = asyncio.run(run())
+    print("RESULT " + json.dumps({
+        "rows": size,
+        "db_bytes": os.path.getsize(db_path),
+        "cases": results,
+    }))
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, check=True, stdout=subprocess.PIPE, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(current: dict, previous_path: str):
+    with open(previous_path, encoding="utf-8") as f:
+        previous = json.load(f)
+    print(f"\nСравнение с {previous_path} ({previous.get('revision')}):")
+    for size, data in current["sizes"].items():
+        old_cases = previous.get("sizes", {}).get(size, {}).get("cases", {})
+        for name, case in data["cases"].items():
+            old = old_cases.get(name)
+            if not old or not old["wall_ms_median"]:
+                continue
+            ratio = case["wall_ms_median"] / old["wall_ms_median"]
+            mark = "⚠️" if ratio > 1.2 else ("✅" if ratio < 0.8 else "  ")
+            print(f"{mark} {size:>9} {name:<26} {old['wall_ms_median']:>10.1f} → {case['wall_ms_median']:>10.1f} мс (x{ratio:.2f})")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки горячих путей бота")
+    parser.add_argument("--sizes", default="100k,1M,10M")
+    parser.add_argument("--days", type=int, default=400, help="за сколько дней распределить строки")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", default="", help="список сценариев через запятую")
+    parser.add_argument("--reseed", action="store_true", help="пересоздать базы с данными")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--output", help="куда сохранить JSON (по умолчанию bench_results/<ревизия>.json)")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        worker(args.worker, args)
+        return
+
+    revision = git_revision()
+    current = {
+        "revision": revision,
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "sizes": {},
+    }
+    for size_text in args.sizes.split(","):
+        size = parse_size(size_text)
+        current["sizes"][str(size)] = run_size(size, args)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = args.output or os.path.join(RESULTS_DIR, f"{revision}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(current, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены в {output}")
+
+    if args.compare:
+        compare(current, args.compare)
+
+if __name__ == "__main__":
+    main()
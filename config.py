@@ -2,8 +2,10 @@
 import os
 import re
 import logging
+import datetime
 from typing import Set
 from dotenv import load_dotenv
+from logs import setup_logging
 import pytz
 
 AdminIds = Set[int]
@@ -21,10 +23,8 @@ class Config:
         self.ALLOWED_CHAT_IDS = {int(x.strip()) for x in os.getenv('ALLOWED_CHAT_IDS', '').split(',') if x.strip()} or set()
         self.REPORT_CHAT_IDS = {int(x.strip()) for x in os.getenv('REPORT_CHAT_IDS', '').split(',') if x.strip()} or set()
 
-        if not self.ADMIN_IDS:
-            logging.warning("⚠️ ADMIN_IDS не заданы — команды администратора будут недоступны!")
-        if not self.ALLOWED_CHAT_IDS:
-            logging.warning("⚠️ ALLOWED_CHAT_IDS не заданы — бот не будет реагировать в группах!")
+        # Адрес Bot API (например, локальный сервер нагрузочного теста); пусто — api.telegram.org
+        self.TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '').rstrip('/')
 
         self.DB_NAME = os.getenv('DB_NAME', 'scooters.db')
         timezone_name = os.getenv('TIMEZONE', 'Asia/Almaty')
@@ -33,6 +33,123 @@ class Config:
         except pytz.exceptions.UnknownTimeZoneError:
             raise ValueError(f"Неизвестная таймзона: {timezone_name}")
 
+        # Смены: имя=начало-конец; конец раньше начала — смена переходит через полночь
+        self.SHIFTS = []
+        for part in os.getenv('SHIFTS', 'morning=07:00-15:00,evening=15:00-04:00').split(','):
+            try:
+                name, bounds = part.split('=')
+                start_str, end_str = bounds.split('-')
+                self.SHIFTS.append((name.strip(), datetime.time.fromisoformat(start_str.strip()), datetime.time.fromisoformat(end_str.strip())))
+            except ValueError:
+                raise ValueError(f"Некорректное описание смены в SHIFTS: {part}")
+
+        # Время отчетов за смену: смена=ЧЧ:ММ[:СС]; смена, которой нет в списке, не отправляется
+        self.REPORT_SCHEDULE = {}
+        for part in os.getenv('REPORT_SCHEDULE', 'morning=15:00,evening=23:00').split(','):
+            try:
+                name, at = part.split('=')
+                self.REPORT_SCHEDULE[name.strip()] = datetime.time.fromisoformat(at.strip())
+            except ValueError:
+                raise ValueError(f"Некорректное время отчета в REPORT_SCHEDULE: {part}")
+
+        # Охват отчетных чатов: отчетный_чат=группа|группа,...; в отчет попадают строки только
+        # из перечисленных групп. Чат, которого нет в списке, получает строки всех групп
+        self.REPORT_SCOPES = {}
+        for part in os.getenv('REPORT_SCOPES', '').split(','):
+            if not part.strip():
+                continue
+            try:
+                chat_id, sources = part.split('=')
+                self.REPORT_SCOPES[int(chat_id)] = frozenset(int(x) for x in sources.split('|') if x.strip())
+            except ValueError:
+                raise ValueError(f"Некорректный охват отчета в REPORT_SCOPES: {part}")
+
+        # Профилирование: порог медленного запроса и размер буфера замеров
+        self.SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', '500'))
+        self.PERF_SAMPLES = int(os.getenv('PERF_SAMPLES', '50000'))
+
+        # Эндпоинт /metrics для Prometheus (0 — выключен)
+        self.METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+        self.METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+        # Контроль event loop: порог зависания и период замера
+        self.LOOP_LAG_THRESHOLD_MS = int(os.getenv('LOOP_LAG_THRESHOLD_MS', '200'))
+        self.LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.25'))
+
+        # Выгрузки: лимит документа Bot API (50 МБ; у локального сервера Bot API — до 2000 МБ),
+        # порог буфера в памяти до сброса на диск, процессы для сборки книг и размер пачки строк
+        self.TELEGRAM_UPLOAD_LIMIT_MB = int(os.getenv('TELEGRAM_UPLOAD_LIMIT_MB', '50'))
+        self.EXPORT_PART_BYTES = self.TELEGRAM_UPLOAD_LIMIT_MB * 1024 * 1024 - 512 * 1024
+        self.SPOOL_MAX_BYTES = int(os.getenv('SPOOL_MAX_BYTES', str(8 * 1024 * 1024)))
+        self.EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', str(min(4, os.cpu_count() or 1))))
+        self.EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '5000'))
+        # Сколько отчетов может собираться одновременно (ограничивает пики памяти)
+        self.REPORT_BUILD_CONCURRENCY = int(os.getenv('REPORT_BUILD_CONCURRENCY', '2'))
+
+        # Период дочитывания строк для отчетов за смену (секунды)
+        self.REPORT_REFRESH_SECONDS = int(os.getenv('REPORT_REFRESH_SECONDS', '60'))
+
+        # Архивы закрытых месяцев: каталог файлов scooters_YYYY_MM.db и сколько дней
+        # после конца месяца он еще остается в основной базе
+        self.ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+        self.ARCHIVE_GRACE_DAYS = int(os.getenv('ARCHIVE_GRACE_DAYS', '3'))
+
+        # Онлайн-бэкап SQLite: каталог снимков, сколько хранить, период (часы, 0 — только /backup_now),
+        # размер порции страниц и пауза между порциями, чтобы не мешать записи
+        self.BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+        self.BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '7'))
+        self.BACKUP_INTERVAL_HOURS = float(os.getenv('BACKUP_INTERVAL_HOURS', '6'))
+        self.BACKUP_PAGES_PER_STEP = int(os.getenv('BACKUP_PAGES_PER_STEP', '1024'))
+        self.BACKUP_STEP_SLEEP = float(os.getenv('BACKUP_STEP_SLEEP', '0.05'))
+
+        # Хранение: строки старше RETENTION_DAYS дней сворачиваются в дневную сводку
+        # (0 — хранить все); компакция освобождает место порциями страниц в пределах бюджета времени
+        self.RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', '0'))
+        if 0 < self.RETENTION_DAYS < 2:
+            raise ValueError("RETENTION_DAYS должен быть 0 или не меньше 2: текущая смена хранится построчно")
+        self.VACUUM_PAGES_PER_STEP = int(os.getenv('VACUUM_PAGES_PER_STEP', '256'))
+        self.COMPACTION_BUDGET_SECONDS = float(os.getenv('COMPACTION_BUDGET_SECONDS', '30'))
+
+        # Несколько процессов: апдейты через вебхук за балансировщиком (пусто — polling),
+        # задачи планировщика выполняет только лидер, выбранный advisory lock в PostgreSQL
+        self.WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+        self.WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+        self.WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+        self.WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', '8080'))
+        self.LEADER_LOCK_KEY = int(os.getenv('LEADER_LOCK_KEY', '720115'))
+        self.LEADER_POLL_SECONDS = float(os.getenv('LEADER_POLL_SECONDS', '5'))
+
+        # Импорт файлов: строк в одной транзакции и предел размера (getFile Bot API отдает до 20 МБ)
+        self.IMPORT_CHUNK_ROWS = int(os.getenv('IMPORT_CHUNK_ROWS', '5000'))
+        self.IMPORT_MAX_BYTES = int(os.getenv('IMPORT_MAX_BYTES', str(20 * 1024 * 1024)))
+
+        # Сколько последних update_id помнить, чтобы повторная доставка апдейта не обрабатывалась
+        self.RECENT_UPDATES_CACHE = int(os.getenv('RECENT_UPDATES_CACHE', '10000'))
+
+        # /my_stats: сколько секунд живут итоги курьера в кэше и как часто бот отвечает одному курьеру
+        self.MY_STATS_TTL = float(os.getenv('MY_STATS_TTL', '60'))
+        self.MY_STATS_INTERVAL = float(os.getenv('MY_STATS_INTERVAL', '30'))
+
+        # Таблица лидеров смены: группы, где она закреплена (пусто — выключена), сколько курьеров
+        # показывать, как часто обновлять сообщение и перечитывать итоги из базы (секунды)
+        self.LEADERBOARD_CHAT_IDS = {int(x.strip()) for x in os.getenv('LEADERBOARD_CHAT_IDS', '').split(',') if x.strip()}
+        self.LEADERBOARD_TOP = int(os.getenv('LEADERBOARD_TOP', '10'))
+        self.LEADERBOARD_INTERVAL = float(os.getenv('LEADERBOARD_INTERVAL', '5'))
+        self.LEADERBOARD_RESYNC_SECONDS = float(os.getenv('LEADERBOARD_RESYNC_SECONDS', '60'))
+
+        # Быстрый старт: миграция и регистрация команд идут в фоне, polling начинается сразу
+        self.FAST_STARTUP = os.getenv('FAST_STARTUP', '1') != '0'
+
+        # Логи: файл с ротацией по размеру и времени, формат text или json,
+        # окно дедупликации повторяющихся сетевых ошибок
+        self.LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+        self.LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+        self.LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+        self.LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+        self.LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '10'))
+        self.LOG_ROTATE_HOURS = float(os.getenv('LOG_ROTATE_HOURS', '24'))
+        self.LOG_DEDUP_WINDOW = float(os.getenv('LOG_DEDUP_WINDOW', '60'))
+
         self.YANDEX_SCOOTER_PATTERN = re.compile(r'\b(\d{8})\b')
         self.WOOSH_SCOOTER_PATTERN = re.compile(r'\b([A-ZА-Я]{2}\d{4})\b', re.IGNORECASE)
         self.JET_SCOOTER_PATTERN = re.compile(r'\b(\d{6}|\d{3}-\d{3})\b')
@@ -46,22 +163,79 @@ class Config:
             "bolt": "Bolt", "болт": "Bolt", "b": "Bolt"
         }
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
+config = Config()
+
+setup_logging(
+    config.LOG_FILE,
+    level=config.LOG_LEVEL,
+    json_format=config.LOG_FORMAT == 'json',
+    max_bytes=config.LOG_MAX_BYTES,
+    backup_count=config.LOG_BACKUP_COUNT,
+    rotate_hours=config.LOG_ROTATE_HOURS,
+    dedup_window=config.LOG_DEDUP_WINDOW,
 )
 
-config = Config()
+if not config.ADMIN_IDS:
+    logging.warning("⚠️ ADMIN_IDS не заданы — команды администратора будут недоступны!")
+if not config.ALLOWED_CHAT_IDS:
+    logging.warning("⚠️ ALLOWED_CHAT_IDS не заданы — бот не будет реагировать в группах!")
+
 BOT_TOKEN = config.BOT_TOKEN
 ADMIN_IDS = config.ADMIN_IDS
 ALLOWED_CHAT_IDS = config.ALLOWED_CHAT_IDS
 REPORT_CHAT_IDS = config.REPORT_CHAT_IDS
+TELEGRAM_API_URL = config.TELEGRAM_API_URL
 DB_NAME = config.DB_NAME
 TIMEZONE = config.TIMEZONE
+SHIFTS = config.SHIFTS
+REPORT_SCHEDULE = config.REPORT_SCHEDULE
+REPORT_SCOPES = config.REPORT_SCOPES
+SLOW_QUERY_MS = config.SLOW_QUERY_MS
+PERF_SAMPLES = config.PERF_SAMPLES
+METRICS_HOST = config.METRICS_HOST
+METRICS_PORT = config.METRICS_PORT
+LOOP_LAG_THRESHOLD_MS = config.LOOP_LAG_THRESHOLD_MS
+LOOP_LAG_INTERVAL = config.LOOP_LAG_INTERVAL
+TELEGRAM_UPLOAD_LIMIT_MB = config.TELEGRAM_UPLOAD_LIMIT_MB
+EXPORT_PART_BYTES = config.EXPORT_PART_BYTES
+SPOOL_MAX_BYTES = config.SPOOL_MAX_BYTES
+EXPORT_WORKERS = config.EXPORT_WORKERS
+EXPORT_CHUNK_ROWS = config.EXPORT_CHUNK_ROWS
+REPORT_BUILD_CONCURRENCY = config.REPORT_BUILD_CONCURRENCY
+REPORT_REFRESH_SECONDS = config.REPORT_REFRESH_SECONDS
+ARCHIVE_DIR = config.ARCHIVE_DIR
+ARCHIVE_GRACE_DAYS = config.ARCHIVE_GRACE_DAYS
+BACKUP_DIR = config.BACKUP_DIR
+BACKUP_KEEP = config.BACKUP_KEEP
+BACKUP_INTERVAL_HOURS = config.BACKUP_INTERVAL_HOURS
+BACKUP_PAGES_PER_STEP = config.BACKUP_PAGES_PER_STEP
+BACKUP_STEP_SLEEP = config.BACKUP_STEP_SLEEP
+RETENTION_DAYS = config.RETENTION_DAYS
+VACUUM_PAGES_PER_STEP = config.VACUUM_PAGES_PER_STEP
+COMPACTION_BUDGET_SECONDS = config.COMPACTION_BUDGET_SECONDS
+WEBHOOK_URL = config.WEBHOOK_URL
+WEBHOOK_PATH = config.WEBHOOK_PATH
+WEBAPP_HOST = config.WEBAPP_HOST
+WEBAPP_PORT = config.WEBAPP_PORT
+LEADER_LOCK_KEY = config.LEADER_LOCK_KEY
+LEADER_POLL_SECONDS = config.LEADER_POLL_SECONDS
+IMPORT_CHUNK_ROWS = config.IMPORT_CHUNK_ROWS
+IMPORT_MAX_BYTES = config.IMPORT_MAX_BYTES
+RECENT_UPDATES_CACHE = config.RECENT_UPDATES_CACHE
+MY_STATS_TTL = config.MY_STATS_TTL
+MY_STATS_INTERVAL = config.MY_STATS_INTERVAL
+LEADERBOARD_CHAT_IDS = config.LEADERBOARD_CHAT_IDS
+LEADERBOARD_TOP = config.LEADERBOARD_TOP
+LEADERBOARD_INTERVAL = config.LEADERBOARD_INTERVAL
+LEADERBOARD_RESYNC_SECONDS = config.LEADERBOARD_RESYNC_SECONDS
+FAST_STARTUP = config.FAST_STARTUP
+LOG_FILE = config.LOG_FILE
+LOG_LEVEL = config.LOG_LEVEL
+LOG_FORMAT = config.LOG_FORMAT
+LOG_MAX_BYTES = config.LOG_MAX_BYTES
+LOG_BACKUP_COUNT = config.LOG_BACKUP_COUNT
+LOG_ROTATE_HOURS = config.LOG_ROTATE_HOURS
+LOG_DEDUP_WINDOW = config.LOG_DEDUP_WINDOW
 YANDEX_SCOOTER_PATTERN = config.YANDEX_SCOOTER_PATTERN
 WOOSH_SCOOTER_PATTERN = config.WOOSH_SCOOTER_PATTERN
 JET_SCOOTER_PATTERN = config.JET_SCOOTER_PATTERN
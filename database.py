@@ -1,45 +1,815 @@
 import aiosqlite
-from config import DB_NAME
+from config import DB_NAME, SHIFTS, ARCHIVE_DIR, ARCHIVE_GRACE_DAYS, RETENTION_DAYS, VACUUM_PAGES_PER_STEP, COMPACTION_BUDGET_SECONDS
+from profiling import query_timer
+from metrics import DB_WRITE_BATCH_SIZE, ROWS_ROLLED_UP, STORAGE_RECLAIMED_BYTES, WAL_CHECKPOINT_PAGES, WAL_CHECKPOINT_BUSY
+from shifts import sql_shift_columns
+import asyncio
+import datetime
+import logging
+import os
+import pathlib
+import re
+import sqlite3
+import time
+
+SQL_DIALECT = "sqlite"
+
+# Время в базе хранится строкой в локальной таймзоне бота
+LOCAL_TS = "timestamp"
+
+ACCEPTED_SCOOTERS_DDL = '''
+    CREATE TABLE IF NOT EXISTS {schema}accepted_scooters (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        scooter_number TEXT NOT NULL,
+        service TEXT NOT NULL,
+        accepted_by_user_id INTEGER NOT NULL,
+        accepted_by_username TEXT,
+        accepted_by_fullname TEXT NOT NULL,
+        timestamp DATETIME NOT NULL,
+        chat_id INTEGER NOT NULL,
+        message_id INTEGER,
+        item_index INTEGER,
+        UNIQUE(scooter_number, accepted_by_user_id, timestamp)
+    )
+'''
+
+# Столбцы, которые есть во всех архивах, в том числе созданных до message_id/item_index
+HISTORY_COLUMNS = "id, scooter_number, service, accepted_by_user_id, accepted_by_username, accepted_by_fullname, timestamp, chat_id"
+
+ACCEPTED_SCOOTERS_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS {schema}idx_timestamp ON accepted_scooters (timestamp);",
+    "CREATE INDEX IF NOT EXISTS {schema}idx_scooter ON accepted_scooters (scooter_number);",
+    "CREATE INDEX IF NOT EXISTS {schema}idx_user_service ON accepted_scooters (accepted_by_user_id, service);",
+    # Повторно доставленное или обработанное сообщение не добавляет строк; у старых строк message_id пуст
+    "CREATE UNIQUE INDEX IF NOT EXISTS {schema}idx_message_item ON accepted_scooters (chat_id, message_id, item_index);",
+)
 
 async def init_db():
     async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS accepted_scooters (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                scooter_number TEXT NOT NULL,
-                service TEXT NOT NULL,
-                accepted_by_user_id INTEGER NOT NULL,
-                accepted_by_username TEXT,
-                accepted_by_fullname TEXT NOT NULL,
-                timestamp DATETIME NOT NULL,
-                chat_id INTEGER NOT NULL,
-                UNIQUE(scooter_number, accepted_by_user_id, timestamp)
-            )
-        ''')
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON accepted_scooters (timestamp);")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_scooter ON accepted_scooters (scooter_number);")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_user_service ON accepted_scooters (accepted_by_user_id, service);")
+        # Действует только на новую базу; существующую переводит compact_storage
+        await db.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        await db.execute(ACCEPTED_SCOOTERS_DDL.format(schema=""))
+        await db.commit()
+        await apply_migrations()
+        for statement in ACCEPTED_SCOOTERS_INDEXES:
+            await db.execute(statement.format(schema=""))
+        await db.execute(ACCEPTED_DAILY_SUMMARY_DDL)
+        await db.execute(ACCEPTED_ROLLUPS_DDL)
+        await db.execute(REPORT_DELIVERIES_DDL)
+        await db.execute(LEADERBOARD_MESSAGES_DDL)
+        for statement in SERVICE_REPORT_CACHE_DDL:
+            await db.execute(statement)
+        # Триггеры пересоздаются при каждом старте: выражение смены зависит от SHIFTS
+        for statement in _service_report_triggers():
+            await db.execute(statement)
         await db.commit()
 
-async def db_execute(query: str, params: tuple = ()) -> int:
+async def background_init():
+    """
+    Инициализация, без которой бот может принимать сообщения: запускается после старта polling.
+    """
     async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA journal_mode=WAL;")
-        cursor = await db.execute(query, params)
+        await db.execute("PRAGMA optimize;")
+
+# --- Миграции ---
+# Примененные миграции записываются в schema_migrations; каждая выполняется один раз,
+# в одной транзакции со своей отметкой.
+
+SCHEMA_MIGRATIONS_DDL = '''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version TEXT PRIMARY KEY,
+        applied_at DATETIME NOT NULL
+    )
+'''
+
+# Строки, записанные до ключа по сообщению, считаются повтором, если тот же курьер отправил
+# тот же номер в тот же чат не позже чем через столько секунд после первой записи
+DEDUPE_WINDOW_SECONDS = 600
+# Удаленные миграцией повторы сохраняются сюда: удаление можно проверить и откатить вручную
+DEDUPE_BACKUP_TABLE = "accepted_scooters_dedupe_0001"
+
+def _add_message_columns(conn, schema: str):
+    columns = {row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(accepted_scooters)")}
+    for column in ("message_id", "item_index"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {schema}.accepted_scooters ADD COLUMN {column} INTEGER")
+
+def _repeated_rows(rows) -> list:
+    """
+    rows — (id, номер, пользователь, чат, время) по группам (номер, пользователь, чат)
+    и по времени внутри группы. Повтор — строка не позже чем через DEDUPE_WINDOW_SECONDS
+    после первой оставшейся строки группы; строка за окном остается и сама становится
+    первой для следующих. Сравнение только с соседней строкой удалило бы цепочку записей
+    с шагом меньше окна целиком, кроме первой.
+    """
+    window = datetime.timedelta(seconds=DEDUPE_WINDOW_SECONDS)
+    repeated = []
+    group = anchor = None
+    for row_id, number, user_id, chat_id, timestamp in rows:
+        if (number, user_id, chat_id) != group or timestamp > anchor + window:
+            group, anchor = (number, user_id, chat_id), timestamp
+        else:
+            repeated.append(row_id)
+    return repeated
+
+def _migrate_message_identity(conn) -> str:
+    """
+    Столбцы message_id/item_index и удаление повторов, записанных при переотправке апдейтов
+    (раньше время записи бралось в момент обработки, и повтор проходил мимо UNIQUE).
+    Номера пакетного приема уникальны сами по себе, по ним повтор не распознать.
+    Архивы закрытых месяцев доступны только на чтение и не меняются.
+    """
+    _add_message_columns(conn, "main")
+    # Кандидаты — строки, у которых в группе есть соседняя запись ближе окна; одиночные
+    # строки остаются в любом случае и на выбор первой строки группы не влияют
+    candidates = conn.execute(f'''
+        SELECT id, scooter_number, accepted_by_user_id, chat_id, timestamp FROM (
+            SELECT id, scooter_number, accepted_by_user_id, chat_id, timestamp,
+                   LAG(timestamp) OVER w AS previous_ts, LEAD(timestamp) OVER w AS next_ts
+            FROM main.accepted_scooters
+            WHERE scooter_number NOT LIKE '%\\_BATCH\\_%' ESCAPE '\\'
+            WINDOW w AS (PARTITION BY scooter_number, accepted_by_user_id, chat_id ORDER BY timestamp, id)
+        )
+        WHERE strftime('%s', timestamp) - strftime('%s', previous_ts) <= {DEDUPE_WINDOW_SECONDS}
+           OR strftime('%s', next_ts) - strftime('%s', timestamp) <= {DEDUPE_WINDOW_SECONDS}
+        ORDER BY scooter_number, accepted_by_user_id, chat_id, timestamp, id
+    ''').fetchall()
+    repeated = _repeated_rows(
+        (row_id, number, user_id, chat_id, datetime.datetime.fromisoformat(timestamp))
+        for row_id, number, user_id, chat_id, timestamp in candidates
+    )
+    if not repeated:
+        return "удалено повторов: 0"
+    conn.execute(f"CREATE TABLE IF NOT EXISTS main.{DEDUPE_BACKUP_TABLE} AS SELECT * FROM main.accepted_scooters WHERE 0")
+    conn.executemany(f"INSERT INTO main.{DEDUPE_BACKUP_TABLE} SELECT * FROM main.accepted_scooters WHERE id = ?", ((row_id,) for row_id in repeated))
+    conn.executemany("DELETE FROM main.accepted_scooters WHERE id = ?", ((row_id,) for row_id in repeated))
+    logging.info(f"🔧 Повторы до ключа по сообщению, id: {', '.join(map(str, repeated))}")
+    return f"удалено повторов: {len(repeated)}, строки сохранены в {DEDUPE_BACKUP_TABLE}"
+
+MIGRATIONS = (
+    ("0001_message_identity", _migrate_message_identity),
+)
+
+def _apply_migrations_sync() -> list[str]:
+    applied = []
+    conn = sqlite3.connect(DB_NAME, isolation_level=None)
+    try:
+        conn.execute("PRAGMA busy_timeout=30000;")
+        conn.execute(SCHEMA_MIGRATIONS_DDL)
+        for version, migrate in MIGRATIONS:
+            conn.execute("BEGIN IMMEDIATE;")
+            try:
+                if conn.execute("SELECT 1 FROM schema_migrations WHERE version = ?", (version,)).fetchone() is None:
+                    outcome = migrate(conn)
+                    conn.execute(
+                        "INSERT INTO schema_migrations (version, applied_at) VALUES (?, datetime('now', 'localtime'))",
+                        (version,)
+                    )
+                    applied.append(version)
+                    logging.info(f"🔧 Миграция {version}: {outcome}")
+                conn.execute("COMMIT;")
+            except Exception:
+                conn.execute("ROLLBACK;")
+                raise
+    finally:
+        conn.close()
+    return applied
+
+async def apply_migrations() -> list[str]:
+    """
+    Применяет недостающие миграции. Выполняется в потоке отдельным соединением:
+    удаление повторов в большой базе не должно держать event loop.
+    """
+    with query_timer("apply_migrations", "schema_migrations", ()):
+        return await asyncio.to_thread(_apply_migrations_sync)
+
+# --- Архивы закрытых месяцев ---
+# Закрытые месяцы переносятся из основной базы в отдельные файлы ARCHIVE_DIR/scooters_YYYY_MM.db
+# (только чтение), в основной базе остается горячая часть: текущий месяц и хвост прошлого.
+# Запросу, которому нужны старые месяцы, архивы подключаются через ATTACH, а TEMP VIEW
+# с именем accepted_scooters перекрывает основную таблицу на время соединения.
+
+# SQLite по умолчанию позволяет подключить к соединению не больше 10 баз
+MAX_ATTACHED_ARCHIVES = 9
+
+_ARCHIVE_NAME = re.compile(r"^scooters_(\d{4})_(\d{2})\.db$")
+_archive_cache = (None, [])
+
+def _month_bounds(month: datetime.date) -> tuple[str, str]:
+    next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+    return f"{month.isoformat()} 00:00:00", f"{next_month.isoformat()} 00:00:00"
+
+def archive_path(month: datetime.date) -> str:
+    return os.path.join(ARCHIVE_DIR, f"scooters_{month.year:04d}_{month.month:02d}.db")
+
+def archived_months() -> list[tuple[datetime.date, str]]:
+    """
+    Архивы в ARCHIVE_DIR по возрастанию месяца. Список перечитывается только при изменении
+    каталога, поэтому месяц отключается простым переносом его файла из каталога.
+    """
+    global _archive_cache
+    try:
+        mtime = os.stat(ARCHIVE_DIR).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    if _archive_cache[0] != mtime:
+        archives = []
+        for name in os.listdir(ARCHIVE_DIR):
+            match = _ARCHIVE_NAME.match(name)
+            if match:
+                month = datetime.date(int(match.group(1)), int(match.group(2)), 1)
+                archives.append((month, os.path.join(ARCHIVE_DIR, name)))
+        _archive_cache = (mtime, sorted(archives))
+    return _archive_cache[1]
+
+def _ts(value) -> str:
+    return value.strftime("%Y-%m-%d %H:%M:%S") if isinstance(value, datetime.datetime) else str(value)
+
+def _archives_for(period) -> list[tuple[datetime.date, str]]:
+    archives = archived_months()
+    if period is None:
+        return archives
+    start, end = _ts(period[0]), _ts(period[1])
+    result = []
+    for month, path in archives:
+        month_start, month_end = _month_bounds(month)
+        if month_start <= end and month_end > start:
+            result.append((month, path))
+    return result
+
+def _readonly_uri(path: str) -> str:
+    return pathlib.Path(path).resolve().as_uri() + "?mode=ro"
+
+async def _attach_history(db, period):
+    """
+    Подключает архивы, пересекающиеся с period (None — все). До MAX_ATTACHED_ARCHIVES
+    архивов — TEMP VIEW с UNION ALL; больше — строки за период копируются
+    во временную таблицу, архивы подключаются группами.
+    """
+    archives = _archives_for(period)
+    if not archives:
+        return
+    if len(archives) <= MAX_ATTACHED_ARCHIVES:
+        for index, (_, path) in enumerate(archives):
+            await db.execute(f"ATTACH DATABASE ? AS arch{index}", (_readonly_uri(path),))
+        union = " UNION ALL ".join(
+            [f"SELECT {HISTORY_COLUMNS} FROM main.accepted_scooters"]
+            + [f"SELECT {HISTORY_COLUMNS} FROM arch{index}.accepted_scooters" for index in range(len(archives))]
+        )
+        await db.execute(f"CREATE TEMP VIEW accepted_scooters AS {union}")
+        return
+
+    where, params = "", ()
+    if period is not None:
+        where, params = " WHERE timestamp >= ? AND timestamp <= ?", (_ts(period[0]), _ts(period[1]))
+    await db.execute(f"CREATE TEMP TABLE accepted_scooters AS SELECT {HISTORY_COLUMNS} FROM main.accepted_scooters{where}", params)
+    for group_start in range(0, len(archives), MAX_ATTACHED_ARCHIVES):
+        group = archives[group_start:group_start + MAX_ATTACHED_ARCHIVES]
+        for index, (_, path) in enumerate(group):
+            await db.execute(f"ATTACH DATABASE ? AS arch{index}", (_readonly_uri(path),))
+        for index in range(len(group)):
+            await db.execute(f"INSERT INTO temp.accepted_scooters SELECT {HISTORY_COLUMNS} FROM arch{index}.accepted_scooters{where}", params)
+        # DETACH невозможен внутри открытой транзакции
         await db.commit()
-        return cursor.rowcount
+        for index in range(len(group)):
+            await db.execute(f"DETACH DATABASE arch{index}")
 
-async def db_fetch_all(query: str, params: tuple = ()) -> list:
-    async with aiosqlite.connect(DB_NAME) as db:
+def _archived_matches_sync(query: str, params: tuple) -> list[tuple[datetime.date, int]]:
+    matches = []
+    for month, path in archived_months():
+        conn = sqlite3.connect(_readonly_uri(path), uri=True)
+        try:
+            count = conn.execute(query, params).fetchone()[0]
+        finally:
+            conn.close()
+        if count:
+            matches.append((month, count))
+    return matches
+
+async def archived_matches(where: str, params: tuple) -> list[tuple[datetime.date, int]]:
+    """
+    Сколько строк accepted_scooters, подходящих под условие where, лежит в каждом архиве:
+    [(месяц, количество), ...]. Архивы доступны только на чтение, такие строки не изменить.
+    """
+    return await asyncio.to_thread(_archived_matches_sync, f"SELECT COUNT(*) FROM accepted_scooters WHERE {where}", params)
+
+def _archive_month_sync(month: datetime.date) -> int:
+    """
+    Переносит месяц в архив: копия, сверка по id, удаление из основной базы, затем VACUUM
+    архива и права только на чтение. Если процесс упадет между коммитами двух файлов,
+    следующий запуск допишет архив (INSERT OR IGNORE) и доудалит строки.
+    """
+    start, end = _month_bounds(month)
+    path = archive_path(month)
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    if os.path.exists(path):
+        os.chmod(path, 0o644)
+
+    conn = sqlite3.connect(DB_NAME, isolation_level=None)
+    try:
+        conn.execute("PRAGMA busy_timeout=30000;")
+        conn.execute("ATTACH DATABASE ? AS archive", (path,))
+        conn.execute(ACCEPTED_SCOOTERS_DDL.format(schema="archive."))
+        # Архив, начатый до появления message_id, дописывается с теми же столбцами, что и main
+        _add_message_columns(conn, "archive")
+        for statement in ACCEPTED_SCOOTERS_INDEXES:
+            conn.execute(statement.format(schema="archive."))
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            conn.execute(
+                f"INSERT OR IGNORE INTO archive.accepted_scooters ({HISTORY_COLUMNS}, message_id, item_index) "
+                f"SELECT {HISTORY_COLUMNS}, message_id, item_index FROM main.accepted_scooters WHERE timestamp >= ? AND timestamp < ?",
+                (start, end)
+            )
+            # Сверка по ключу UNIQUE: строка, уже лежащая в архиве под другим id (повтор,
+            # записанный задним числом), считается перенесенной и удаляется из основной базы
+            in_main, copied = conn.execute(
+                """
+                SELECT COUNT(*), COUNT(a.id)
+                FROM main.accepted_scooters m LEFT JOIN archive.accepted_scooters a
+                  ON a.scooter_number = m.scooter_number AND a.accepted_by_user_id = m.accepted_by_user_id AND a.timestamp = m.timestamp
+                WHERE m.timestamp >= ? AND m.timestamp < ?
+                """,
+                (start, end)
+            ).fetchone()
+            if copied != in_main:
+                raise RuntimeError(f"в архив {path} скопировано {copied} строк из {in_main}")
+            conn.execute("DELETE FROM main.accepted_scooters WHERE timestamp >= ? AND timestamp < ?", (start, end))
+            conn.execute("COMMIT;")
+        except Exception:
+            conn.execute("ROLLBACK;")
+            raise
+        conn.execute("DETACH DATABASE archive")
+    finally:
+        conn.close()
+
+    archive = sqlite3.connect(path, isolation_level=None)
+    try:
+        # Без WAL архив открывается с mode=ro и не оставляет -wal/-shm рядом с файлом
+        archive.execute("PRAGMA journal_mode=DELETE;")
+        archive.execute("VACUUM;")
+        archive.execute("ANALYZE;")
+    finally:
+        archive.close()
+    os.chmod(path, 0o444)
+    return in_main
+
+def _months_to_archive(today: datetime.date) -> list[datetime.date]:
+    # Месяц закрыт, когда после его конца прошло ARCHIVE_GRACE_DAYS дней: поздние записи успеют дойти
+    cutoff = (today - datetime.timedelta(days=ARCHIVE_GRACE_DAYS)).replace(day=1)
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        rows = conn.execute(
+            "SELECT DISTINCT substr(timestamp, 1, 7) FROM accepted_scooters WHERE timestamp < ?",
+            (f"{cutoff.isoformat()} 00:00:00",)
+        ).fetchall()
+    finally:
+        conn.close()
+    return sorted(datetime.date(int(value[:4]), int(value[5:7]), 1) for (value,) in rows)
+
+async def maintain_partitions(today: datetime.date = None) -> list[tuple[datetime.date, int]]:
+    """
+    Переносит закрытые месяцы в архивы. Запускается планировщиком в тихие часы.
+    """
+    today = today or datetime.date.today()
+    archived = []
+    for month in await asyncio.to_thread(_months_to_archive, today):
+        with query_timer("maintain_partitions", "archive month", (month.isoformat(),)):
+            moved = await asyncio.to_thread(_archive_month_sync, month)
+        archived.append((month, moved))
+        logging.info(f"🗄 {month.strftime('%Y-%m')} перенесен в архив {archive_path(month)}: {moved} строк")
+    return archived
+
+# --- Дневная сводка и компакция ---
+# Строки старше RETENTION_DAYS дней сворачиваются в accepted_daily_summary: одна строка
+# на (день, дата смены, смена, пользователь, сервис) с количеством. Отчеты за месяц и
+# по сервисам складывают построчные данные со сводкой, поэтому итоги не меняются.
+
+ACCEPTED_DAILY_SUMMARY_DDL = '''
+    CREATE TABLE IF NOT EXISTS accepted_daily_summary (
+        day DATE NOT NULL,
+        shift_date DATE NOT NULL,
+        shift TEXT NOT NULL,
+        accepted_by_user_id INTEGER NOT NULL,
+        accepted_by_username TEXT,
+        accepted_by_fullname TEXT NOT NULL,
+        service TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (day, shift_date, shift, accepted_by_user_id, service)
+    )
+'''
+
+# Свернутые архивы: отметка пишется в той же транзакции, что и сводка, поэтому
+# архив, не удаленный из-за сбоя, при следующем запуске не будет учтен дважды
+ACCEPTED_ROLLUPS_DDL = '''
+    CREATE TABLE IF NOT EXISTS accepted_rollups (
+        source TEXT PRIMARY KEY,
+        rows INTEGER NOT NULL,
+        rolled_at DATETIME NOT NULL
+    )
+'''
+
+def _rollup_rows(conn, schema: str, cutoff: str = None) -> int:
+    where, params = (" WHERE timestamp < ?", (cutoff,)) if cutoff else ("", ())
+    rows = conn.execute(f"SELECT COUNT(*) FROM {schema}.accepted_scooters{where}", params).fetchone()[0]
+    if not rows:
+        return 0
+    # Время вне смен попадает в сводку с пустым именем смены и датой смены, равной дню
+    shift_date_expr, shift_name_expr = sql_shift_columns("timestamp", SQL_DIALECT)
+    conn.execute(f'''
+        INSERT INTO main.accepted_daily_summary
+        (day, shift_date, shift, accepted_by_user_id, accepted_by_username, accepted_by_fullname, service, count)
+        SELECT date(timestamp) AS row_day, COALESCE({shift_date_expr}, date(timestamp)) AS row_shift_date,
+               COALESCE({shift_name_expr}, '') AS row_shift, accepted_by_user_id,
+               MAX(accepted_by_username), MAX(accepted_by_fullname), service, COUNT(*)
+        FROM {schema}.accepted_scooters{where}
+        GROUP BY row_day, row_shift_date, row_shift, accepted_by_user_id, service
+        ON CONFLICT (day, shift_date, shift, accepted_by_user_id, service) DO UPDATE SET
+            count = count + excluded.count,
+            accepted_by_username = COALESCE(excluded.accepted_by_username, accepted_by_username),
+            accepted_by_fullname = excluded.accepted_by_fullname
+    ''', params)
+    return rows
+
+def _rollup_sync(cutoff_day: datetime.date) -> int:
+    """
+    Сворачивает строки до cutoff_day: сначала архивы месяцев, целиком лежащих раньше
+    cutoff_day (файл архива после этого удаляется), затем хвост горячей части.
+    """
+    cutoff = f"{cutoff_day.isoformat()} 00:00:00"
+    # Переименованный архив уже не виден запросам, но еще не учтен в сводке
+    for month, path in archived_months():
+        if _month_bounds(month)[1] <= cutoff:
+            os.replace(path, path + ".rolling")
+    pending = sorted(name for name in os.listdir(ARCHIVE_DIR) if name.endswith(".db.rolling")) if os.path.isdir(ARCHIVE_DIR) else []
+
+    rolled = 0
+    conn = sqlite3.connect(DB_NAME, isolation_level=None)
+    try:
+        conn.execute("PRAGMA busy_timeout=30000;")
+        for name in pending:
+            path = os.path.join(ARCHIVE_DIR, name)
+            source = name[:-len(".rolling")]
+            conn.execute("ATTACH DATABASE ? AS archive", (path,))
+            conn.execute("BEGIN IMMEDIATE;")
+            try:
+                if conn.execute("SELECT 1 FROM accepted_rollups WHERE source = ?", (source,)).fetchone() is None:
+                    rows = _rollup_rows(conn, "archive")
+                    conn.execute(
+                        "INSERT INTO accepted_rollups (source, rows, rolled_at) VALUES (?, ?, datetime('now', 'localtime'))",
+                        (source, rows)
+                    )
+                    rolled += rows
+                conn.execute("COMMIT;")
+            except Exception:
+                conn.execute("ROLLBACK;")
+                raise
+            finally:
+                conn.execute("DETACH DATABASE archive")
+            os.remove(path)
+            logging.info(f"🗜 Архив {source} свернут в дневную сводку")
+
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            rolled += _rollup_rows(conn, "main", cutoff)
+            conn.execute("DELETE FROM main.accepted_scooters WHERE timestamp < ?", (cutoff,))
+            conn.execute("COMMIT;")
+        except Exception:
+            conn.execute("ROLLBACK;")
+            raise
+    finally:
+        conn.close()
+    return rolled
+
+def _database_size() -> int:
+    return sum(os.path.getsize(path) for path in (DB_NAME, DB_NAME + "-wal") if os.path.exists(path))
+
+def _compact_sync() -> dict:
+    """
+    incremental_vacuum порциями по VACUUM_PAGES_PER_STEP страниц, пока есть свободные
+    страницы и не вышел COMPACTION_BUDGET_SECONDS; между порциями запись продолжается.
+    Затем wal_checkpoint(TRUNCATE) обрезает WAL.
+    """
+    size_before = _database_size()
+    conn = sqlite3.connect(DB_NAME, isolation_level=None)
+    try:
+        conn.execute("PRAGMA busy_timeout=30000;")
+        if conn.execute("PRAGMA auto_vacuum;").fetchone()[0] != 2:
+            # Режим меняется только полным VACUUM; горячая часть после архивации невелика
+            logging.info("🧹 Перевожу базу на auto_vacuum=INCREMENTAL (разовый VACUUM)")
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+            conn.execute("VACUUM;")
+        deadline = time.monotonic() + COMPACTION_BUDGET_SECONDS
+        while conn.execute("PRAGMA freelist_count;").fetchone()[0] and time.monotonic() < deadline:
+            # execute() делает один шаг прагмы (одну страницу), executescript доводит ее до конца
+            conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP});")
+            time.sleep(0.05)
+        free_pages = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+        busy, log_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchone()
+    finally:
+        conn.close()
+    WAL_CHECKPOINT_PAGES.labels("log").set(log_pages)
+    WAL_CHECKPOINT_PAGES.labels("checkpointed").set(checkpointed)
+    if busy:
+        WAL_CHECKPOINT_BUSY.inc()
+    return {
+        "reclaimed": size_before - _database_size(),
+        "free_pages": free_pages,
+        "wal_busy": bool(busy),
+    }
+
+async def compact_storage(today: datetime.date = None) -> dict:
+    """
+    Сворачивает старые строки (если задан RETENTION_DAYS) и освобождает место в файле базы.
+    Запускается планировщиком в тихие часы между сменами.
+    """
+    today = today or datetime.date.today()
+    rolled = 0
+    if RETENTION_DAYS > 0:
+        with query_timer("compact_storage", "rollup", (RETENTION_DAYS,)):
+            rolled = await asyncio.to_thread(_rollup_sync, today - datetime.timedelta(days=RETENTION_DAYS))
+    with query_timer("compact_storage", "incremental_vacuum", ()):
+        result = await asyncio.to_thread(_compact_sync)
+    result["rolled_up"] = rolled
+    ROWS_ROLLED_UP.inc(rolled)
+    STORAGE_RECLAIMED_BYTES.inc(max(result["reclaimed"], 0))
+    logging.info(
+        f"🧹 Компакция: свернуто строк {rolled}, освобождено {result['reclaimed'] / 1024 / 1024:.1f} МБ, "
+        f"свободных страниц осталось {result['free_pages']}{', WAL занят' if result['wal_busy'] else ''}"
+    )
+    return result
+
+async def db_execute(query: str, params: tuple = ()) -> int:
+    # Пишет только в горячую часть: архивы закрытых месяцев открываются только на чтение
+    with query_timer("db_execute", query, params):
+        async with aiosqlite.connect(DB_NAME) as db:
+            await db.execute("PRAGMA journal_mode=WAL;")
+            cursor = await db.execute(query, params)
+            await db.commit()
+            return cursor.rowcount
+
+async def db_iter_chunks(query: str, params: tuple = (), chunk_size: int = 5000, period: tuple = None, fresh: bool = False):
+    """
+    Потоковое чтение: строки отдаются пачками по chunk_size, весь результат в память не загружается.
+    Запрос выполняется по очереди для каждого архива (от старых месяцев к новым) и для горячей
+    части, поэтому годится только для запросов без агрегатов.
+    """
+    async with aiosqlite.connect(DB_NAME, uri=True) as db:
         await db.execute("PRAGMA journal_mode=WAL;")
-        cursor = await db.execute(query, params)
-        return await cursor.fetchall()
+        for _, path in _archives_for(period) + [(None, None)]:
+            if path is not None:
+                await db.execute("ATTACH DATABASE ? AS arch0", (_readonly_uri(path),))
+                await db.execute(f"CREATE TEMP VIEW accepted_scooters AS SELECT {HISTORY_COLUMNS} FROM arch0.accepted_scooters")
+            with query_timer("db_iter_chunks", query, params):
+                cursor = await db.execute(query, params)
+            try:
+                while True:
+                    rows = await cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                await cursor.close()
+            if path is not None:
+                await db.execute("DROP VIEW temp.accepted_scooters")
+                await db.execute("DETACH DATABASE arch0")
+
+async def db_fetch_all(query: str, params: tuple = (), period: tuple = None, fresh: bool = False) -> list:
+    """
+    period — (начало, конец) данных, которые читает запрос: подключаются только архивы
+    пересекающихся месяцев, запрос за текущий месяц идет в горячую часть без ATTACH.
+    None — вся история. fresh — для совместимости с PostgreSQL (чтение без реплик),
+    у SQLite одна база.
+    """
+    with query_timer("db_fetch_all", query, params):
+        async with aiosqlite.connect(DB_NAME, uri=True) as db:
+            await db.execute("PRAGMA journal_mode=WAL;")
+            await _attach_history(db, period)
+            cursor = await db.execute(query, params)
+            return await cursor.fetchall()
+
+async def db_time_bounds() -> tuple:
+    """
+    Первый и последний день с данными за всю историю или (None, None). Из архивов
+    читаются только самый старый и самый новый, без объединения всей истории.
+    """
+    archives = archived_months()
+    sources = ["main"]
+    async with aiosqlite.connect(DB_NAME, uri=True) as db:
+        for index, (_, path) in enumerate(dict.fromkeys([archives[0], archives[-1]]) if archives else []):
+            await db.execute(f"ATTACH DATABASE ? AS arch{index}", (_readonly_uri(path),))
+            sources.append(f"arch{index}")
+        values = []
+        for source in sources:
+            cursor = await db.execute(f"SELECT MIN(timestamp), MAX(timestamp) FROM {source}.accepted_scooters")
+            values.extend(value for value in await cursor.fetchone() if value)
+    if not values:
+        return None, None
+    return datetime.date.fromisoformat(min(values)[:10]), datetime.date.fromisoformat(max(values)[:10])
+
+# --- Доставка отчетов ---
+# Отметка на каждую пару (отчет, чат): отчет, запущенный несколькими процессами или
+# повторно после перезапуска, уходит в чат один раз. Захват в статусе sending старше
+# DELIVERY_CLAIM_TIMEOUT считается брошенным упавшим процессом и может быть перехвачен.
+
+DELIVERY_CLAIM_TIMEOUT = 600
+
+REPORT_DELIVERIES_DDL = '''
+    CREATE TABLE IF NOT EXISTS report_deliveries (
+        report TEXT NOT NULL,
+        chat_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        instance TEXT NOT NULL,
+        claimed_at DATETIME NOT NULL,
+        sent_at DATETIME,
+        PRIMARY KEY (report, chat_id)
+    )
+'''
+
+async def claim_delivery(report: str, chat_id: int, instance: str) -> bool:
+    claimed = await db_execute(f'''
+        INSERT INTO report_deliveries (report, chat_id, status, instance, claimed_at)
+        VALUES (?, ?, 'sending', ?, datetime('now'))
+        ON CONFLICT (report, chat_id) DO UPDATE SET instance = excluded.instance, claimed_at = excluded.claimed_at
+        WHERE status = 'sending' AND claimed_at < datetime('now', '-{DELIVERY_CLAIM_TIMEOUT} seconds')
+    ''', (report, chat_id, instance))
+    return claimed > 0
+
+async def mark_delivered(report: str, chat_id: int):
+    await db_execute(
+        "UPDATE report_deliveries SET status = 'sent', sent_at = datetime('now') WHERE report = ? AND chat_id = ?",
+        (report, chat_id)
+    )
 
-async def db_write_batch(records_data: list[tuple]):
+async def release_delivery(report: str, chat_id: int, instance: str):
+    await db_execute(
+        "DELETE FROM report_deliveries WHERE report = ? AND chat_id = ? AND status = 'sending' AND instance = ?",
+        (report, chat_id, instance)
+    )
+
+async def delivered_chats(report: str) -> set:
+    rows = await _fetch_main("SELECT chat_id FROM report_deliveries WHERE report = ? AND status = 'sent'", (report,))
+    return {row[0] for row in rows}
+
+# --- Кэш /service_report ---
+# Итоги закрытых дней (дата смены → смена → сервис) хранятся в базе и считаются один раз.
+# Триггеры на accepted_scooters помечают день устаревшим при любой вставке, удалении
+# или изменении строки этого дня. День сначала помечается computing, и итог записывается,
+# только если за время подсчета триггер не пометил его stale.
+
+SERVICE_REPORT_CACHE_DDL = (
+    '''
+    CREATE TABLE IF NOT EXISTS service_report_days (
+        shift_date DATE PRIMARY KEY,
+        state TEXT NOT NULL,
+        shifts TEXT NOT NULL,
+        computed_at DATETIME
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS service_report_counts (
+        shift_date DATE NOT NULL,
+        shift TEXT NOT NULL,
+        service TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (shift_date, shift, service)
+    )
+    ''',
+)
+
+# Итоги, посчитанные при другом расписании смен, не используются
+SHIFTS_SIGNATURE = ",".join(f"{name}={start.isoformat()}-{end.isoformat()}" for name, start, end in SHIFTS)
+
+def _service_report_triggers() -> list[str]:
+    old_day = sql_shift_columns("OLD.timestamp", SQL_DIALECT)[0]
+    new_day = sql_shift_columns("NEW.timestamp", SQL_DIALECT)[0]
+    stale = "UPDATE service_report_days SET state = 'stale' WHERE shift_date"
+    statements = []
+    for event, condition in (("INSERT", f"= {new_day}"), ("DELETE", f"= {old_day}"), ("UPDATE", f"IN ({old_day}, {new_day})")):
+        name = f"service_report_stale_{event.lower()}"
+        statements.append(f"DROP TRIGGER IF EXISTS {name}")
+        statements.append(f"CREATE TRIGGER {name} AFTER {event} ON accepted_scooters BEGIN {stale} {condition}; END")
+    return statements
+
+async def _fetch_main(query: str, params: tuple = ()) -> list:
+    # Служебные таблицы лежат только в основной базе: архивы не подключаются
+    with query_timer("db_fetch_all", query, params):
+        async with aiosqlite.connect(DB_NAME) as db:
+            cursor = await db.execute(query, params)
+            return await cursor.fetchall()
+
+async def service_report_cached_days(start: datetime.date, end: datetime.date) -> dict:
+    """
+    Готовые итоги дней из [start, end]: {дата 'YYYY-MM-DD': [(смена, сервис, количество), ...]}.
+    День без приемок тоже присутствует, с пустым списком.
+    """
+    rows = await _fetch_main('''
+        SELECT d.shift_date, c.shift, c.service, c.count
+        FROM service_report_days d LEFT JOIN service_report_counts c ON c.shift_date = d.shift_date
+        WHERE d.shift_date >= ? AND d.shift_date <= ? AND d.state = 'ready' AND d.shifts = ?
+    ''', (start.isoformat(), end.isoformat(), SHIFTS_SIGNATURE))
+    days = {}
+    for shift_date, shift, service, count in rows:
+        entries = days.setdefault(str(shift_date), [])
+        if shift is not None:
+            entries.append((shift, service, count))
+    return days
+
+async def begin_service_report_days(days: list[str]):
     async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("PRAGMA journal_mode=WAL;")
         await db.executemany('''
-            INSERT OR IGNORE INTO accepted_scooters 
-            (scooter_number, service, accepted_by_user_id, accepted_by_username, accepted_by_fullname, timestamp, chat_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', records_data)
+            INSERT INTO service_report_days (shift_date, state, shifts) VALUES (?, 'computing', ?)
+            ON CONFLICT (shift_date) DO UPDATE SET state = 'computing', shifts = excluded.shifts
+        ''', [(day, SHIFTS_SIGNATURE) for day in days])
         await db.commit()
+
+async def store_service_report_days(results: dict) -> int:
+    """
+    Сохраняет итоги {дата: [(смена, сервис, количество), ...]} для дней, которые с начала
+    подсчета не менялись. Возвращает число сохраненных дней.
+    """
+    stored = 0
+    with query_timer("store_service_report_days", "service_report_counts", tuple(results)):
+        async with aiosqlite.connect(DB_NAME) as db:
+            await db.execute("BEGIN IMMEDIATE;")
+            for day, entries in results.items():
+                cursor = await db.execute('''
+                    UPDATE service_report_days SET state = 'ready', computed_at = datetime('now', 'localtime')
+                    WHERE shift_date = ? AND state = 'computing' AND shifts = ?
+                ''', (day, SHIFTS_SIGNATURE))
+                if not cursor.rowcount:
+                    continue
+                await db.execute("DELETE FROM service_report_counts WHERE shift_date = ?", (day,))
+                await db.executemany(
+                    "INSERT INTO service_report_counts (shift_date, shift, service, count) VALUES (?, ?, ?, ?)",
+                    [(day, shift, service, count) for shift, service, count in entries]
+                )
+                stored += 1
+            await db.commit()
+    return stored
+
+# --- Таблица лидеров смены ---
+# Сообщение с таблицей лидеров текущей смены в каждой группе. Отметка в базе позволяет
+# после перезапуска или смены лидера редактировать то же сообщение, а не публиковать новое.
+
+LEADERBOARD_MESSAGES_DDL = '''
+    CREATE TABLE IF NOT EXISTS leaderboard_messages (
+        chat_id INTEGER PRIMARY KEY,
+        shift_start TEXT NOT NULL,
+        message_id INTEGER NOT NULL
+    )
+'''
+
+async def chat_shift_totals(chat_id: int, start_dt: datetime.datetime, end_dt: datetime.datetime) -> list:
+    """
+    Итоги группы за смену: [(user_id, username, fullname, сервис, количество), ...].
+    """
+    bounds = (start_dt.strftime("%Y-%m-%d %H:%M:%S"), end_dt.strftime("%Y-%m-%d %H:%M:%S"))
+    return await db_fetch_all('''
+        SELECT accepted_by_user_id, MAX(accepted_by_username), MAX(accepted_by_fullname), service, COUNT(*)
+        FROM accepted_scooters
+        WHERE chat_id = ? AND timestamp >= ? AND timestamp < ?
+        GROUP BY accepted_by_user_id, service
+    ''', (chat_id, *bounds), period=bounds)
+
+async def leaderboard_message(chat_id: int):
+    """
+    (начало смены в ISO, message_id) последней таблицы лидеров группы или None.
+    """
+    rows = await _fetch_main("SELECT shift_start, message_id FROM leaderboard_messages WHERE chat_id = ?", (chat_id,))
+    return tuple(rows[0]) if rows else None
+
+async def set_leaderboard_message(chat_id: int, shift_start: str, message_id: int):
+    await db_execute('''
+        INSERT INTO leaderboard_messages (chat_id, shift_start, message_id) VALUES (?, ?, ?)
+        ON CONFLICT (chat_id) DO UPDATE SET shift_start = excluded.shift_start, message_id = excluded.message_id
+    ''', (chat_id, shift_start, message_id))
+
+async def closed_history() -> tuple:
+    """
+    Периоды, куда нельзя дописывать строки задним числом: уже записанную строку там
+    UNIQUE основной базы не увидит. (последний день, свернутый в сводку, или None;
+    месяцы, перенесенные в архивы).
+    """
+    async with aiosqlite.connect(DB_NAME) as db:
+        async with db.execute("SELECT MAX(day) FROM accepted_daily_summary") as cursor:
+            (rolled_until,) = await cursor.fetchone()
+    return (datetime.date.fromisoformat(rolled_until) if rolled_until else None), {month for month, _ in archived_months()}
+
+INSERT_ACCEPTED_SQL = '''
+    INSERT OR IGNORE INTO accepted_scooters
+    (scooter_number, service, accepted_by_user_id, accepted_by_username, accepted_by_fullname, timestamp, chat_id, message_id, item_index)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+async def db_write_batch(records_data: list[tuple]) -> int:
+    """
+    Записывает строки, пропуская уже записанные. Возвращает число новых строк.
+    """
+    DB_WRITE_BATCH_SIZE.observe(len(records_data))
+    with query_timer("db_write_batch", INSERT_ACCEPTED_SQL, records_data):
+        async with aiosqlite.connect(DB_NAME) as db:
+            await db.execute("PRAGMA journal_mode=WAL;")
+            cursor = await db.executemany(INSERT_ACCEPTED_SQL, records_data)
+            await db.commit()
+            return cursor.rowcount
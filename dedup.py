@@ -0,0 +1,30 @@
+# dedup.py
+# Повторная доставка апдейта (обрыв связи при getUpdates, повтор вебхука) отсекается
+# по update_id до разбора сообщения. Кэш живет в памяти процесса; повторы, которые он
+# не поймал (перезапуск, другой процесс за балансировщиком), отсекает уникальный ключ
+# строки по (chat_id, message_id, item_index).
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from metrics import DUPLICATE_UPDATES
+from collections import OrderedDict
+import logging
+
+class RecentUpdatesMiddleware(BaseMiddleware):
+    """
+    Помнит последние max_size update_id; уже виденный апдейт дальше не обрабатывается.
+    """
+    def __init__(self, max_size: int):
+        super().__init__()
+        self.max_size = max_size
+        self._seen = OrderedDict()
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        if update.update_id in self._seen:
+            self._seen.move_to_end(update.update_id)
+            DUPLICATE_UPDATES.labels("update_id").inc()
+            logging.info(f"⏭ Апдейт {update.update_id} уже обработан, повтор пропущен")
+            raise CancelHandler()
+        self._seen[update.update_id] = None
+        if len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
@@ -1,11 +1,20 @@
 # handlers.py
 from aiogram import types
 from aiogram.dispatcher.filters import BoundFilter
-from config import ADMIN_IDS, ALLOWED_CHAT_IDS, SERVICE_ALIASES, YANDEX_SCOOTER_PATTERN, WOOSH_SCOOTER_PATTERN, JET_SCOOTER_PATTERN, BOLT_SCOOTER_PATTERN, BATCH_QUANTITY_PATTERN, TIMEZONE
-from database import db_write_batch, db_fetch_all, db_execute
+from config import ADMIN_IDS, ALLOWED_CHAT_IDS, SERVICE_ALIASES, YANDEX_SCOOTER_PATTERN, WOOSH_SCOOTER_PATTERN, JET_SCOOTER_PATTERN, BOLT_SCOOTER_PATTERN, BATCH_QUANTITY_PATTERN, TIMEZONE, EXPORT_PART_BYTES, IMPORT_MAX_BYTES
+from database import db_write_batch, db_fetch_all, db_execute, LOCAL_TS, SQL_DIALECT, service_report_cached_days, begin_service_report_days, store_service_report_days, archived_matches
+from metrics import MESSAGES_PARSED, SCOOTERS_ACCEPTED, DUPLICATE_UPDATES
+from singleflight import SingleFlight
+from userstats import user_stats
+from leaderboard import leaderboards
+from shifts import current_shift, period_range, sql_shift_columns, shift_title, shift_hours, SHIFT_NAMES
 from collections import defaultdict
+import asyncio
 import datetime
 import logging
+import os
+import tempfile
+import time
 
 class IsAdminFilter(BoundFilter):
     async def check(self, message: types.Message) -> bool:
@@ -30,9 +39,15 @@ async def command_start_handler(message: types.Message):
     )
     await message.answer(response, parse_mode="Markdown")
 
+def message_time(message: types.Message) -> datetime.datetime:
+    # aiogram отдает message.date наивным временем сервера; переводим в таймзону бота
+    return datetime.datetime.fromtimestamp(message.date.timestamp(), TIMEZONE)
+
 async def process_scooter_text(message: types.Message, text_to_process: str):
+    MESSAGES_PARSED.inc()
     user = message.from_user
-    now_localized_str = datetime.datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M:%S")
+    # Время приема — время сообщения: у повторно доставленного апдейта оно то же, что у первого
+    accepted_at_str = message_time(message).strftime("%Y-%m-%d %H:%M:%S")
 
     records_to_insert = []
     accepted_summary = defaultdict(int)
@@ -48,7 +63,7 @@ async def process_scooter_text(message: types.Message, text_to_process: str):
                 if service and 0 < quantity <= 200:
                     for i in range(quantity):
                         placeholder_number = f"{service.upper()}_BATCH_{datetime.datetime.now(TIMEZONE).strftime('%H%M%S%f')}_{i+1}"
-                        records_to_insert.append((placeholder_number, service, user.id, user.username, user.full_name, now_localized_str, message.chat.id))
+                        records_to_insert.append((placeholder_number, service, user.id, user.username, user.full_name, accepted_at_str, message.chat.id, message.message_id, len(records_to_insert)))
                     accepted_summary[service] += quantity
             except (ValueError, TypeError):
                 continue
@@ -72,14 +87,22 @@ async def process_scooter_text(message: types.Message, text_to_process: str):
             if clean_num in processed_numbers:
                 continue
 
-            records_to_insert.append((clean_num, service, user.id, user.username, user.full_name, now_localized_str, message.chat.id))
+            records_to_insert.append((clean_num, service, user.id, user.username, user.full_name, accepted_at_str, message.chat.id, message.message_id, len(records_to_insert)))
             accepted_summary[service] += 1
             processed_numbers.add(clean_num)
 
     if not records_to_insert:
         return False
 
-    await db_write_batch(records_to_insert)
+    # Ключ строки — (чат, сообщение, позиция в сообщении): повтор того же сообщения ничего не добавляет
+    if not await db_write_batch(records_to_insert):
+        DUPLICATE_UPDATES.labels("message").inc()
+        logging.info(f"⏭ Сообщение {message.message_id} уже принято, повтор пропущен")
+        return True
+    user_stats.invalidate(user.id)
+    leaderboards.record(message.chat.id, user.id, f"@{user.username}" if user.username else user.full_name, accepted_summary)
+    for service, count in accepted_summary.items():
+        SCOOTERS_ACCEPTED.labels(service).inc(count)
 
     response_parts = []
     user_mention = f"<a href='tg://user?id={user.id}'>{user.full_name}</a>"
@@ -114,8 +137,8 @@ async def today_stats_handler(message: types.Message):
     start_str = start_time.strftime("%Y-%m-%d %H:%M:%S")
     end_str = end_time.strftime("%Y-%m-%d %H:%M:%S")
 
-    query = "SELECT service, accepted_by_user_id, accepted_by_username, accepted_by_fullname FROM accepted_scooters WHERE timestamp BETWEEN ? AND ?"
-    records = await db_fetch_all(query, (start_str, end_str))
+    query = "SELECT service, accepted_by_user_id, accepted_by_username, accepted_by_fullname FROM accepted_scooters WHERE timestamp >= ? AND timestamp < ?"
+    records = await db_fetch_all(query, (start_str, end_str), period=(start_str, end_str))
 
     if not records:
         await message.answer(f"За {shift_name} пока ничего не принято.")
@@ -161,65 +184,163 @@ async def today_stats_handler(message: types.Message):
         await message.answer("\n".join(current_message_buffer), parse_mode="HTML")
 
 def get_shift_time_range():
-    now = datetime.datetime.now(TIMEZONE)
-    today = now.date()
+    return current_shift()
 
-    morning_shift_start = TIMEZONE.localize(datetime.datetime.combine(today, datetime.time(7, 0, 0)))
-    morning_shift_end = TIMEZONE.localize(datetime.datetime.combine(today, datetime.time(15, 0, 0)))
-    evening_shift_start = TIMEZONE.localize(datetime.datetime.combine(today, datetime.time(15, 0, 0)))
-    evening_shift_end = TIMEZONE.localize(datetime.datetime.combine(today, datetime.time(23, 0, 0)))
+EXPORT_FORMATS = ("xlsx", "csv", "zip")
 
-    if morning_shift_start <= now < morning_shift_end:
-        return morning_shift_start, morning_shift_end, "утреннюю смену"
-    elif evening_shift_start <= now < evening_shift_end:
-        return evening_shift_start, evening_shift_end, "вечернюю смену"
-    else:
-        prev_day = today - datetime.timedelta(days=1)
-        night_cutoff_current_day = TIMEZONE.localize(datetime.datetime.combine(today, datetime.time(4, 0, 0)))
-        if TIMEZONE.localize(datetime.datetime.combine(today, datetime.time(0,0,0))) <= now < night_cutoff_current_day:
-            prev_evening_shift_start = TIMEZONE.localize(datetime.datetime.combine(prev_day, datetime.time(15, 0, 0)))
-            return prev_evening_shift_start, night_cutoff_current_day, "вечернюю смену (с учетом ночных часов)"
-        else:
-            if now.hour >= 23:
-                return evening_shift_start, evening_shift_end, "вечернюю смену"
-            return morning_shift_start, morning_shift_end, "утреннюю смену (еще не началась)"
+report_flights = SingleFlight()
 
 async def export_excel_handler(message: types.Message):
     if not await IsAdminFilter().check(message):
         return
 
     is_today_shift = message.get_command() == '/export_today_excel'
+    export_format = 'xlsx' if is_today_shift else (message.get_args().strip().lower() or 'xlsx')
+    if export_format not in EXPORT_FORMATS:
+        await message.reply(
+            "Используйте: /export_all_excel [xlsx|csv|zip]\n"
+            "xlsx — одна книга, csv — CSV в gzip, zip — архив с книгой на каждый месяц",
+            parse_mode=None
+        )
+        return
 
-    await message.answer(f"Формирую отчет...")
-
-    query = "SELECT id, scooter_number, service, accepted_by_user_id, accepted_by_username, accepted_by_fullname, timestamp, chat_id FROM accepted_scooters"
+    if export_format != 'xlsx':
+        await message.answer(f"Формирую отчет...")
+        await send_export_parts(message, export_format)
+        return
 
+    # Одновременные запросы одной выгрузки ждут одну сборку (ключ — смена или «все время»)
     if is_today_shift:
         start_time, end_time, shift_name = get_shift_time_range()
-        start_str = start_time.strftime("%Y-%m-%d %H:%M:%S")
-        end_str = end_time.strftime("%Y-%m-%d %H:%M:%S")
-        query += " WHERE timestamp BETWEEN ? AND ?"
-        records = await db_fetch_all(query, (start_str, end_str))
+        key = ("export_today", start_time.isoformat())
         date_filter_text = f" за {shift_name}"
     else:
-        query += " ORDER BY timestamp DESC"
-        records = await db_fetch_all(query)
+        key = ("export_all",)
         date_filter_text = " за все время"
 
-    if not records:
-        await message.answer(f"Нет данных для экспорта{date_filter_text}.")
-        return
-
-    try:
-        from reports import create_excel_report
-        excel_file = create_excel_report(records)
+    async def build(flight):
+        from reports import create_excel_report, build_report, spool_size, SharedReport
+        await flight.progress("Формирую отчет: читаю данные...")
+        query = "SELECT id, scooter_number, service, accepted_by_user_id, accepted_by_username, accepted_by_fullname, timestamp, chat_id FROM accepted_scooters"
+        if is_today_shift:
+            start_str = start_time.strftime("%Y-%m-%d %H:%M:%S")
+            end_str = end_time.strftime("%Y-%m-%d %H:%M:%S")
+            query += " WHERE timestamp >= ? AND timestamp < ?"
+            records = await db_fetch_all(query, (start_str, end_str), period=(start_str, end_str))
+        else:
+            query += " ORDER BY timestamp DESC"
+            records = await db_fetch_all(query)
+        if not records:
+            return f"Нет данных для экспорта{date_filter_text}."
+        await flight.progress(f"Формирую отчет: {len(records)} строк, собираю книгу...")
+        excel_file = await build_report(create_excel_report, records)
+        if spool_size(excel_file) > EXPORT_PART_BYTES:
+            excel_file.close()
+            return "Файл больше лимита Telegram. Используйте /export_all_excel csv или /export_all_excel zip."
+        await flight.progress("Формирую отчет: отправляю файл...")
         report_type = "shift" if is_today_shift else "full"
         filename = f"report_{report_type}_{datetime.date.today().isoformat()}.xlsx"
-        await message.bot.send_document(message.chat.id, types.InputFile(excel_file, filename=filename), caption=f"Ваш отчет{date_filter_text} готов.")
+        return SharedReport(excel_file, filename, f"Ваш отчет{date_filter_text} готов.")
+
+    try:
+        async with report_flights.join(key, message, build) as report:
+            if isinstance(report, str):
+                await message.answer(report)
+            else:
+                await report.send(message.bot, message.chat.id)
     except Exception as e:
         logging.error(f"Ошибка при отправке Excel файла: {e}")
         await message.answer("Произошла ошибка при отправке отчета.")
 
+async def send_export_parts(message: types.Message, export_format: str):
+    """
+    Выгрузка всей истории в CSV (gzip) или ZIP по месяцам; большие файлы
+    приходят несколькими документами в пределах лимита Telegram.
+    """
+    from reports import export_csv_gzip_parts, export_monthly_zip_parts, upload_buffer, upload_file
+    started = time.perf_counter()
+    try:
+        if export_format == 'csv':
+            parts = await export_csv_gzip_parts()
+            extension = "csv.gz"
+        else:
+            parts = await export_monthly_zip_parts()
+            extension = "zip"
+    except Exception as e:
+        logging.error(f"❌ Ошибка при формировании выгрузки {export_format}: {e}")
+        await message.answer("Произошла ошибка при формировании отчета.")
+        return
+
+    if not parts:
+        await message.answer("Нет данных для экспорта за все время.")
+        return
+
+    elapsed = time.perf_counter() - started
+    today = datetime.date.today().isoformat()
+    try:
+        for index, part in enumerate(parts, start=1):
+            suffix = f"_part{index}" if len(parts) > 1 else ""
+            caption = f"Ваш отчет за все время готов ({elapsed:.1f} с)."
+            if len(parts) > 1:
+                caption += f" Часть {index} из {len(parts)}."
+            with upload_buffer(part) as buffer:
+                await message.bot.send_document(message.chat.id, upload_file(buffer, f"report_full_{today}{suffix}.{extension}"), caption=caption)
+    except Exception as e:
+        logging.error(f"Ошибка при отправке выгрузки {export_format}: {e}")
+        await message.answer("Произошла ошибка при отправке отчета.")
+    finally:
+        for part in parts:
+            part.close()
+
+def _date_runs(days: list) -> list[tuple]:
+    """
+    Отсортированные даты в отрезки подряд идущих дней: [(начало, конец), ...].
+    """
+    runs = []
+    for day in days:
+        if runs and runs[-1][1] + datetime.timedelta(days=1) == day:
+            runs[-1] = (runs[-1][0], day)
+        else:
+            runs.append((day, day))
+    return runs
+
+async def fetch_service_counts(start_date: datetime.date, end_date: datetime.date) -> dict:
+    """
+    Приемки по сменам и сервисам за дни [start_date, end_date]: {(дата, смена): {сервис: количество}}.
+    Один запрос на отрезок: раскладка по сменам делается в базе. Итоги закрытых дней
+    уходят в кэш, поэтому читаются с основного сервера, а не с отстающей реплики.
+    """
+    range_start, range_end = period_range(start_date, end_date)
+    shift_date_expr, shift_name_expr = sql_shift_columns(LOCAL_TS, SQL_DIALECT)
+    # Свернутые дни берутся из дневной сводки
+    query = f"""
+        SELECT shift_date, shift, service, SUM(amount)
+        FROM (
+            SELECT {shift_date_expr} AS shift_date, {shift_name_expr} AS shift, service, COUNT(*) AS amount
+            FROM accepted_scooters
+            WHERE timestamp >= ? AND timestamp < ?
+            GROUP BY shift_date, shift, service
+            UNION ALL
+            SELECT shift_date, shift, service, SUM(count)
+            FROM accepted_daily_summary
+            WHERE shift_date >= ? AND shift_date <= ?
+            GROUP BY shift_date, shift, service
+        ) AS combined
+        GROUP BY shift_date, shift, service
+    """
+    records = await db_fetch_all(
+        query,
+        (range_start.strftime("%Y-%m-%d %H:%M:%S"), range_end.strftime("%Y-%m-%d %H:%M:%S"), start_date.isoformat(), end_date.isoformat()),
+        period=(range_start, range_end), fresh=True
+    )
+
+    shift_counts = defaultdict(lambda: defaultdict(int))
+    for shift_date, shift, service, count in records:
+        if shift is None:
+            continue
+        shift_counts[(str(shift_date), shift)][service] += count
+    return shift_counts
+
 async def service_report_handler(message: types.Message):
     if not await IsAdminFilter().check(message):
         return
@@ -234,8 +355,8 @@ async def service_report_handler(message: types.Message):
 
     start_date_str, end_date_str = args
     try:
-        start_date = TIMEZONE.localize(datetime.datetime.strptime(start_date_str, "%Y-%m-%d"))
-        end_date = TIMEZONE.localize(datetime.datetime.strptime(end_date_str, "%Y-%m-%d") + datetime.timedelta(days=1))
+        start_date = datetime.datetime.strptime(start_date_str, "%Y-%m-%d").date()
+        end_date = datetime.datetime.strptime(end_date_str, "%Y-%m-%d").date()
     except Exception as e:
         await message.reply(
             "Некорректный формат даты. Дата должна быть в YYYY-MM-DD.",
@@ -243,49 +364,47 @@ async def service_report_handler(message: types.Message):
         )
         return
 
+    if end_date < start_date:
+        start_date, end_date = end_date, start_date
+
     report_lines = []
     total_all = 0
     total_service = defaultdict(int)
 
+    # Итоги закрытых дней берутся из кэша в базе; считаются только открытые дни
+    # и дни, которые триггер пометил устаревшими после вставки или удаления
+    shift_counts = defaultdict(lambda: defaultdict(int))
+    cached = await service_report_cached_days(start_date, end_date)
+    for day, entries in cached.items():
+        for shift, service, count in entries:
+            shift_counts[(day, shift)][service] += count
+
+    days = [start_date + datetime.timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+    missing = [day for day in days if day.isoformat() not in cached]
+    now = datetime.datetime.now(TIMEZONE)
+    closed = {day.isoformat(): [] for day in missing if period_range(day, day)[1] <= now}
+    if closed:
+        await begin_service_report_days(list(closed))
+    for run_start, run_end in _date_runs(missing):
+        for (day, shift), services in (await fetch_service_counts(run_start, run_end)).items():
+            for service, count in services.items():
+                shift_counts[(day, shift)][service] += count
+                if day in closed:
+                    closed[day].append((shift, service, count))
+    if closed:
+        await store_service_report_days(closed)
+
     current_date = start_date
     while current_date <= end_date:
-        morning_start = TIMEZONE.localize(datetime.datetime.combine(current_date.date(), datetime.time(7, 0, 0)))
-        morning_end = TIMEZONE.localize(datetime.datetime.combine(current_date.date(), datetime.time(15, 0, 0)))
-
-        morning_query = "SELECT service FROM accepted_scooters WHERE timestamp BETWEEN ? AND ?"
-        morning_records = await db_fetch_all(morning_query, (morning_start.strftime("%Y-%m-%d %H:%M:%S"), morning_end.strftime("%Y-%m-%d %H:%M:%S")))
-
-        morning_services = defaultdict(int)
-        morning_total = 0
-        for (service,) in morning_records:
-            morning_services[service] += 1
-            total_service[service] += 1
-            morning_total += 1
-            total_all += 1
-
-        evening_start = TIMEZONE.localize(datetime.datetime.combine(current_date.date(), datetime.time(15, 0, 0)))
-        evening_end = TIMEZONE.localize(datetime.datetime.combine(current_date.date() + datetime.timedelta(days=1), datetime.time(4, 0, 0)))
-
-        evening_query = "SELECT service FROM accepted_scooters WHERE timestamp BETWEEN ? AND ?"
-        evening_records = await db_fetch_all(evening_query, (evening_start.strftime("%Y-%m-%d %H:%M:%S"), evening_end.strftime("%Y-%m-%d %H:%M:%S")))
-
-        evening_services = defaultdict(int)
-        evening_total = 0
-        for (service,) in evening_records:
-            evening_services[service] += 1
-            total_service[service] += 1
-            evening_total += 1
-            total_all += 1
-
-        date_str = current_date.strftime("%d.%m")
-        report_lines.append(f"<b>{date_str}</b>")
-        report_lines.append("Утренняя смена (7:00-15:00):")
-        for service, count in sorted(morning_services.items()):
-            report_lines.append(f"{service}: {count} шт.")
-        report_lines.append("Вечерняя смена (15:00-4:00):")
-        for service, count in sorted(evening_services.items()):
-            report_lines.append(f"{service}: {count} шт.")
-        day_total = morning_total + evening_total
+        day_total = 0
+        report_lines.append(f"<b>{current_date.strftime('%d.%m')}</b>")
+        for shift in SHIFT_NAMES:
+            report_lines.append(f"{shift_title(shift, nominative=True)} ({shift_hours(shift)}):")
+            for service, count in sorted(shift_counts.get((current_date.isoformat(), shift), {}).items()):
+                report_lines.append(f"{service}: {count} шт.")
+                total_service[service] += count
+                day_total += count
+        total_all += day_total
         report_lines.append(f"<b>Итог за день: {day_total}</b>")
         report_lines.append("")
 
@@ -382,11 +501,24 @@ async def delete_scooter_handler(message: types.Message):
 
     query = "DELETE FROM accepted_scooters WHERE scooter_number = ? AND accepted_by_username = ?"
     deleted_rows = await db_execute(query, (scooter_number, target_username))
+    if deleted_rows:
+        user_stats.invalidate()
+    # Удаление идет только в основной базе: закрытые месяцы лежат в архивах только для чтения
+    archived = await archived_matches("scooter_number = ? AND accepted_by_username = ?", (scooter_number, target_username))
+    archived_note = ""
+    if archived:
+        months = ", ".join(f"{month.strftime('%m.%Y')} ({count} шт.)" for month, count in archived)
+        archived_note = f"\n\n🗄 Записи за закрытые месяцы в архиве не удалены: {months}. Архив доступен только для чтения."
 
     if deleted_rows > 0:
         await message.reply(
             f"✅ Удалено {deleted_rows} записей:\n"
-            f"<code>{scooter_number}</code> от пользователя <code>{target_username}</code>",
+            f"<code>{scooter_number}</code> от пользователя <code>{target_username}</code>" + archived_note,
+            parse_mode="HTML"
+        )
+    elif archived:
+        await message.reply(
+            f"❌ Запись <code>{scooter_number}</code> от пользователя @{target_username} есть только в архиве." + archived_note,
             parse_mode="HTML"
         )
     else:
@@ -395,6 +527,130 @@ async def delete_scooter_handler(message: types.Message):
             parse_mode="HTML"
         )
 
+async def perf_stats_handler(message: types.Message):
+    if not await IsAdminFilter().check(message):
+        return
+
+    args = message.get_args().strip()
+    try:
+        minutes = int(args) if args else 15
+        if minutes <= 0:
+            raise ValueError
+    except ValueError:
+        await message.reply("⏱ Используйте: /perf_stats [минуты]\nПример: /perf_stats 60", parse_mode=None)
+        return
+
+    from profiling import format_report
+    from watchdog import format_status
+    from startup import format_report as format_startup
+    MESSAGE_LIMIT = 4000
+    current_msg = []
+    for line in format_report(minutes) + format_status() + format_startup().splitlines():
+        if len('\n'.join(current_msg)) + len(line) + 1 > MESSAGE_LIMIT:
+            await message.answer('\n'.join(current_msg), parse_mode="HTML")
+            current_msg = []
+        current_msg.append(line)
+
+    if current_msg:
+        await message.answer('\n'.join(current_msg), parse_mode="HTML")
+
+async def backup_now_handler(message: types.Message):
+    if not await IsAdminFilter().check(message):
+        return
+
+    await message.answer("💾 Делаю бэкап базы...")
+    from backup import backup_database
+    try:
+        result = await backup_database()
+    except Exception as e:
+        logging.exception("Ошибка бэкапа по команде")
+        await message.reply(f"❌ Бэкап не удался: {e}", parse_mode=None)
+        return
+
+    await message.reply(
+        f"✅ Бэкап готов за {result['seconds']:.1f} с\n"
+        f"Файл: <code>{os.path.basename(result['path'])}</code>\n"
+        f"Размер: {result['size'] / 1024 / 1024:.1f} МБ\n"
+        f"SHA-256: <code>{result['sha256']}</code>\n"
+        f"Архивов месяцев: {result['archives']}\n"
+        f"WAL: перенесено {result['wal_checkpointed']} из {result['wal_pages']} страниц",
+        parse_mode="HTML"
+    )
+
+async def import_document_handler(message: types.Message):
+    if not await IsAdminFilter().check(message):
+        return
+
+    from importer import import_file, import_lock, IMPORT_EXTENSIONS
+    from reports import upload_buffer, upload_file
+    document = message.document
+    filename = document.file_name or "import"
+    if not filename.lower().endswith(IMPORT_EXTENSIONS):
+        await message.reply(
+            "Для импорта пришлите файл .csv, .csv.gz или .xlsx в формате выгрузки /export_all_excel.",
+            parse_mode=None
+        )
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await message.reply(f"Файл больше {IMPORT_MAX_BYTES // 1024 // 1024} МБ: разбейте его на части.", parse_mode=None)
+        return
+    if import_lock.locked():
+        await message.reply("Импорт другого файла еще идет, пришлите этот после него.", parse_mode=None)
+        return
+
+    async with import_lock:
+        # Один статус на весь импорт: прогресс редактирует его, а не шлет новые сообщения
+        status = await message.answer(f"📥 Импорт {filename}: загружаю файл...", parse_mode=None)
+
+        async def edit_status(text: str):
+            try:
+                await status.edit_text(text, parse_mode=None)
+            except Exception as e:
+                logging.debug(f"Статус импорта не обновлен: {e!r}")
+
+        async def progress(stats: dict):
+            await edit_status(
+                f"📥 Импорт {filename}: прочитано {stats['rows']} строк, "
+                f"добавлено {stats['inserted']}, отклонено {stats['rejected']}..."
+            )
+
+        try:
+            # Файл скачивается на диск: в памяти держится только текущая пачка строк
+            with tempfile.TemporaryFile() as source:
+                await document.download(destination_file=source)
+                result = await import_file(source, filename, progress)
+        except ValueError as e:
+            await edit_status(f"❌ Импорт {filename} остановлен: {e}")
+            return
+        except Exception as e:
+            logging.exception(f"Ошибка импорта {filename}")
+            await edit_status(f"❌ Импорт {filename} не удался: {e!r}")
+            return
+
+        await edit_status(
+            f"✅ Импорт {filename} завершен за {result['seconds']:.1f} с\n"
+            f"Строк: {result['rows']}\n"
+            f"Добавлено: {result['inserted']}\n"
+            f"Уже были в базе: {result['duplicates']}\n"
+            f"Отклонено: {result['rejected']}"
+        )
+        rejected_file = result["rejected_file"]
+        if rejected_file is not None:
+            with rejected_file, upload_buffer(rejected_file) as buffer:
+                await message.bot.send_document(
+                    message.chat.id,
+                    upload_file(buffer, f"rejected_{filename.split('.')[0]}.csv"),
+                    caption=f"Отклоненные строки ({result['rejected']}): номер строки в файле и причина."
+                )
+
+async def profile_next_handler(message: types.Message):
+    if not await IsAdminFilter().check(message):
+        return
+
+    from profiling import arm_profile
+    arm_profile(message.from_user.id)
+    await message.reply("🔬 Следующая ваша команда будет выполнена под cProfile, результат придет файлом.", parse_mode=None)
+
 # --- НОВАЯ ФУНКЦИЯ ДЛЯ ОПРЕДЕЛЕНИЯ ГРАНИЦ МЕСЯЦА ---
 def get_month_start_end(month_str, year_str):
     """
@@ -417,91 +673,187 @@ def get_month_start_end(month_str, year_str):
     except (ValueError, TypeError):
         return None, None
 # --- КОНЕЦ НОВОЙ ФУНКЦИИ ---
-# --- УПРОЩЕННЫЙ ОБРАБОТЧИК МЕСЯЧНОГО ОТЧЕТА ---
+# Больше месяцев за один /monthly_report не строится: по листу и запросу на месяц
+MAX_REPORT_MONTHS = 24
+
+def get_month_ranges(start_month: datetime.datetime, last_month: datetime.datetime) -> list[tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Возвращает границы всех месяцев от start_month до last_month включительно.
+    """
+    ranges = []
+    current = start_month
+    while current <= last_month:
+        start_dt, end_dt = get_month_start_end(current.month, current.year)
+        ranges.append((start_dt, end_dt))
+        current = end_dt
+    return ranges
+
+MY_STATS_PERIODS = {"shift": "shift", "смена": "shift", "month": "month", "месяц": "month"}
+
+async def fetch_user_counts(user_id: int, start_dt: datetime.datetime, end_dt: datetime.datetime, with_summary: bool) -> dict:
+    """
+    Итоги пользователя по сервисам за период ({сервис: количество}); строки одного
+    пользователя выбираются по индексу idx_user_service. Смена в дневную сводку
+    не попадает (RETENTION_DAYS не меньше 2), месяц складывается со сводкой.
+    Курьер спрашивает сразу после своей приемки, поэтому чтение идет на основной сервер.
+    """
+    if with_summary:
+        query = """
+            SELECT service, SUM(amount) FROM (
+                SELECT service, COUNT(*) AS amount FROM accepted_scooters
+                WHERE accepted_by_user_id = ? AND timestamp >= ? AND timestamp < ?
+                GROUP BY service
+                UNION ALL
+                SELECT service, SUM(count) FROM accepted_daily_summary
+                WHERE accepted_by_user_id = ? AND day >= ? AND day < ?
+                GROUP BY service
+            ) AS combined
+            GROUP BY service
+        """
+        params = (user_id, start_dt.strftime("%Y-%m-%d %H:%M:%S"), end_dt.strftime("%Y-%m-%d %H:%M:%S"), user_id, start_dt.date().isoformat(), end_dt.date().isoformat())
+    else:
+        query = """
+            SELECT service, COUNT(*) FROM accepted_scooters
+            WHERE accepted_by_user_id = ? AND timestamp >= ? AND timestamp < ?
+            GROUP BY service
+        """
+        params = (user_id, start_dt.strftime("%Y-%m-%d %H:%M:%S"), end_dt.strftime("%Y-%m-%d %H:%M:%S"))
+    rows = await db_fetch_all(query, params, period=(start_dt, end_dt), fresh=True)
+    return {service: count for service, count in rows}
+
+async def my_stats_handler(message: types.Message):
+    user = message.from_user
+    if not user_stats.allow(user.id):
+        return
+
+    period = MY_STATS_PERIODS.get(message.get_args().strip().lower() or "shift")
+    if period is None:
+        await message.reply("Используйте: /my_stats [shift|month] — итоги за текущую смену или месяц", parse_mode=None)
+        return
+
+    if period == "shift":
+        start_dt, end_dt, shift_name = get_shift_time_range()
+        period_text = f"{shift_name} ({start_dt.strftime('%H:%M')} - {end_dt.strftime('%H:%M')})"
+    else:
+        now = datetime.datetime.now(TIMEZONE)
+        start_dt, end_dt = get_month_start_end(now.month, now.year)
+        period_text = start_dt.strftime('%B %Y')
+
+    counts = await user_stats.get(
+        (user.id, period, start_dt.isoformat()),
+        lambda: fetch_user_counts(user.id, start_dt, end_dt, period == "month")
+    )
+    user_mention = f"<a href='tg://user?id={user.id}'>{user.full_name}</a>"
+    if not counts:
+        await message.reply(f"{user_mention}, за {period_text} у вас пока ничего не принято.", parse_mode="HTML")
+        return
+    response_parts = [f"{user_mention}, за {period_text} принято {sum(counts.values())} шт.:"]
+    for service, count in sorted(counts.items()):
+        response_parts.append(f"  - {service}: {count} шт.")
+    await message.reply("\n".join(response_parts), parse_mode="HTML")
+
+async def fetch_monthly_pivot(start_dt: datetime.datetime, end_dt: datetime.datetime, with_days: bool = False):
+    # Один агрегирующий запрос: пользователь × сервис (× день)
+    day_expr = f"date({LOCAL_TS})" if with_days else "NULL"
+    group_by = "accepted_by_user_id, service, day" if with_days else "accepted_by_user_id, service"
+    # Свернутые дни берутся из дневной сводки: границы месяца совпадают с границами дней
+    summary_day = "day" if with_days else "NULL"
+    query = f"""
+        SELECT accepted_by_user_id, MAX(accepted_by_username), MAX(accepted_by_fullname), service, {summary_day}, SUM(amount)
+        FROM (
+            SELECT accepted_by_user_id, MAX(accepted_by_username) AS accepted_by_username,
+                   MAX(accepted_by_fullname) AS accepted_by_fullname, service, {day_expr} AS day, COUNT(*) AS amount
+            FROM accepted_scooters
+            WHERE timestamp >= ? AND timestamp < ?
+            GROUP BY {group_by}
+            UNION ALL
+            SELECT accepted_by_user_id, MAX(accepted_by_username), MAX(accepted_by_fullname), service, {summary_day}, SUM(count)
+            FROM accepted_daily_summary
+            WHERE day >= ? AND day < ?
+            GROUP BY {group_by}
+        ) AS combined
+        GROUP BY {group_by}
+    """
+    rows = await db_fetch_all(
+        query,
+        (start_dt.strftime("%Y-%m-%d %H:%M:%S"), end_dt.strftime("%Y-%m-%d %H:%M:%S"), start_dt.date().isoformat(), end_dt.date().isoformat()),
+        period=(start_dt, end_dt)
+    )
+
+    from reports import build_monthly_pivot
+    return build_monthly_pivot(rows, with_days=with_days)
+
 async def monthly_report_handler(message: types.Message):
     if not await IsAdminFilter().check(message):
         return
 
-    args = message.get_args().strip()
+    args = message.get_args().split()
+    with_days = bool(args) and args[-1].lower() in ("days", "дни")
+    if with_days:
+        args = args[:-1]
+
     if not args:
         await message.reply(
-            "📊 Используйте: /monthly_report <месяц> <год>\n"
+            "📊 Используйте: /monthly_report <месяц> <год> [<месяц> <год>] [days]\n"
             "Пример:\n"
             "/monthly_report 09 2024\n"
-            "/monthly_report 10 2024"
+            "/monthly_report 09 2024 days — с разбивкой по дням\n"
+            "/monthly_report 01 2024 03 2024 — по листу на каждый месяц"
         )
         return
 
     try:
-        month_str, year_str = args.split()
-        start_dt, end_dt = get_month_start_end(month_str, year_str)
-        if start_dt is None or end_dt is None:
+        if len(args) not in (2, 4):
+            raise ValueError("Неверное количество аргументов.")
+        start_dt, _ = get_month_start_end(args[0], args[1])
+        last_dt, _ = get_month_start_end(*(args[2:4] if len(args) == 4 else args[0:2]))
+        if start_dt is None or last_dt is None or last_dt < start_dt:
             raise ValueError("Неверный формат месяца или года.")
     except ValueError:
         await message.reply(
-            "❌ Неверный формат. Используйте: /monthly_report <месяц> <год>\n"
+            "❌ Неверный формат. Используйте: /monthly_report <месяц> <год> [<месяц> <год>] [days]\n"
             "Месяц должен быть числом от 01 до 12, год - 4-значным числом (например, 2024).",
             parse_mode=None
         )
         return
 
-    start_str = start_dt.strftime("%Y-%m-%d %H:%M:%S")
-    end_str = end_dt.strftime("%Y-%m-%d %H:%M:%S")
-
-    query = """
-        SELECT accepted_by_user_id, accepted_by_username, accepted_by_fullname, service
-        FROM accepted_scooters
-        WHERE timestamp >= ? AND timestamp < ?
-    """
-    records = await db_fetch_all(query, (start_str, end_str))
-
-    if not records:
-        await message.answer(f"❌ Нет данных за {start_dt.strftime('%B %Y')}.")
+    months = (last_dt.year - start_dt.year) * 12 + last_dt.month - start_dt.month + 1
+    if months > MAX_REPORT_MONTHS:
+        await message.reply(
+            f"❌ Период слишком длинный: {months} мес. За один раз — не больше {MAX_REPORT_MONTHS} мес.\n"
+            "Используйте: /monthly_report <месяц> <год> [<месяц> <год>] [days] и разбейте период на части.",
+            parse_mode=None
+        )
         return
 
-    # Группируем данные по пользователю и сервису
-    user_stats = defaultdict(lambda: defaultdict(int))
-    user_info = {}
+    month_ranges = get_month_ranges(start_dt, last_dt)
+    period_text = start_dt.strftime('%B %Y')
+    if len(month_ranges) > 1:
+        period_text += f" — {month_ranges[-1][0].strftime('%B %Y')}"
+    key = ("monthly", start_dt.strftime('%Y-%m'), last_dt.strftime('%Y-%m'), with_days)
+
+    async def build(flight):
+        from reports import create_monthly_excel_report, build_report, SharedReport
+        # Месяцы считаются параллельно
+        pivots = await asyncio.gather(*(fetch_monthly_pivot(month_start, month_end, with_days) for month_start, month_end in month_ranges))
+        sheets = [(month_start, headers, data) for (month_start, _), (headers, data) in zip(month_ranges, pivots) if data]
+        if not sheets:
+            return f"❌ Нет данных за {period_text}."
+        await flight.progress(f"Формирую отчет за {len(month_ranges)} мес: собираю книгу...")
+        excel_file = await build_report(create_monthly_excel_report, sheets)
+        await flight.progress(f"Формирую отчет за {len(month_ranges)} мес: отправляю файл...")
+        filename = f"monthly_report_{start_dt.strftime('%Y_%m')}"
+        if len(month_ranges) > 1:
+            filename += f"-{month_ranges[-1][0].strftime('%Y_%m')}"
+        filename += ".xlsx"
+        return SharedReport(excel_file, filename, f"📊 Отчет за {period_text}")
 
-    for user_id, username, fullname, service in records:
-        user_stats[user_id][service] += 1
-        if user_id not in user_info:
-            user_info[user_id] = {'username': username, 'fullname': fullname}
-
-    # Подготовка данных для Excel
-    excel_data = []
-    for user_id, services in user_stats.items():
-        username = user_info[user_id]['username']
-        fullname = user_info[user_id]['fullname']
-        display_name = f"@{username}" if username else fullname
-
-        # Получаем количество по каждому сервису
-        bolt_count = services.get("Bolt", 0)
-        jet_count = services.get("Jet", 0)
-        whoosh_count = services.get("Whoosh", 0)
-        yandex_count = services.get("Яндекс", 0)
-        total_count = bolt_count + jet_count + whoosh_count + yandex_count
-
-        # Формируем строку для Excel: [Пользователь, Bolt, Jet, Whoosh, Яндекс, Итого]
-        row = [display_name, bolt_count, jet_count, whoosh_count, yandex_count, total_count]
-        excel_data.append(row)
-
-    # Сортируем по убыванию общего итога (чтобы лидер был наверху)
-    excel_data.sort(key=lambda x: x[5], reverse=True)
-
-    # Отправляем Excel файл
     try:
-        from reports import create_monthly_excel_report
-        excel_file = create_monthly_excel_report(excel_data, start_dt)
-        filename = f"monthly_report_{start_dt.strftime('%Y_%m')}.xlsx"
-        caption = f"📊 Отчет за {start_dt.strftime('%B %Y')}"
-        excel_file.seek(0)
-        await message.bot.send_document(
-            message.chat.id,
-            types.InputFile(excel_file, filename=filename),
-            caption=caption
-        )
+        async with report_flights.join(key, message, build, f"Формирую отчет за {len(month_ranges)} мес...") as report:
+            if isinstance(report, str):
+                await message.answer(report)
+            else:
+                await report.send(message.bot, message.chat.id)
     except Exception as e:
         logging.error(f"❌ Ошибка при создании или отправке Excel отчета: {e}")
         await message.answer("❌ Произошла ошибка при формировании Excel отчета.")
-
@@ -0,0 +1,227 @@
+# importer.py
+# Импорт истории из файлов в формате выгрузки /export_all_excel: CSV (в том числе .csv.gz)
+# или .xlsx. Файл читается потоково (csv / openpyxl read_only), номера проверяются теми же
+# шаблонами, что и сообщения курьеров, строки пишутся пачками по IMPORT_CHUNK_ROWS — одна
+# транзакция на пачку. Уже записанные строки пропускает UNIQUE (номер, курьер, время)
+# основной базы. Он не видит месяцы в архивах и дни, свернутые в сводку, поэтому строки
+# за такие периоды отклоняются: повторный импорт не дублирует их итоги.
+from config import (
+    TIMEZONE, SERVICE_ALIASES, IMPORT_CHUNK_ROWS,
+    YANDEX_SCOOTER_PATTERN, WOOSH_SCOOTER_PATTERN, JET_SCOOTER_PATTERN, BOLT_SCOOTER_PATTERN,
+)
+from database import db_write_batch, closed_history, SQL_DIALECT
+from reports import EXPORT_HEADERS, new_spool
+from metrics import IMPORTED_ROWS
+from userstats import user_stats
+import asyncio
+import csv
+import datetime
+import gzip
+import io
+import logging
+import time
+
+IMPORT_EXTENSIONS = (".csv", ".csv.gz", ".xlsx")
+
+# Не чаще одного редактирования статуса за столько секунд: лимиты Telegram на editMessageText
+PROGRESS_INTERVAL = 3.0
+
+REJECTED_HEADERS = ["Строка"] + EXPORT_HEADERS + ["Причина"]
+
+SERVICE_PATTERNS = {
+    "Яндекс": YANDEX_SCOOTER_PATTERN,
+    "Whoosh": WOOSH_SCOOTER_PATTERN,
+    "Jet": JET_SCOOTER_PATTERN,
+    "Bolt": BOLT_SCOOTER_PATTERN,
+}
+
+# Ник и ID могут отсутствовать; остальные столбцы обязательны
+_OPTIONAL_HEADERS = {"ID", "Ник"}
+
+# Один импорт за раз: пачки большого файла не должны чередоваться с другим файлом
+import_lock = asyncio.Lock()
+
+def _int(value) -> int:
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return int(str(value).strip())
+
+def _text(value) -> str:
+    return "" if value is None else str(value).strip()
+
+def _service(value) -> str:
+    name = _text(value)
+    if name in SERVICE_PATTERNS:
+        return name
+    service = SERVICE_ALIASES.get(name.lower())
+    if service is None:
+        raise ValueError(f"неизвестный сервис «{name}»")
+    return service
+
+def _accepted_at(value) -> datetime.datetime:
+    if isinstance(value, datetime.datetime):
+        accepted = value.replace(tzinfo=None, microsecond=0)
+    else:
+        try:
+            accepted = datetime.datetime.fromisoformat(_text(value)).replace(tzinfo=None, microsecond=0)
+        except ValueError:
+            raise ValueError(f"время «{_text(value)}» не в формате ГГГГ-ММ-ДД ЧЧ:ММ:СС")
+    if accepted > datetime.datetime.now(TIMEZONE).replace(tzinfo=None):
+        raise ValueError("время приема в будущем")
+    return accepted
+
+def _db_time(accepted: datetime.datetime):
+    # Время в файле — локальное время бота, как в выгрузке
+    if SQL_DIALECT == "postgres":
+        return accepted.replace(tzinfo=TIMEZONE)
+    return accepted.strftime("%Y-%m-%d %H:%M:%S")
+
+def parse_row(values: dict) -> tuple:
+    """
+    Строка файла (заголовок → значение) в кортеж для db_write_batch. Ошибка — ValueError с причиной.
+    """
+    service = _service(values["Сервис"])
+    number = _text(values["Номер Самоката"])
+    # Номера пакетного приема пишутся как СЕРВИС_BATCH_..., шаблону номера они не соответствуют
+    if not number.upper().startswith(f"{service.upper()}_BATCH_"):
+        if not SERVICE_PATTERNS[service].fullmatch(number):
+            raise ValueError(f"номер «{number}» не похож на номер {service}")
+        number = number.replace('-', '').upper()
+    try:
+        user_id = _int(values["ID Пользователя"])
+    except (TypeError, ValueError):
+        raise ValueError("ID пользователя не число")
+    try:
+        chat_id = _int(values["ID Чата"])
+    except (TypeError, ValueError):
+        raise ValueError("ID чата не число")
+    fullname = _text(values["Полное имя"])
+    if not fullname:
+        raise ValueError("пустое полное имя")
+    username = _text(values.get("Ник")).lstrip("@") or None
+    accepted = _accepted_at(values["Время Принятия"])
+    return (number, service, user_id, username, fullname, _db_time(accepted), chat_id, None, None)
+
+class _Reader:
+    """
+    Построчное чтение файла и проверка строк; отклоненные строки сразу пишутся в CSV.
+    Методы синхронные — вызываются в потоке.
+    """
+    def __init__(self, file, filename: str, closed: tuple = (None, frozenset())):
+        self._rolled_until, self._archived = closed
+        self._workbook = None
+        name = filename.lower()
+        if name.endswith(".xlsx"):
+            # openpyxl импортируется при первом импорте, а не при старте бота
+            from openpyxl import load_workbook
+            self._workbook = load_workbook(file, read_only=True, data_only=True)
+            sheet = self._workbook["Все данные"] if "Все данные" in self._workbook.sheetnames else self._workbook.worksheets[0]
+            self._rows = sheet.iter_rows(values_only=True)
+        else:
+            raw = gzip.GzipFile(fileobj=file, mode="rb") if name.endswith(".gz") else file
+            self._rows = csv.reader(io.TextIOWrapper(raw, encoding="utf-8-sig", newline=""))
+
+        header = [_text(value) for value in next(self._rows, None) or ()]
+        missing = [name for name in EXPORT_HEADERS if name not in header and name not in _OPTIONAL_HEADERS]
+        if missing:
+            raise ValueError(f"в первой строке нет столбцов: {', '.join(missing)}")
+        self._columns = {name: header.index(name) for name in EXPORT_HEADERS if name in header}
+        self.line = 1
+        self.rejected = 0
+        self.done = False
+        self._rejected_file = None
+        self._rejected_writer = None
+
+    def _reject(self, row: tuple, reason: str):
+        if self._rejected_writer is None:
+            self._rejected_file = new_spool()
+            self._rejected_text = io.TextIOWrapper(self._rejected_file, encoding="utf-8-sig", newline="")
+            self._rejected_writer = csv.writer(self._rejected_text)
+            self._rejected_writer.writerow(REJECTED_HEADERS)
+        values = [row[self._columns[name]] if name in self._columns and self._columns[name] < len(row) else "" for name in EXPORT_HEADERS]
+        self._rejected_writer.writerow([self.line] + values + [reason])
+        self.rejected += 1
+
+    def read_chunk(self, size: int) -> list[tuple]:
+        records = []
+        while len(records) < size:
+            row = next(self._rows, None)
+            if row is None:
+                self.done = True
+                break
+            self.line += 1
+            if not any(_text(value) for value in row):
+                continue
+            values = {name: row[index] if index < len(row) else None for name, index in self._columns.items()}
+            try:
+                record = parse_row(values)
+                self._check_open(record[5])
+                records.append(record)
+            except (KeyError, ValueError) as e:
+                self._reject(row, str(e) or "некорректная строка")
+        return records
+
+    def _check_open(self, accepted):
+        # Повтор строки из архива или сводки основная база не распознает: такие строки не пишутся
+        day = datetime.date.fromisoformat(str(accepted)[:10])
+        if day.replace(day=1) in self._archived:
+            raise ValueError("месяц уже перенесен в архив")
+        if self._rolled_until is not None and day <= self._rolled_until:
+            raise ValueError("день уже свернут в дневную сводку")
+
+    def rejected_file(self):
+        """
+        CSV с отклоненными строками (None, если таких нет), перемотанный в начало.
+        """
+        if self._rejected_writer is None:
+            return None
+        self._rejected_text.flush()
+        # Отсоединяем обертку, чтобы ее закрытие не закрыло сам буфер
+        self._rejected_text.detach()
+        self._rejected_file.seek(0)
+        return self._rejected_file
+
+    def close(self):
+        if self._workbook is not None:
+            self._workbook.close()
+
+async def import_file(file, filename: str, progress=None) -> dict:
+    """
+    Импортирует файл пачками. progress(stats) вызывается не чаще раза в PROGRESS_INTERVAL
+    секунд. Результат: rows, inserted, duplicates, rejected, seconds и rejected_file —
+    CSV отклоненных строк (закрывает вызывающий) или None.
+    Ошибка формата всего файла (нет нужных столбцов) — ValueError.
+    """
+    started = time.perf_counter()
+    reader = await asyncio.to_thread(_Reader, file, filename, await closed_history())
+    stats = {"rows": 0, "inserted": 0, "duplicates": 0, "rejected": 0}
+    last_progress = time.monotonic()
+    try:
+        while not reader.done:
+            records = await asyncio.to_thread(reader.read_chunk, IMPORT_CHUNK_ROWS)
+            if records:
+                inserted = await db_write_batch(records)
+                stats["inserted"] += inserted
+                stats["duplicates"] += len(records) - inserted
+            stats["rows"] = reader.line - 1
+            stats["rejected"] = reader.rejected
+            if progress is not None and time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                await progress(dict(stats))
+        stats["rejected_file"] = await asyncio.to_thread(reader.rejected_file)
+    finally:
+        await asyncio.to_thread(reader.close)
+    if stats["inserted"]:
+        user_stats.invalidate()
+    stats["seconds"] = time.perf_counter() - started
+    for outcome in ("inserted", "duplicates", "rejected"):
+        IMPORTED_ROWS.labels(outcome).inc(stats[outcome])
+    logging.info(
+        f"📥 Импорт {filename}: строк {stats['rows']}, добавлено {stats['inserted']}, "
+        f"уже были {stats['duplicates']}, отклонено {stats['rejected']} за {stats['seconds']:.1f} с"
+    )
+    return stats
@@ -0,0 +1,95 @@
+# leader.py
+# Выбор лидера среди процессов бота: задачи планировщика (отчеты, архивация, бэкап)
+# выполняет только процесс, который держит advisory lock в PostgreSQL. Блокировка
+# привязана к сессии: если лидер падает, его сессия закрывается, и блокировку берет
+# следующий процесс при очередной попытке.
+from database import SQL_DIALECT
+from metrics import IS_LEADER, LEADER_CHANGES
+import asyncio
+import logging
+import os
+import socket
+
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+class LeaderElection:
+    """
+    Раз в poll_seconds последователь пытается взять pg_try_advisory_lock, а лидер
+    проверяет, что его сессия жива. on_elected/on_lost вызываются при смене роли.
+    """
+    def __init__(self, lock_key: int, poll_seconds: float, on_elected, on_lost):
+        self.lock_key = lock_key
+        self.poll_seconds = poll_seconds
+        self.on_elected = on_elected
+        self.on_lost = on_lost
+        self.is_leader = False
+        self._conn = None
+        self._stopped = False
+
+    async def run(self):
+        if SQL_DIALECT != "postgres":
+            # SQLite: с файлом базы работает один процесс, он и лидер
+            self._elected()
+            return
+        while not self._stopped:
+            try:
+                await self._tick()
+            except Exception as e:
+                logging.warning(f"⚠️ Выбор лидера: {e!r}")
+                self._drop_session()
+            await asyncio.sleep(self.poll_seconds)
+
+    async def _connect(self):
+        import asyncpg
+        from config import DATABASE_URL
+        # Keepalive короче стандартного: сервер быстрее заметит пропавшего лидера и снимет блокировку
+        keepalive = str(max(int(self.poll_seconds), 1))
+        return await asyncpg.connect(DATABASE_URL, server_settings={
+            'application_name': f"scooter_bot {INSTANCE_ID}",
+            'tcp_keepalives_idle': keepalive,
+            'tcp_keepalives_interval': keepalive,
+            'tcp_keepalives_count': '3',
+        })
+
+    async def _tick(self):
+        if self._conn is None or self._conn.is_closed():
+            if self.is_leader:
+                self._lost()
+            self._conn = await self._connect()
+        if self.is_leader:
+            # Пока сессия жива, блокировка за нами; не ответила вовремя — считаем ее потерянной
+            await asyncio.wait_for(self._conn.fetchval("SELECT 1"), self.poll_seconds)
+        elif await self._conn.fetchval("SELECT pg_try_advisory_lock($1)", self.lock_key):
+            self._elected()
+
+    def _drop_session(self):
+        if self.is_leader:
+            self._lost()
+        if self._conn is not None:
+            self._conn.terminate()
+            self._conn = None
+
+    def _elected(self):
+        self.is_leader = True
+        IS_LEADER.set(1)
+        LEADER_CHANGES.labels("elected").inc()
+        logging.info(f"👑 {INSTANCE_ID} выполняет задачи планировщика")
+        self.on_elected()
+
+    def _lost(self):
+        self.is_leader = False
+        IS_LEADER.set(0)
+        LEADER_CHANGES.labels("lost").inc()
+        logging.warning(f"⚠️ {INSTANCE_ID} потерял лидерство, задачи планировщика приостановлены")
+        self.on_lost()
+
+    async def stop(self):
+        """
+        Закрывает сессию: блокировка освобождается сразу, не дожидаясь keepalive.
+        """
+        self._stopped = True
+        if self._conn is not None and not self._conn.is_closed():
+            await self._conn.close()
+        self._conn = None
+        self.is_leader = False
+        IS_LEADER.set(0)
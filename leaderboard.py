@@ -0,0 +1,133 @@
+# leaderboard.py
+# Таблица лидеров смены в группах из LEADERBOARD_CHAT_IDS: одно закрепленное сообщение на
+# смену, которое редактируется, а не запросы /today_stats и длинные ответы. Итоги группы
+# держатся в памяти и пополняются при каждой приемке; раз в LEADERBOARD_RESYNC_SECONDS они
+# перечитываются из базы одним запросом (строки, принятые другими процессами, удаления).
+# Обновление — задача планировщика, поэтому сообщения редактирует только лидер.
+from aiogram.utils.exceptions import MessageNotModified, MessageToEditNotFound
+from config import LEADERBOARD_CHAT_IDS, LEADERBOARD_TOP, LEADERBOARD_RESYNC_SECONDS, TIMEZONE
+from database import chat_shift_totals, leaderboard_message, set_leaderboard_message
+from shifts import current_shift
+from metrics import LEADERBOARD_UPDATES
+from collections import defaultdict
+import datetime
+import heapq
+import html
+import logging
+import time
+
+class ShiftBoard:
+    """
+    Итоги одной группы за смену: по пользователям и по сервисам.
+    """
+    def __init__(self, chat_id: int, start_dt: datetime.datetime, end_dt: datetime.datetime, shift_name: str):
+        self.chat_id = chat_id
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        self.shift_name = shift_name
+        self.user_counts = defaultdict(int)
+        self.names = {}
+        self.service_counts = defaultdict(int)
+        self.message_id = None
+        self.text = None
+        self.synced_at = None
+
+    def add(self, user_id: int, name: str, accepted: dict):
+        self.names[user_id] = name
+        for service, count in accepted.items():
+            self.user_counts[user_id] += count
+            self.service_counts[service] += count
+
+    def load(self, rows: list):
+        self.user_counts.clear()
+        self.service_counts.clear()
+        for user_id, username, fullname, service, count in rows:
+            self.add(user_id, f"@{username}" if username else fullname, {service: count})
+
+    def render(self, top: int) -> str:
+        parts = [f"<b>🏆 Лидеры за {self.shift_name} ({self.start_dt.strftime('%H:%M')} - {self.end_dt.strftime('%H:%M')})</b>"]
+        leaders = heapq.nlargest(top, self.user_counts.items(), key=lambda item: item[1])
+        if not leaders:
+            parts.append("\nПока ничего не принято.")
+            return "\n".join(parts)
+        parts.append("")
+        for place, (user_id, count) in enumerate(leaders, 1):
+            parts.append(f"{place}. {html.escape(self.names.get(user_id) or f'ID: {user_id}')} — {count} шт.")
+        parts.append("\n<b>По сервисам:</b>")
+        for service, count in sorted(self.service_counts.items()):
+            parts.append(f"{service}: {count} шт.")
+        parts.append(f"\n<b>Всего: {sum(self.service_counts.values())} шт.</b>")
+        return "\n".join(parts)
+
+class Leaderboards:
+    """
+    Таблицы лидеров текущей смены по группам. refresh() вызывается планировщиком
+    каждые LEADERBOARD_INTERVAL секунд и редактирует сообщение, только если текст изменился.
+    """
+    def __init__(self, chat_ids, top: int, resync_seconds: float):
+        self.chat_ids = set(chat_ids)
+        self.top = top
+        self.resync_seconds = resync_seconds
+        self._boards = {}
+
+    def record(self, chat_id: int, user_id: int, name: str, accepted: dict):
+        """
+        Приемка из сообщения группы. Пока таблицы этой смены нет (процесс не лидер,
+        смена еще не обновлялась), строку учтет следующее чтение из базы.
+        """
+        board = self._boards.get(chat_id)
+        if board is None or not board.start_dt <= datetime.datetime.now(TIMEZONE) < board.end_dt:
+            return
+        board.add(user_id, name, accepted)
+
+    async def refresh(self, bot):
+        for chat_id in self.chat_ids:
+            try:
+                await self._refresh_chat(bot, chat_id)
+            except Exception as e:
+                logging.warning(f"⚠️ Таблица лидеров в {chat_id} не обновлена: {e!r}")
+
+    async def _refresh_chat(self, bot, chat_id: int):
+        start_dt, end_dt, shift_name = current_shift()
+        # Между сменами остается таблица закончившейся смены
+        if start_dt is None or start_dt > datetime.datetime.now(TIMEZONE):
+            return
+        board = self._boards.get(chat_id)
+        if board is None or board.start_dt != start_dt:
+            board = ShiftBoard(chat_id, start_dt, end_dt, shift_name)
+            self._boards[chat_id] = board
+            stored = await leaderboard_message(chat_id)
+            if stored is not None and stored[0] == start_dt.isoformat():
+                board.message_id = stored[1]
+
+        if board.synced_at is None or time.monotonic() - board.synced_at >= self.resync_seconds:
+            board.load(await chat_shift_totals(chat_id, start_dt, end_dt))
+            board.synced_at = time.monotonic()
+
+        text = board.render(self.top)
+        if board.message_id is None:
+            message = await bot.send_message(chat_id, text, parse_mode="HTML", disable_notification=True)
+            board.message_id = message.message_id
+            board.text = text
+            await set_leaderboard_message(chat_id, start_dt.isoformat(), message.message_id)
+            LEADERBOARD_UPDATES.labels("posted").inc()
+            logging.info(f"🏆 Таблица лидеров за {shift_name} опубликована в {chat_id}")
+            try:
+                await bot.pin_chat_message(chat_id, message.message_id, disable_notification=True)
+            except Exception as e:
+                logging.warning(f"⚠️ Не удалось закрепить таблицу лидеров в {chat_id}: {e!r}")
+            return
+        if text == board.text:
+            return
+        try:
+            await bot.edit_message_text(text, chat_id, board.message_id, parse_mode="HTML")
+        except MessageNotModified:
+            pass
+        except MessageToEditNotFound:
+            # Сообщение удалили: в следующий раз будет опубликовано новое
+            board.message_id = None
+            return
+        board.text = text
+        LEADERBOARD_UPDATES.labels("edited").inc()
+
+leaderboards = Leaderboards(LEADERBOARD_CHAT_IDS, LEADERBOARD_TOP, LEADERBOARD_RESYNC_SECONDS)
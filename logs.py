@@ -0,0 +1,242 @@
+# logs.py
+# Логирование через очередь: запись на диск, ротация и сжатие идут в отдельном потоке,
+# а не в event loop. Сетевые трейсбеки одного вида схлопываются в одну запись за окно.
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from metrics import Counter
+import asyncio
+import atexit
+import copy
+import datetime
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+import time
+
+LOG_RECORDS_DROPPED = Counter("scooter_bot_log_records_dropped_total", "Записи лога, отброшенные из-за переполненной очереди")
+LOG_RECORDS_SUPPRESSED = Counter("scooter_bot_log_records_suppressed_total", "Повторные сетевые ошибки, схлопнутые дедупликацией")
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Контекст текущего апдейта: update_id, chat_id, handler и момент начала обработки
+_update_context = ContextVar("log_update_context", default=None)
+
+_listener = None
+
+def _network_error_types() -> tuple:
+    import aiohttp
+    from aiogram.utils.exceptions import NetworkError, RetryAfter
+    return (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError, NetworkError, RetryAfter)
+
+class UpdateContextFilter(logging.Filter):
+    """
+    Добавляет к записи поля текущего апдейта. Стоит на QueueHandler,
+    чтобы контекст читался в потоке, который пишет в лог.
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _update_context.get()
+        if context is None:
+            record.update_id = record.chat_id = record.handler = record.duration_ms = None
+        else:
+            record.update_id = context.get('update_id')
+            record.chat_id = context.get('chat_id')
+            record.handler = context.get('handler')
+            record.duration_ms = round((time.perf_counter() - context['started']) * 1000, 1)
+        return True
+
+class NetworkErrorDedupFilter(logging.Filter):
+    """
+    Первая сетевая ошибка за окно пишется с трейсбеком, повторы того же типа
+    из того же места отбрасываются; по истечении окна следующая запись сообщает,
+    сколько повторов было пропущено.
+    """
+    def __init__(self, window: float):
+        super().__init__()
+        self.window = window
+        self._seen = {}
+        self._lock = threading.Lock()
+        self._network_errors = None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.window <= 0 or not record.exc_info or record.exc_info[1] is None:
+            return True
+        if self._network_errors is None:
+            self._network_errors = _network_error_types()
+        exc = record.exc_info[1]
+        if not isinstance(exc, self._network_errors):
+            return True
+
+        key = (type(exc).__name__, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            first_seen, suppressed = self._seen.get(key, (None, 0))
+            if first_seen is not None and now - first_seen < self.window:
+                self._seen[key] = (first_seen, suppressed + 1)
+                LOG_RECORDS_SUPPRESSED.inc()
+                return False
+            self._seen[key] = (now, 0)
+        if suppressed:
+            record.msg = f"{record.getMessage()} (повторов за {self.window:.0f} с: {suppressed})"
+            record.args = None
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """
+    Одна JSON-строка на запись: время, уровень, сообщение, поля апдейта и трейсбек.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in ("update_id", "chat_id", "handler", "duration_ms"):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class _BoundedQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Как в QueueHandler.prepare, но трейсбек остается отдельно в exc_text —
+        # его оформляет форматтер нужного обработчика (текст или JSON)
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+class CompressedRotatingFileHandler(RotatingFileHandler):
+    """
+    Ротация по размеру и по времени (границы периода по локальному времени),
+    старые файлы сжимаются в .gz.
+    """
+    def __init__(self, filename: str, max_bytes: int, backup_count: int, interval_hours: float):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        # Без резервных копий ротация по времени не сдвинула бы файл
+        self.interval = int(interval_hours * 3600) if backup_count > 0 else 0
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self._compress
+        self.rollover_at = self._next_rollover(time.time())
+
+    def _next_rollover(self, now: float) -> float:
+        if self.interval <= 0:
+            return float('inf')
+        offset = time.localtime(now).tm_gmtoff
+        return ((int(now) + offset) // self.interval + 1) * self.interval - offset
+
+    @staticmethod
+    def _compress(source: str, dest: str):
+        with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if time.time() >= self.rollover_at:
+            if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+                return True
+            self.rollover_at = self._next_rollover(time.time())
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = self._next_rollover(time.time())
+
+def setup_logging(
+    log_file: str = 'bot.log',
+    level: str = 'INFO',
+    json_format: bool = False,
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 10,
+    rotate_hours: float = 24,
+    dedup_window: float = 60,
+    queue_size: int = 10000,
+) -> QueueListener:
+    """
+    Настраивает корневой логгер: QueueHandler в вызывающем потоке,
+    файл и консоль — в потоке QueueListener. Повторный вызов ничего не меняет.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers = [console]
+    # Дочерние процессы (пул сборки отчетов) пишут только в консоль: файл и его ротацию ведет основной процесс
+    if log_file and multiprocessing.parent_process() is None:
+        file_handler = CompressedRotatingFileHandler(log_file, max_bytes, backup_count, rotate_hours)
+        file_handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+        handlers.append(file_handler)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = _BoundedQueueHandler(log_queue)
+    queue_handler.addFilter(UpdateContextFilter())
+    queue_handler.addFilter(NetworkErrorDedupFilter(dedup_window))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+def stop_logging():
+    """
+    Дописывает очередь на диск и останавливает поток записи.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+class LogContextMiddleware(BaseMiddleware):
+    """
+    Заполняет контекст логирования для каждого апдейта.
+    """
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        data['_log_token'] = _update_context.set({'update_id': update.update_id, 'started': time.perf_counter()})
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        context = _update_context.get()
+        if context is not None:
+            context['chat_id'] = message.chat.id
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        context = _update_context.get()
+        handler = current_handler.get()
+        if context is not None and handler is not None:
+            context['handler'] = handler.__name__
+
+    async def on_post_process_update(self, update: types.Update, results: list, data: dict):
+        token = data.get('_log_token')
+        if token is None:
+            return
+        logging.debug("Апдейт обработан")
+        _update_context.reset(token)
@@ -0,0 +1,222 @@
+# metrics.py
+# Метрики в текстовом формате Prometheus и HTTP-эндпоинт /metrics.
+# Счетчики — обычные int в памяти: на горячем пути это одно сложение.
+from aiohttp import web
+import bisect
+import functools
+import logging
+import time
+
+_registry = []
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    parts = ['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in zip(label_names, label_values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        _registry.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, child in sorted(self._children.items(), key=lambda item: item[0]):
+            lines.extend(child.render(self.name, self.labelnames, label_values))
+        return lines
+
+class _ValueChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def render(self, name, label_names, label_values):
+        value = self.function() if self.function else self.value
+        return [f"{name}{_format_labels(label_names, label_values)} {value}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default().dec(amount)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _HistogramTimer(self)
+
+    def render(self, name, label_names, label_values):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            bucket_labels = _format_labels(label_names, label_values, 'le="%s"' % bound)
+            lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+        inf_labels = _format_labels(label_names, label_values, 'le="+Inf"')
+        lines.append(f"{name}_bucket{inf_labels} {self.count}")
+        lines.append(f"{name}_sum{_format_labels(label_names, label_values)} {self.sum}")
+        lines.append(f"{name}_count{_format_labels(label_names, label_values)} {self.count}")
+        return lines
+
+class _HistogramTimer:
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.child.observe(time.perf_counter() - self.started)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _HistogramTimer(self.child):
+                return func(*args, **kwargs)
+        return wrapper
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+MESSAGES_PARSED = Counter("scooter_bot_messages_parsed_total", "Сообщения, прошедшие разбор номеров")
+SCOOTERS_ACCEPTED = Counter("scooter_bot_scooters_accepted_total", "Принятые самокаты по сервисам", ("service",))
+DB_WRITE_BATCH_SIZE = Histogram("scooter_bot_db_write_batch_size", "Размер пачки db_write_batch", buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000))
+DB_QUERY_SECONDS = Histogram("scooter_bot_db_query_seconds", "Длительность запросов к базе", ("function",))
+REPORT_BUILD_SECONDS = Histogram("scooter_bot_report_build_seconds", "Длительность сборки отчетов", ("report",))
+SHIFT_REPORT_RECONCILES = Counter("scooter_bot_shift_report_reconciles_total", "Полные перечитывания смены при сверке отчета с базой")
+BACKUP_SECONDS = Histogram("scooter_bot_backup_seconds", "Длительность онлайн-бэкапа SQLite", buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800))
+BACKUP_SIZE_BYTES = Gauge("scooter_bot_backup_size_bytes", "Размер последнего снимка базы")
+BACKUP_LAST_SUCCESS = Gauge("scooter_bot_backup_last_success_timestamp", "Время последнего успешного бэкапа")
+BACKUP_RESTARTS = Counter("scooter_bot_backup_restarts_total", "Перезапуски пошагового бэкапа из-за записи в базу")
+WAL_CHECKPOINT_PAGES = Gauge("scooter_bot_wal_checkpoint_pages", "Страницы WAL при последнем checkpoint: всего в журнале и перенесено в базу", ("state",))
+WAL_CHECKPOINT_BUSY = Counter("scooter_bot_wal_checkpoint_busy_total", "Checkpoint, не завершенные из-за активных читателей или писателей")
+WAL_SIZE_BYTES = Gauge("scooter_bot_wal_size_bytes", "Текущий размер файла WAL")
+ROWS_ROLLED_UP = Counter("scooter_bot_rows_rolled_up_total", "Строки, свернутые в дневную сводку")
+STORAGE_RECLAIMED_BYTES = Counter("scooter_bot_storage_reclaimed_bytes_total", "Место, освобожденное компакцией базы")
+IS_LEADER = Gauge("scooter_bot_is_leader", "1, если процесс выполняет задачи планировщика")
+LEADER_CHANGES = Counter("scooter_bot_leader_changes_total", "Смены лидерства этого процесса", ("event",))
+REPORT_DELIVERIES = Counter("scooter_bot_report_deliveries_total", "Отправки отчетов по результату захвата", ("outcome",))
+DUPLICATE_UPDATES = Counter("scooter_bot_duplicate_updates_total", "Повторно доставленные апдейты и сообщения, пропущенные без записи", ("source",))
+IMPORTED_ROWS = Counter("scooter_bot_imported_rows_total", "Строки импортированных файлов по результату", ("outcome",))
+REPORT_COALESCED = Counter("scooter_bot_report_requests_total", "Запросы отчетов: запустившие сборку и присоединившиеся к идущей", ("report", "outcome"))
+MY_STATS_REQUESTS = Counter("scooter_bot_my_stats_requests_total", "Запросы /my_stats: из кэша, с запросом к базе и отклоненные лимитом", ("outcome",))
+LEADERBOARD_UPDATES = Counter("scooter_bot_leaderboard_updates_total", "Таблицы лидеров: опубликованные и отредактированные сообщения", ("action",))
+DB_READS = Counter("scooter_bot_db_reads_total", "Чтения по серверу: основной или реплика", ("target",))
+REPLICA_LAG_SECONDS = Gauge("scooter_bot_replica_lag_seconds", "Отставание реплики при последней проверке (-1 — недоступна)", ("replica",))
+AGGREGATE_REFRESH_SECONDS = Gauge("scooter_bot_aggregate_refresh_seconds", "Длительность последнего обновления представления агрегатов", ("view",))
+TELEGRAM_ERRORS = Counter("scooter_bot_telegram_errors_total", "Ошибки Bot API по типам", ("method", "error"))
+SCHEDULER_JOBS = Counter("scooter_bot_scheduler_jobs_total", "Результаты задач планировщика", ("job", "outcome"))
+SCHEDULER_LAST_SUCCESS = Gauge("scooter_bot_scheduler_last_success_timestamp", "Время последнего успешного запуска задачи", ("job",))
+STARTED_AT = Gauge("scooter_bot_start_time_seconds", "Время запуска процесса")
+STARTED_AT.set(time.time())
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def track_scheduler(scheduler):
+    from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED
+
+    def listener(event):
+        if event.code == EVENT_JOB_EXECUTED:
+            SCHEDULER_JOBS.labels(event.job_id, "success").inc()
+            SCHEDULER_LAST_SUCCESS.labels(event.job_id).set(time.time())
+        elif event.code == EVENT_JOB_ERROR:
+            SCHEDULER_JOBS.labels(event.job_id, "error").inc()
+        elif event.code == EVENT_JOB_MISSED:
+            SCHEDULER_JOBS.labels(event.job_id, "missed").inc()
+
+    scheduler.add_listener(listener, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+
+async def _metrics_handler(request):
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server(host: str, port: int):
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"📈 Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,217 @@
+# profiling.py
+# Замеры времени хендлеров, запросов к базе, сборки Excel и отправки в Telegram.
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from config import SLOW_QUERY_MS, PERF_SAMPLES
+from metrics import DB_QUERY_SECONDS, TELEGRAM_ERRORS
+from collections import Counter, defaultdict, deque
+from io import BytesIO
+import contextvars
+import cProfile
+import functools
+import html
+import inspect
+import io
+import logging
+import math
+import pstats
+import time
+
+# (время, имя замера, длительность в секундах)
+_samples = deque(maxlen=PERF_SAMPLES)
+# (время, длительность, функция, SQL, параметры)
+slow_queries = deque(maxlen=200)
+
+# Количество запросов по функциям базы (для бенчмарков и отладки)
+query_calls = Counter()
+
+# Время по секциям (db_fetch_all, excel, telegram...) внутри текущего апдейта
+_sections = contextvars.ContextVar('perf_sections', default=None)
+
+# Админы, чья следующая команда будет снята cProfile
+_profile_armed = set()
+_profile_active = False
+
+def record(name: str, seconds: float):
+    _samples.append((time.time(), name, seconds))
+    sections = _sections.get()
+    if sections is not None:
+        sections[name] += seconds
+
+class timed:
+    """
+    Замер блока кода или функции: `with timed("excel:build"):` или `@timed("excel:build")`.
+    """
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.name, time.perf_counter() - self.started)
+        return False
+
+    def __call__(self, func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timed(self.name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(self.name):
+                return func(*args, **kwargs)
+        return wrapper
+
+def _short_params(params) -> str:
+    if isinstance(params, list) and len(params) > 3:
+        return f"[{len(params)} записей, первая: {params[0]!r}]"
+    text = repr(params)
+    return text if len(text) <= 300 else text[:300] + "..."
+
+class query_timer:
+    """
+    Замер запроса к базе с записью в журнал медленных запросов.
+    """
+    def __init__(self, func_name: str, query: str, params=()):
+        self.func_name = func_name
+        self.query = query
+        self.params = params
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        record(f"db:{self.func_name}", elapsed)
+        query_calls[self.func_name] += 1
+        DB_QUERY_SECONDS.labels(self.func_name).observe(elapsed)
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            query_text = " ".join(self.query.split())
+            slow_queries.append((time.time(), elapsed, self.func_name, query_text, _short_params(self.params)))
+            logging.warning(f"🐢 Медленный запрос ({elapsed * 1000:.0f} мс) в {self.func_name}: {query_text[:300]} | {_short_params(self.params)}")
+        return False
+
+def instrument_bot(bot):
+    """
+    Оборачивает bot.request, чтобы замерять каждый вызов Bot API и считать ошибки
+    (RetryAfter, NetworkError и т.д.) по типам.
+    """
+    original_request = bot.request
+
+    async def request(method, data=None, files=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await original_request(method, data, files, **kwargs)
+        except Exception as e:
+            TELEGRAM_ERRORS.labels(method, type(e).__name__).inc()
+            raise
+        finally:
+            record(f"telegram:{method}", time.perf_counter() - started)
+
+    bot.request = request
+    return bot
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    # Метод ближайшего ранга
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+def latency_summary(minutes: int = 15) -> dict:
+    """
+    Возвращает {имя: (кол-во, p50, p95, p99, max)} в миллисекундах за последние minutes минут.
+    """
+    since = time.time() - minutes * 60
+    values = defaultdict(list)
+    for ts, name, seconds in list(_samples):
+        if ts >= since:
+            values[name].append(seconds * 1000)
+
+    summary = {}
+    for name, durations in values.items():
+        durations.sort()
+        summary[name] = (
+            len(durations),
+            _percentile(durations, 50),
+            _percentile(durations, 95),
+            _percentile(durations, 99),
+            durations[-1],
+        )
+    return summary
+
+def format_report(minutes: int = 15) -> list[str]:
+    summary = latency_summary(minutes)
+    lines = [f"<b>⏱ Задержки за {minutes} мин (мс): кол-во | p50 | p95 | p99 | max</b>"]
+    if not summary:
+        lines.append("Нет замеров.")
+    for name in sorted(summary):
+        count, p50, p95, p99, max_ms = summary[name]
+        lines.append(f"<code>{html.escape(name)}</code>: {count} | {p50:.0f} | {p95:.0f} | {p99:.0f} | {max_ms:.0f}")
+
+    since = time.time() - minutes * 60
+    recent_slow = [item for item in slow_queries if item[0] >= since]
+    if recent_slow:
+        lines.append(f"\n<b>🐢 Медленные запросы (≥ {SLOW_QUERY_MS} мс):</b>")
+        for ts, elapsed, func_name, query_text, params in recent_slow[-10:]:
+            when = time.strftime('%H:%M:%S', time.localtime(ts))
+            lines.append(f"{when} {func_name} {elapsed * 1000:.0f} мс: <code>{html.escape(query_text[:200])}</code>")
+    return lines
+
+def arm_profile(user_id: int):
+    _profile_armed.add(user_id)
+
+class ProfilingMiddleware(BaseMiddleware):
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        global _profile_active
+        data['_perf_started'] = time.perf_counter()
+        data['_perf_token'] = _sections.set(defaultdict(float))
+
+        if message.from_user and message.from_user.id in _profile_armed and message.is_command() and not _profile_active:
+            if message.get_command() != '/profile_next':
+                _profile_armed.discard(message.from_user.id)
+                _profile_active = True
+                profiler = cProfile.Profile()
+                profiler.enable()
+                data['_perf_profiler'] = profiler
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        handler = current_handler.get()
+        if handler is not None:
+            data['_perf_handler'] = handler.__name__
+
+    async def on_post_process_message(self, message: types.Message, results: list, data: dict):
+        global _profile_active
+        started = data.get('_perf_started')
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        handler_name = data.get('_perf_handler', 'unhandled')
+        sections = _sections.get() or {}
+        _sections.reset(data['_perf_token'])
+
+        if handler_name != 'unhandled':
+            _samples.append((time.time(), f"handler:{handler_name}", elapsed))
+            for section, seconds in sections.items():
+                _samples.append((time.time(), f"{handler_name}:{section}", seconds))
+
+        profiler = data.get('_perf_profiler')
+        if profiler is not None:
+            profiler.disable()
+            _profile_active = False
+            text_stream = io.StringIO()
+            pstats.Stats(profiler, stream=text_stream).sort_stats('cumulative').print_stats(60)
+            stream = BytesIO(text_stream.getvalue().encode('utf-8'))
+            try:
+                await message.bot.send_document(
+                    message.chat.id,
+                    types.InputFile(stream, filename=f"profile_{handler_name}.txt"),
+                    caption=f"cProfile: {handler_name}, {elapsed * 1000:.0f} мс"
+                )
+            except Exception as e:
+                logging.error(f"❌ Не удалось отправить профиль: {e}")
+
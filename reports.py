@@ -1,25 +1,170 @@
 # reports.py
 from aiogram import types
-from config import TIMEZONE, REPORT_CHAT_IDS, SERVICE_ALIASES
-from database import db_fetch_all
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment
-from openpyxl.utils import get_column_letter
-from io import BytesIO
+from config import TIMEZONE, REPORT_CHAT_IDS, REPORT_SCOPES, SERVICE_ALIASES, SPOOL_MAX_BYTES, EXPORT_PART_BYTES, EXPORT_WORKERS, EXPORT_CHUNK_ROWS, REPORT_BUILD_CONCURRENCY
+from database import db_fetch_all, db_iter_chunks, db_time_bounds, claim_delivery, mark_delivered, release_delivery, delivered_chats
+from shifts import shift_range, shift_title, SHIFT_NAMES
+from profiling import timed
+from metrics import REPORT_BUILD_SECONDS, SHIFT_REPORT_RECONCILES, REPORT_DELIVERIES
+from watchdog import supervised
+from leader import INSTANCE_ID
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import aiohttp.payload
+import asyncio
+import contextlib
+import csv
 import datetime
+import gzip
+import io
 import logging
-from collections import defaultdict
+import mmap
+import multiprocessing
+import os
+import tempfile
+import zipfile
+from collections import defaultdict, deque
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-scheduler = AsyncIOScheduler(timezone=str(TIMEZONE))
+scheduler = AsyncIOScheduler(timezone=TIMEZONE)
+
+EXPORT_HEADERS = ["ID", "Номер Самоката", "Сервис", "ID Пользователя", "Ник", "Полное имя", "Время Принятия", "ID Чата"]
+
+def new_spool():
+    """
+    Буфер для файла отчета: в памяти до SPOOL_MAX_BYTES, дальше — временный файл на диске
+    (без имени в файловой системе, поэтому удаляется при закрытии или падении процесса).
+    """
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+
+def spool_size(spool) -> int:
+    position = spool.tell()
+    spool.seek(0, io.SEEK_END)
+    size = spool.tell()
+    spool.seek(position)
+    return size
+
+class _BufferReader(io.RawIOBase):
+    """
+    Читатель поверх общего буфера (mmap или memoryview) со своей позицией:
+    файл можно отправить в несколько чатов без копий, а aiogram, закрывая
+    InputFile после отправки, закрывает только читателя, но не сам отчет.
+    """
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._buffer)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def remaining(self) -> int:
+        return max(0, len(self._buffer) - self._pos)
+
+    def readinto(self, target) -> int:
+        chunk = self._buffer[self._pos:self._pos + len(target)]
+        size = len(chunk)
+        target[:size] = chunk
+        self._pos += size
+        return size
+
+class _BufferPayload(aiohttp.payload.IOBasePayload):
+    # Размер известен заранее — загрузка идет с Content-Length, без chunked
+    @property
+    def size(self) -> int:
+        return self._value.remaining()
+
+aiohttp.payload.PAYLOAD_REGISTRY.register(_BufferPayload, _BufferReader, order=aiohttp.payload.Order.try_first)
+
+@contextlib.contextmanager
+def upload_buffer(spool):
+    """
+    Общий буфер файла отчета для отправки: mmap временного файла, на котором лежит
+    спул. Содержимое не копируется в память процесса.
+    """
+    # Маленький отчет еще в памяти: rollover() переносит его во временный файл
+    # (обычно он остается в page cache), дальше чтение идет через публичный fileno()
+    spool.rollover()
+    spool.flush()
+    if os.fstat(spool.fileno()).st_size == 0:
+        # Пустой файл не отображается в память
+        buffer = memoryview(b"")
+        release = buffer.release
+    else:
+        buffer = mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+        release = buffer.close
+    try:
+        yield buffer
+    finally:
+        release()
+
+def upload_file(buffer, filename: str) -> types.InputFile:
+    return types.InputFile(_BufferReader(buffer), filename=filename)
+
+class SharedReport:
+    """
+    Готовый файл отчета для нескольких получателей: каждый отправляет его через свой
+    буфер, а закрывает файл тот, кто отправил последним (см. singleflight).
+    """
+    def __init__(self, file, filename: str, caption: str):
+        self.file = file
+        self.filename = filename
+        self.caption = caption
+
+    async def send(self, bot, chat_id: int):
+        with upload_buffer(self.file) as buffer:
+            await bot.send_document(chat_id, upload_file(buffer, self.filename), caption=self.caption)
+
+    def close(self):
+        self.file.close()
+
+_build_slots = asyncio.Semaphore(REPORT_BUILD_CONCURRENCY)
+
+async def build_report(func, *args):
+    """
+    Сборка отчета в потоке; одновременно собирается не больше REPORT_BUILD_CONCURRENCY
+    отчетов, чтобы пики памяти openpyxl не складывались.
+    """
+    async with _build_slots:
+        return await asyncio.to_thread(func, *args)
+
+def summarize_users(records: list, counts: dict = None, names: dict = None) -> tuple[dict, dict]:
+    """
+    Итоги по пользователям: {user_id: количество} и {user_id: отображаемое имя}.
+    Можно передать уже накопленные словари, чтобы дополнить их новыми строками.
+    """
+    counts = defaultdict(int) if counts is None else counts
+    names = {} if names is None else names
+    for record in records:
+        user_id = record[3]
+        username = record[4]
+        fullname = record[5]
+        names[user_id] = fullname if fullname else (f"@{username}" if username else f"ID: {user_id}")
+        counts[user_id] += 1
+    return counts, names
+
+@timed("excel:create_excel_report")
+@REPORT_BUILD_SECONDS.labels("create_excel_report").time()
+def create_excel_report(records: list[tuple], user_totals: tuple = None):
+    # openpyxl импортируется при первом экспорте, а не при старте бота
+    from openpyxl import Workbook
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
 
-def create_excel_report(records: list[tuple]) -> BytesIO:
     wb = Workbook()
     ws_all_data = wb.active
     ws_all_data.title = "Все данные"
 
-    headers_all_data = ["ID", "Номер Самоката", "Сервис", "ID Пользователя", "Ник", "Полное имя", "Время Принятия", "ID Чата"]
-    ws_all_data.append(headers_all_data)
+    ws_all_data.append(EXPORT_HEADERS)
     header_font = Font(bold=True)
     for cell in ws_all_data[1]:
         cell.font = header_font
@@ -45,16 +190,10 @@ def create_excel_report(records: list[tuple]) -> BytesIO:
     for cell in ws_totals[1]:
         cell.font = header_font
 
-    user_total_counts_summary = defaultdict(int)
-    user_info_map_summary = {}
-
-    for record in records:
-        user_id = record[3]
-        username = record[4]
-        fullname = record[5]
-        display_name = fullname if fullname else (f"@{username}" if username else f"ID: {user_id}")
-        user_total_counts_summary[user_id] += 1
-        user_info_map_summary[user_id] = display_name
+    # Итоги могут прийти готовыми (ShiftReportBuilder копит их в течение смены)
+    if user_totals is None:
+        user_totals = summarize_users(records)
+    user_total_counts_summary, user_info_map_summary = user_totals
 
     sorted_user_ids_summary = sorted(user_total_counts_summary.keys(), key=lambda user_id: user_info_map_summary[user_id].lower())
 
@@ -77,72 +216,419 @@ def create_excel_report(records: list[tuple]) -> BytesIO:
         adjusted_width = (max_length + 2) * 1.2
         ws_totals.column_dimensions[column_letter].width = adjusted_width
 
-    buffer = BytesIO()
+    buffer = new_spool()
     wb.save(buffer)
     buffer.seek(0)
     return buffer
 
-def create_monthly_excel_report(data: list[list], month_start_dt: datetime.datetime) -> BytesIO:
+def get_services(extra=()) -> list[str]:
     """
-    Создает Excel файл с отчетом за месяц в простом виде:
-    Столбцы: Пользователь | Bolt | Jet | Whoosh | Яндекс | Итого
+    Список сервисов для сводных отчетов: все сервисы из SERVICE_ALIASES
+    плюс встретившиеся в данных (например, старые записи).
     """
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"{month_start_dt.strftime('%B_%Y')}"
+    return sorted(set(SERVICE_ALIASES.values()) | set(extra))
+
+def _day_label(day) -> str:
+    return datetime.date.fromisoformat(str(day)[:10]).strftime('%d.%m')
+
+def build_monthly_pivot(rows: list, with_days: bool = False) -> tuple[list, list[list]]:
+    """
+    Строит сводную таблицу из строк агрегирующего запроса
+    (user_id, username, fullname, service, day, count).
+    Возвращает заголовки и строки: Пользователь | <сервисы> | Итого | [дни].
+    """
+    user_info = {}
+    user_services = defaultdict(lambda: defaultdict(int))
+    user_days = defaultdict(lambda: defaultdict(int))
+    days = set()
+
+    for user_id, username, fullname, service, day, count in rows:
+        user_services[user_id][service] += count
+        if user_id not in user_info:
+            user_info[user_id] = f"@{username}" if username else fullname
+        if with_days and day is not None:
+            day_key = str(day)[:10]
+            user_days[user_id][day_key] += count
+            days.add(day_key)
+
+    services = get_services({service for counts in user_services.values() for service in counts})
+    sorted_days = sorted(days)
 
-    # Заголовки (только нужные)
-    headers = ["Пользователь", "Bolt", "Jet", "Whoosh", "Яндекс", "Итого"]
-    ws.append(headers)
+    headers = ["Пользователь", *services, "Итого"]
+    if with_days:
+        headers += [_day_label(day) for day in sorted_days]
 
-    # Шрифт для заголовков
+    data = []
+    for user_id, counts in user_services.items():
+        row = [user_info[user_id]]
+        row += [counts.get(service, 0) for service in services]
+        row.append(sum(counts.values()))
+        if with_days:
+            row += [user_days[user_id].get(day, 0) for day in sorted_days]
+        data.append(row)
+
+    # Лидер наверху
+    total_idx = len(services) + 1
+    data.sort(key=lambda x: x[total_idx], reverse=True)
+    return headers, data
+
+@timed("excel:create_monthly_excel_report")
+@REPORT_BUILD_SECONDS.labels("create_monthly_excel_report").time()
+def create_monthly_excel_report(sheets: list[tuple[datetime.datetime, list, list[list]]]):
+    """
+    Создает Excel файл с отчетом по месяцам: по одному листу на месяц.
+    sheets — список (начало месяца, заголовки, строки).
+    """
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook()
+    wb.remove(wb.active)
     header_font = Font(bold=True)
-    for cell in ws[1]:
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center", vertical="center")
 
-    # Добавляем данные
-    for row_data in data:
-        ws.append(row_data)
+    for month_start_dt, headers, data in sheets:
+        ws = wb.create_sheet(f"{month_start_dt.strftime('%B_%Y')}")
+        ws.append(headers)
 
-    # Автоширина колонок
-    for col_idx, col in enumerate(ws.columns):
-        max_length = 0
-        column_letter = get_column_letter(col_idx + 1)
-        for cell in col:
-            try:
-                if cell.value:
-                    max_length = max(max_length, len(str(cell.value)))
-            except:
-                pass
-        adjusted_width = (max_length + 2) * 1.2
-        ws.column_dimensions[column_letter].width = adjusted_width
+        for cell in ws[1]:
+            cell.font = header_font
+            cell.alignment = Alignment(horizontal="center", vertical="center")
 
-    buffer = BytesIO()
+        for row_data in data:
+            ws.append(row_data)
+
+        # Автоширина колонок
+        for col_idx, col in enumerate(ws.columns):
+            max_length = 0
+            column_letter = get_column_letter(col_idx + 1)
+            for cell in col:
+                try:
+                    if cell.value:
+                        max_length = max(max_length, len(str(cell.value)))
+                except:
+                    pass
+            adjusted_width = (max_length + 2) * 1.2
+            ws.column_dimensions[column_letter].width = adjusted_width
+
+    buffer = new_spool()
     wb.save(buffer)
     buffer.seek(0)
     return buffer
-# --- КОНЕЦ УПРОЩЕННОЙ ФУНКЦИИ ---
+
+# --- Выгрузка всей истории: CSV (gzip) и ZIP с книгой на каждый месяц ---
+EXPORT_QUERY = "SELECT id, scooter_number, service, accepted_by_user_id, accepted_by_username, accepted_by_fullname, timestamp, chat_id FROM accepted_scooters"
+
+def _export_row(row) -> tuple:
+    # В SQLite время уже хранится локальной строкой
+    return row
+
+class _CsvGzipPart:
+    """
+    Одна часть CSV-выгрузки: строки пишутся через csv → gzip сразу в буфер.
+    """
+    def __init__(self):
+        self.file = new_spool()
+        self._gzip = gzip.GzipFile(fileobj=self.file, mode="wb", compresslevel=6)
+        self._text = io.TextIOWrapper(self._gzip, encoding="utf-8-sig", newline="")
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(EXPORT_HEADERS)
+        self.rows = 0
+
+    def write(self, rows: list):
+        self._writer.writerows(_export_row(row) for row in rows)
+        self._text.flush()
+        self.rows += len(rows)
+
+    def size(self) -> int:
+        return self.file.tell()
+
+    def finish(self):
+        # Закрывает gzip (дописывает хвост), сам буфер остается открытым для отправки
+        self._text.close()
+        self.file.seek(0)
+        return self.file
+
+@timed("export:csv_gzip")
+async def export_csv_gzip_parts(part_limit: int = EXPORT_PART_BYTES) -> list:
+    """
+    Потоковая выгрузка всей истории в CSV (gzip): строки читаются пачками,
+    сжатие идет в потоке, файл режется на части не больше part_limit.
+    """
+    parts = []
+    part = None
+    growth = 0
+    async for chunk in db_iter_chunks(EXPORT_QUERY + " ORDER BY id", chunk_size=EXPORT_CHUNK_ROWS):
+        if part is None:
+            part = _CsvGzipPart()
+        before = part.size()
+        await asyncio.to_thread(part.write, chunk)
+        growth = max(growth, part.size() - before)
+        # Запас в две пачки: часть сжатых данных еще в буферах gzip
+        if part.size() + 2 * growth >= part_limit:
+            parts.append(await asyncio.to_thread(part.finish))
+            part = None
+    if part is not None:
+        parts.append(await asyncio.to_thread(part.finish))
+    return parts
+
+def _month_starts(first: datetime.date, last: datetime.date) -> list[datetime.date]:
+    months = []
+    current = first.replace(day=1)
+    while current <= last:
+        months.append(current)
+        current = (current + datetime.timedelta(days=32)).replace(day=1)
+    return months
+
+def build_excel_bytes(records: list) -> bytes:
+    """
+    Книга Excel в виде bytes — для сборки в отдельном процессе.
+    """
+    with create_excel_report(records) as report:
+        return report.read()
+
+class _ZipParts:
+    """
+    ZIP-архивы с книгами по месяцам; новый архив начинается, когда следующий файл не влезает в лимит.
+    """
+    def __init__(self, part_limit: int):
+        self.part_limit = part_limit
+        self.parts = []
+        self._archive = None
+        self._file = None
+
+    def add(self, name: str, data: bytes):
+        # xlsx уже сжат внутри, поэтому ZIP_STORED; 1 КБ — запас на заголовки записи
+        if self._archive is not None and self._file.tell() + len(data) + 1024 > self.part_limit:
+            self._close()
+        if self._archive is None:
+            self._file = new_spool()
+            self._archive = zipfile.ZipFile(self._file, "w", compression=zipfile.ZIP_STORED)
+        if len(data) + 1024 > self.part_limit:
+            logging.warning(f"⚠️ Файл {name} ({len(data)} байт) больше лимита Telegram даже в отдельном архиве")
+        self._archive.writestr(name, data)
+
+    def _close(self):
+        self._archive.close()
+        self._file.seek(0)
+        self.parts.append(self._file)
+        self._archive = self._file = None
+
+    def finish(self) -> list:
+        if self._archive is not None:
+            self._close()
+        return self.parts
+
+# Процессы сборки книг живут между выгрузками. Контекст spawn, а не fork: форк процесса,
+# в котором уже работают потоки логирования и watchdog, наследует их захваченные блокировки
+_export_pool = None
+
+def _export_executor() -> ProcessPoolExecutor:
+    global _export_pool
+    if _export_pool is None:
+        _export_pool = ProcessPoolExecutor(max_workers=EXPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _export_pool
+
+async def shutdown_export_pool():
+    """
+    Останавливает процессы сборки книг. Ожидание идет в потоке, не блокируя цикл событий.
+    """
+    global _export_pool
+    pool, _export_pool = _export_pool, None
+    if pool is not None:
+        await asyncio.to_thread(pool.shutdown, wait=True)
+
+@timed("export:monthly_zip")
+async def export_monthly_zip_parts(part_limit: int = EXPORT_PART_BYTES, workers: int = EXPORT_WORKERS) -> list:
+    """
+    Выгрузка всей истории в ZIP с отдельной книгой на каждый месяц.
+    Книги собираются параллельно в процессах; в работе не больше workers месяцев,
+    чтобы в памяти не лежала вся история сразу.
+    """
+    global _export_pool
+    first, last = await db_time_bounds()
+    if first is None:
+        return []
+
+    zip_parts = _ZipParts(part_limit)
+    loop = asyncio.get_running_loop()
+    pending = deque()
+
+    async def write_next():
+        month_start, future = pending.popleft()
+        data = await future
+        await asyncio.to_thread(zip_parts.add, f"report_{month_start.strftime('%Y-%m')}.xlsx", data)
+
+    pool = _export_executor()
+    try:
+        for month_start in _month_starts(first, last):
+            month_end = (month_start + datetime.timedelta(days=32)).replace(day=1)
+            month_bounds = (f"{month_start.isoformat()} 00:00:00", f"{month_end.isoformat()} 00:00:00")
+            records = await db_fetch_all(
+                EXPORT_QUERY + " WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp",
+                month_bounds, period=month_bounds
+            )
+            if not records:
+                continue
+            pending.append((month_start, loop.run_in_executor(pool, build_excel_bytes, records)))
+            if len(pending) >= workers:
+                await write_next()
+        while pending:
+            await write_next()
+    except BrokenProcessPool:
+        # Упавший процесс ломает пул целиком: следующая выгрузка создаст новый
+        if _export_pool is pool:
+            _export_pool = None
+        pool.shutdown(wait=False)
+        raise
+
+    return await asyncio.to_thread(zip_parts.finish)
+
 def get_shift_time_range_for_report(shift_type: str):
-    now = datetime.datetime.now(TIMEZONE)
-    today = now.date()
-    
-    if shift_type == 'morning':
-        start_time = TIMEZONE.localize(datetime.datetime.combine(today, datetime.time(7, 0, 0)))
-        end_time = TIMEZONE.localize(datetime.datetime.combine(today, datetime.time(15, 0, 0)))
-        shift_name = "утреннюю смену"
-    elif shift_type == 'evening':
-        evening_start_actual = TIMEZONE.localize(datetime.datetime.combine(today, datetime.time(15, 0, 0)))
-        evening_end_extended = TIMEZONE.localize(datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time(4, 0, 0)))
-        start_time = evening_start_actual
-        end_time = evening_end_extended
-        shift_name = "вечернюю смену (с учетом ночных часов)"
-    else:
+    today = datetime.datetime.now(TIMEZONE).date()
+    start_time, end_time = shift_range(today, shift_type)
+    if not start_time:
         return None, None, None
-        
-    return start_time, end_time, shift_name
+    return start_time, end_time, shift_title(shift_type)
+
+# --- Отчет за смену, который копится в течение смены ---
+class ShiftReportBuilder:
+    """
+    Строки и итоги по пользователям за смену, дочитываемые по id > last_id
+    (задача shift_report_refresh), чтобы к моменту отправки оставалось
+    дочитать хвост и собрать книгу. Строки и итоги раскладываются еще и по
+    chat_id: отчеты с разным охватом групп собираются из того же чтения.
+    Отчет должен включать все строки смены, поэтому чтение идет на основной сервер.
+    """
+    def __init__(self, shift_type: str, start_time: datetime.datetime, end_time: datetime.datetime):
+        self.shift_type = shift_type
+        self.start_time = start_time
+        self.end_time = end_time
+        self.finalized = False
+        self._lock = asyncio.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.rows = []
+        self.counts = defaultdict(int)
+        self.names = {}
+        self.chat_rows = defaultdict(list)
+        self.chat_totals = {}
+        self.last_id = 0
+        self.id_sum = 0
+
+    def _bounds(self) -> tuple:
+        return (self.start_time.strftime("%Y-%m-%d %H:%M:%S"), self.end_time.strftime("%Y-%m-%d %H:%M:%S"))
+
+    def _add(self, rows: list):
+        if not rows:
+            return
+        self.rows.extend(rows)
+        summarize_users(rows, self.counts, self.names)
+        by_chat = defaultdict(list)
+        for row in rows:
+            by_chat[row[7]].append(row)
+        for chat_id, chat_rows in by_chat.items():
+            self.chat_rows[chat_id].extend(chat_rows)
+            counts, names = self.chat_totals.get(chat_id, (None, None))
+            self.chat_totals[chat_id] = summarize_users(chat_rows, counts, names)
+        self.last_id = max(self.last_id, max(row[0] for row in rows))
+        self.id_sum += sum(row[0] for row in rows)
+
+    async def refresh(self) -> int:
+        async with self._lock:
+            rows = await db_fetch_all(
+                EXPORT_QUERY + " WHERE timestamp >= ? AND timestamp < ? AND id > ? ORDER BY id",
+                (*self._bounds(), self.last_id), period=self._bounds(), fresh=True
+            )
+            self._add(rows)
+            return len(rows)
+
+    def _scoped(self, scope: frozenset = None) -> tuple[list, tuple]:
+        # None — все группы; иначе строки и итоги только из чатов scope, по возрастанию id
+        if scope is None:
+            return list(self.rows), (dict(self.counts), dict(self.names))
+        rows = sorted((row for chat_id in scope for row in self.chat_rows.get(chat_id, ())), key=lambda row: row[0])
+        counts, names = defaultdict(int), {}
+        for chat_id in scope:
+            chat_counts, chat_names = self.chat_totals.get(chat_id, ({}, {}))
+            for user_id, count in chat_counts.items():
+                counts[user_id] += count
+            names.update(chat_names)
+        return rows, (dict(counts), names)
+
+    async def finalize(self, scopes=(None,)) -> dict:
+        """
+        Дочитывает хвост и сверяет накопленное с базой по COUNT/MAX/SUM(id) за смену.
+        Расхождение означает удаленные строки или строки, закоммиченные позже строк
+        с бо́льшим id, — тогда смена перечитывается целиком.
+        Результат: {охват: (строки, итоги по пользователям)} для каждого из scopes.
+        """
+        await self.refresh()
+        async with self._lock:
+            self.finalized = True
+            count, max_id, id_sum = (await db_fetch_all(
+                "SELECT COUNT(*), MAX(id), SUM(id) FROM accepted_scooters WHERE timestamp >= ? AND timestamp < ?",
+                self._bounds(), period=self._bounds(), fresh=True
+            ))[0]
+            if (count, max_id or 0, id_sum or 0) != (len(self.rows), self.last_id, self.id_sum):
+                logging.info(f"🔄 Отчет за смену {self.shift_type}: расхождение с базой ({len(self.rows)} строк против {count}), перечитываю смену")
+                SHIFT_REPORT_RECONCILES.inc()
+                self._reset()
+                self._add(await db_fetch_all(
+                    EXPORT_QUERY + " WHERE timestamp >= ? AND timestamp < ? ORDER BY id",
+                    self._bounds(), period=self._bounds(), fresh=True
+                ))
+            return {scope: self._scoped(scope) for scope in scopes}
+
+_shift_builders = {}
+
+def shift_report_builder(shift_type: str):
+    """
+    Накопитель для смены shift_type сегодняшнего дня; с наступлением новой смены заменяется.
+    """
+    start_time, end_time, _ = get_shift_time_range_for_report(shift_type)
+    if not start_time:
+        return None
+    builder = _shift_builders.get(shift_type)
+    if builder is None or builder.start_time != start_time:
+        builder = ShiftReportBuilder(shift_type, start_time, end_time)
+        _shift_builders[shift_type] = builder
+    return builder
+
+@supervised("refresh_shift_reports")
+async def refresh_shift_reports():
+    """
+    Периодически дочитывает новые строки для уже начавшихся смен, отчет по которым еще не отправлен.
+    """
+    now = datetime.datetime.now(TIMEZONE)
+    for shift_type in SHIFT_NAMES:
+        builder = shift_report_builder(shift_type)
+        if builder is None or builder.finalized or builder.start_time > now:
+            continue
+        await builder.refresh()
+
+async def _deliver(report_key: str, chat_id: int, send) -> bool:
+    """
+    Отправляет отчет в чат, если его туда еще не отправил этот или другой процесс.
+    Упавшая отправка снимает захват, чтобы повторный запуск мог попробовать снова.
+    """
+    if not await claim_delivery(report_key, chat_id, INSTANCE_ID):
+        REPORT_DELIVERIES.labels("duplicate").inc()
+        logging.info(f"⏭ Отчет {report_key} в {chat_id} уже отправлен или отправляется")
+        return False
+    try:
+        await send()
+    except Exception:
+        await release_delivery(report_key, chat_id, INSTANCE_ID)
+        REPORT_DELIVERIES.labels("failed").inc()
+        raise
+    await mark_delivered(report_key, chat_id)
+    REPORT_DELIVERIES.labels("sent").inc()
+    return True
 
 # 🔥 ИСПРАВЛЕНА: добавлено логирование и проверка bot_instance
+@supervised("send_scheduled_report")
 async def send_scheduled_report(shift_type: str, bot_instance):
     if bot_instance is None:
         logging.error("❌ bot_instance is None in send_scheduled_report!")
@@ -153,38 +639,53 @@ async def send_scheduled_report(shift_type: str, bot_instance):
         logging.warning(f"Не удалось определить время смены для {shift_type}")
         return
 
-    start_str = start_time.strftime("%Y-%m-%d %H:%M:%S")
-    end_str = end_time.strftime("%Y-%m-%d %H:%M:%S")
+    # Ключ доставки: одна смена — один отчет, сколько бы раз и где бы ни запускалась задача
+    report_key = f"{shift_type}:{start_time.date().isoformat()}"
+    delivered = await delivered_chats(report_key)
+    if set(REPORT_CHAT_IDS) <= delivered:
+        logging.info(f"⏭ Отчет {report_key} уже отправлен во все чаты")
+        return
+
+    # Чаты с одинаковым охватом групп получают одну книгу
+    scope_chats = defaultdict(list)
+    for chat_id in REPORT_CHAT_IDS:
+        scope_chats[REPORT_SCOPES.get(chat_id)].append(chat_id)
 
-    query = "SELECT id, scooter_number, service, accepted_by_user_id, accepted_by_username, accepted_by_fullname, timestamp, chat_id FROM accepted_scooters WHERE timestamp BETWEEN ? AND ?"
-    records = await db_fetch_all(query, (start_str, end_str))
+    # Строки уже накоплены в течение смены и разложены по группам: дочитываем хвост,
+    # сверяемся с базой и получаем строки всех охватов из одного чтения
+    scoped = await shift_report_builder(shift_type).finalize(scope_chats)
 
+    for scope, chat_ids in scope_chats.items():
+        if set(chat_ids) <= delivered:
+            continue
+        records, user_totals = scoped[scope]
+        await _send_shift_report(report_key, chat_ids, records, user_totals, bot_instance, shift_type, start_time, end_time, shift_name)
+
+async def _send_shift_report(report_key: str, chat_ids: list, records: list, user_totals: tuple, bot_instance,
+                             shift_type: str, start_time: datetime.datetime, end_time: datetime.datetime, shift_name: str):
     if not records:
         message_text = f"Отчет за {shift_name} ({start_time.strftime('%H:%M')} - {end_time.strftime('%H:%M')}): За смену ничего не принято."
-        for chat_id in REPORT_CHAT_IDS:
+        for chat_id in chat_ids:
             try:
-                await bot_instance.send_message(chat_id, message_text)
-                logging.info(f"✅ Текстовый отчёт отправлен в {chat_id}")
+                if await _deliver(report_key, chat_id, lambda: bot_instance.send_message(chat_id, message_text)):
+                    logging.info(f"✅ Текстовый отчёт отправлен в {chat_id}")
             except Exception as e:
                 logging.error(f"❌ Не удалось отправить текст в {chat_id}: {e}")
         return
 
     try:
-        excel_file = create_excel_report(records)
+        excel_file = await build_report(create_excel_report, records, user_totals)
         report_type_filename = "morning_shift" if shift_type == 'morning' else "evening_shift"
         filename = f"report_{report_type_filename}_{start_time.strftime('%Y%m%d')}.xlsx"
         caption = f"Ежедневный отчет за {shift_name} ({start_time.strftime('%d.%m %H:%M')} - {end_time.strftime('%d.%m %H:%M')})"
-        
-        for chat_id in REPORT_CHAT_IDS:
-            try:
-                excel_file.seek(0)
-                await bot_instance.send_document(
-                    chat_id,
-                    types.InputFile(excel_file, filename=filename),
-                    caption=caption
-                )
-                logging.info(f"✅ Excel-отчёт отправлен в {chat_id}")
-            except Exception as e:
-                logging.error(f"❌ Ошибка отправки Excel в {chat_id}: {e}")
+
+        # Один буфер на все чаты охвата: каждая отправка читает его своим читателем
+        with excel_file, upload_buffer(excel_file) as buffer:
+            for chat_id in chat_ids:
+                try:
+                    if await _deliver(report_key, chat_id, lambda: bot_instance.send_document(chat_id, upload_file(buffer, filename), caption=caption)):
+                        logging.info(f"✅ Excel-отчёт отправлен в {chat_id}")
+                except Exception as e:
+                    logging.error(f"❌ Ошибка отправки Excel в {chat_id}: {e}")
     except Exception as e:
         logging.error(f"❌ Ошибка генерации Excel-отчёта: {e}")
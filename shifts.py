@@ -0,0 +1,193 @@
+# shifts.py
+# Календарь смен: границы задаются в config.SHIFTS и используются и хендлерами, и отчетами.
+from config import SHIFTS, TIMEZONE
+from functools import lru_cache
+import bisect
+import datetime
+
+SECONDS_IN_DAY = 24 * 60 * 60
+
+# Название смены: (винительный падеж для "за ...", именительный для заголовков)
+SHIFT_TITLES = {
+    'morning': ("утреннюю смену", "Утренняя смена"),
+    'evening': ("вечернюю смену (с учетом ночных часов)", "Вечерняя смена"),
+}
+
+SHIFT_NAMES = [name for name, _, _ in SHIFTS]
+
+def _seconds(t: datetime.time) -> int:
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+def _localize(dt: datetime.datetime) -> datetime.datetime:
+    if hasattr(TIMEZONE, 'localize'):
+        return TIMEZONE.localize(dt)
+    return dt.replace(tzinfo=TIMEZONE)
+
+def _build_slots():
+    """
+    Раскладывает смены по секундам суток: для каждого интервала суток хранится
+    (сдвиг даты смены в днях, имя смены) или None, если время вне смен.
+    """
+    pieces = []
+    for name, start, end in SHIFTS:
+        start_s = _seconds(start)
+        end_s = _seconds(end)
+        if end_s <= start_s:
+            end_s += SECONDS_IN_DAY
+        if end_s - start_s > SECONDS_IN_DAY:
+            raise ValueError(f"Смена {name} длиннее суток")
+        if start_s < SECONDS_IN_DAY:
+            pieces.append((start_s, min(end_s, SECONDS_IN_DAY), 0, name))
+        if end_s > SECONDS_IN_DAY:
+            # Ночные часы относятся к смене предыдущего дня
+            pieces.append((0, end_s - SECONDS_IN_DAY, -1, name))
+    pieces.sort()
+
+    starts, values = [], []
+    position = 0
+    for piece_start, piece_end, day_shift, name in pieces:
+        if piece_start < position:
+            raise ValueError(f"Смена {name} пересекается с другой сменой")
+        if piece_start > position:
+            starts.append(position)
+            values.append(None)
+        starts.append(piece_start)
+        values.append((day_shift, name))
+        position = piece_end
+    if position < SECONDS_IN_DAY:
+        starts.append(position)
+        values.append(None)
+    return starts, values
+
+_SLOT_STARTS, _SLOT_VALUES = _build_slots()
+
+def shift_title(name: str, nominative: bool = False) -> str:
+    titles = SHIFT_TITLES.get(name, (f"смену {name}", f"Смена {name}"))
+    return titles[1] if nominative else titles[0]
+
+def shift_hours(name: str) -> str:
+    for shift_name, start, end in SHIFTS:
+        if shift_name == name:
+            return f"{start.hour}:{start.minute:02d}-{end.hour}:{end.minute:02d}"
+    return ""
+
+@lru_cache(maxsize=2048)
+def day_table(shift_date: datetime.date) -> tuple:
+    """
+    Границы всех смен, начинающихся в shift_date: ((имя, начало, конец), ...).
+    Результат кэшируется, поэтому локализация выполняется один раз на день.
+    """
+    table = []
+    for name, start, end in SHIFTS:
+        start_dt = datetime.datetime.combine(shift_date, start)
+        end_dt = datetime.datetime.combine(shift_date, end)
+        if end_dt <= start_dt:
+            end_dt += datetime.timedelta(days=1)
+        table.append((name, _localize(start_dt), _localize(end_dt)))
+    return tuple(sorted(table, key=lambda item: item[1]))
+
+def shift_range(shift_date: datetime.date, name: str):
+    for shift_name, start_dt, end_dt in day_table(shift_date):
+        if shift_name == name:
+            return start_dt, end_dt
+    return None, None
+
+def period_range(start_date: datetime.date, end_date: datetime.date):
+    """
+    Время от начала первой смены start_date до конца последней смены end_date.
+    """
+    return day_table(start_date)[0][1], max(end_dt for _, _, end_dt in day_table(end_date))
+
+@lru_cache(maxsize=4096)
+def _date_from_iso(date_str: str) -> datetime.date:
+    return datetime.date.fromisoformat(date_str)
+
+@lru_cache(maxsize=4096)
+def _shifted_date(date_str: str, day_shift: int) -> datetime.date:
+    return _date_from_iso(date_str) + datetime.timedelta(days=day_shift)
+
+def bucket_timestamps(timestamps) -> list:
+    """
+    Быстрая раскладка пачки меток времени по сменам.
+    Принимает строки 'YYYY-MM-DD HH:MM:SS' в локальном времени (как в SQLite)
+    или datetime (aware приводятся к TIMEZONE). Возвращает список
+    (дата смены, имя смены) или None для времени вне смен.
+    """
+    slot_starts = _SLOT_STARTS
+    slot_values = _SLOT_VALUES
+    result = []
+    append = result.append
+    for ts in timestamps:
+        if isinstance(ts, str):
+            date_str = ts[:10]
+            seconds = int(ts[11:13]) * 3600 + int(ts[14:16]) * 60 + int(ts[17:19])
+        else:
+            if ts.tzinfo is not None:
+                ts = ts.astimezone(TIMEZONE)
+            date_str = ts.strftime("%Y-%m-%d")
+            seconds = ts.hour * 3600 + ts.minute * 60 + ts.second
+        value = slot_values[bisect.bisect_right(slot_starts, seconds) - 1]
+        if value is None:
+            append(None)
+        else:
+            append((_shifted_date(date_str, value[0]), value[1]))
+    return result
+
+def bucket_timestamp(ts):
+    return bucket_timestamps((ts,))[0]
+
+def current_shift(now: datetime.datetime = None):
+    """
+    Смена, идущая в момент now: (начало, конец, название).
+    Между сменами возвращается ближайшая следующая смена.
+    """
+    now = now or datetime.datetime.now(TIMEZONE)
+    bucket = bucket_timestamp(now)
+    if bucket:
+        shift_date, name = bucket
+        start_dt, end_dt = shift_range(shift_date, name)
+        return start_dt, end_dt, shift_title(name)
+
+    today = now.astimezone(TIMEZONE).date()
+    for shift_date in (today, today + datetime.timedelta(days=1)):
+        for name, start_dt, end_dt in day_table(shift_date):
+            if start_dt > now:
+                return start_dt, end_dt, f"{shift_title(name)} (еще не началась)"
+    return None, None, None
+
+def sql_shift_columns(ts_expr: str, dialect: str) -> tuple[str, str]:
+    """
+    SQL-выражения (дата смены, имя смены) для колонки ts_expr с локальным временем.
+    Повторяют bucket_timestamps, чтобы раскладку по сменам можно было делать в базе.
+    """
+    def time_literal(seconds: int) -> str:
+        value = f"'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'"
+        return f"TIME {value}" if dialect == "postgres" else value
+
+    if dialect == "postgres":
+        time_expr = f"CAST({ts_expr} AS time)"
+        date_expr = f"CAST({ts_expr} AS date)"
+    else:
+        time_expr = f"time({ts_expr})"
+        date_expr = f"date({ts_expr})"
+
+    def shifted_date(day_shift: int) -> str:
+        if not day_shift:
+            return date_expr
+        if dialect == "postgres":
+            return f"({date_expr} {day_shift:+d})"
+        return f"date({ts_expr}, '{day_shift:+d} day')"
+
+    date_cases, name_cases = [], []
+    for idx, value in enumerate(_SLOT_VALUES):
+        slot_end = _SLOT_STARTS[idx + 1] if idx + 1 < len(_SLOT_STARTS) else None
+        date_value = shifted_date(value[0]) if value else "NULL"
+        name_value = f"'{value[1]}'" if value else "NULL"
+        if slot_end is None:
+            date_cases.append(f"ELSE {date_value}")
+            name_cases.append(f"ELSE {name_value}")
+        else:
+            date_cases.append(f"WHEN {time_expr} < {time_literal(slot_end)} THEN {date_value}")
+            name_cases.append(f"WHEN {time_expr} < {time_literal(slot_end)} THEN {name_value}")
+
+    return f"CASE {' '.join(date_cases)} END", f"CASE {' '.join(name_cases)} END"
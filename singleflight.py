@@ -0,0 +1,97 @@
+# singleflight.py
+# Одинаковые отчеты, запрошенные одновременно (несколько админов жмут /export_today_excel
+# перед плановым отчетом), собираются один раз: первый запрос запускает сборку, остальные
+# с тем же ключом ждут ее и получают тот же файл. Статус «Формирую отчет...» в чате один
+# на сборку — прогресс редактирует его, а не шлет новое сообщение на каждый запрос.
+from aiogram import types
+from metrics import REPORT_COALESCED
+import asyncio
+import contextlib
+import logging
+
+class Flight:
+    """
+    Одна сборка отчета и ее ожидающие. Сообщения статуса — по одному на чат.
+    """
+    def __init__(self, key: tuple):
+        self.key = key
+        self.task = None
+        self.waiters = 0
+        self.text = None
+        self._statuses = {}
+
+    async def attach(self, message: types.Message, text: str):
+        self.text = self.text or text
+        status = self._statuses.get(message.chat.id)
+        if status is None:
+            self._statuses[message.chat.id] = await message.answer(self._status_text(), parse_mode=None)
+        else:
+            await self._edit(status, self._status_text())
+
+    async def progress(self, text: str):
+        """
+        Новый текст статуса во всех чатах сборки; тот же текст повторно не отправляется.
+        """
+        if text == self.text:
+            return
+        self.text = text
+        status_text = self._status_text()
+        await asyncio.gather(*(self._edit(status, status_text) for status in list(self._statuses.values())))
+
+    def _status_text(self) -> str:
+        if self.waiters > 1:
+            return f"{self.text}\nЗапросов этого отчета: {self.waiters}"
+        return self.text
+
+    async def _edit(self, status: types.Message, text: str):
+        try:
+            await status.edit_text(text, parse_mode=None)
+        except Exception as e:
+            logging.debug(f"Статус отчета не обновлен: {e!r}")
+
+    def release(self):
+        # Файл закрывается, когда сборка завершена и его получили все ожидающие
+        if self.waiters or not self.task.done() or self.task.cancelled() or self.task.exception() is not None:
+            return
+        result = self.task.result()
+        if hasattr(result, "close"):
+            result.close()
+
+class SingleFlight:
+    """
+    Сборки отчетов по ключу нормализованных параметров. Ключ свободен, как только
+    сборка завершилась: запрос после этого соберет свежий отчет.
+    """
+    def __init__(self):
+        self._flights = {}
+
+    def _finished(self, flight: Flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        flight.release()
+
+    @contextlib.asynccontextmanager
+    async def join(self, key: tuple, message: types.Message, build, text: str = "Формирую отчет..."):
+        """
+        Результат build(flight) для ключа key; build запускается, только если такой
+        сборки еще нет; первый элемент ключа — имя отчета для метрик. У результата
+        с методом close() он вызывается после выхода последнего ожидающего.
+        Отмена одного запроса сборку не прерывает.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight(key)
+            self._flights[key] = flight
+            flight.task = asyncio.ensure_future(build(flight))
+            flight.task.add_done_callback(lambda task: self._finished(flight))
+            REPORT_COALESCED.labels(key[0], "built").inc()
+        else:
+            REPORT_COALESCED.labels(key[0], "joined").inc()
+            logging.info(f"🔗 Отчет {key} уже собирается, запрос ждет ту же сборку")
+        flight.waiters += 1
+        try:
+            await flight.attach(message, text)
+            yield await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            flight.release()
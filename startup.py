@@ -0,0 +1,94 @@
+# startup.py
+# Замеры холодного старта: время импорта верхнеуровневых модулей и фазы on_startup.
+# Импортируется первым в app.py, поэтому сам использует только stdlib.
+import contextlib
+import importlib.abc
+import logging
+import sys
+import time
+
+STARTED = time.perf_counter()
+
+_import_times = {}
+_phases = []
+
+class _TimedLoader:
+    """
+    Обертка над загрузчиком модуля: замеряет exec_module вместе с вложенными импортами.
+    """
+    def __init__(self, loader, name: str):
+        self._loader = loader
+        self._name = name
+
+    def __getattr__(self, item):
+        return getattr(self._loader, item)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        started = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            _import_times[self._name] = _import_times.get(self._name, 0.0) + time.perf_counter() - started
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    def find_spec(self, fullname, path, target=None):
+        # Только пакеты верхнего уровня: время подмодулей входит в них
+        if '.' in fullname:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                spec.loader = _TimedLoader(spec.loader, fullname)
+            return spec
+        return None
+
+_timer = _ImportTimer()
+
+def track_imports():
+    if _timer not in sys.meta_path:
+        sys.meta_path.insert(0, _timer)
+
+def stop_tracking_imports():
+    if _timer in sys.meta_path:
+        sys.meta_path.remove(_timer)
+
+def mark(name: str):
+    """
+    Фаза, закончившаяся сейчас: длительность считается от конца предыдущей фазы.
+    """
+    now = time.perf_counter() - STARTED
+    previous = _phases[-1][2] if _phases else 0.0
+    _phases.append((name, previous, now))
+
+@contextlib.contextmanager
+def phase(name: str):
+    started = time.perf_counter() - STARTED
+    try:
+        yield
+    finally:
+        _phases.append((name, started, time.perf_counter() - STARTED))
+
+def phase_ms(name: str) -> float:
+    for phase_name, started, finished in reversed(_phases):
+        if phase_name == name:
+            return (finished - started) * 1000
+    return 0.0
+
+def format_report(top: int = 10) -> str:
+    lines = [f"🚀 Холодный старт: {(time.perf_counter() - STARTED) * 1000:.0f} мс с запуска процесса"]
+    for name, started, finished in _phases:
+        lines.append(f"  {name}: {(finished - started) * 1000:.0f} мс (на {finished * 1000:.0f} мс)")
+    if _import_times:
+        slowest = sorted(_import_times.items(), key=lambda item: item[1], reverse=True)[:top]
+        lines.append("  Самые долгие импорты: " + ", ".join(f"{name} {seconds * 1000:.0f} мс" for name, seconds in slowest))
+    return "\n".join(lines)
+
+def log_report():
+    logging.info(format_report())
@@ -0,0 +1,140 @@
+# tests/test_delivery.py
+# Отчет уходит в чат один раз, даже если его одновременно отправляют несколько процессов:
+# захват (отчет, чат) в report_deliveries получает ровно один из них. Проверяется и сам
+# захват, и send_scheduled_report целиком — с ботом-заглушкой, который считает отправки
+# в каждый чат. Бэкенд — SQLite во временном каталоге. Запуск: python -m unittest discover tests
+import os
+import sys
+import asyncio
+import datetime
+import multiprocessing
+import tempfile
+import unittest
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "test")
+os.environ.setdefault("LOG_FILE", "")
+# Дочерние процессы наследуют окружение и открывают ту же базу
+os.environ.setdefault("DB_NAME", os.path.join(tempfile.mkdtemp(), "deliveries.db"))
+os.environ["REPORT_CHAT_IDS"] = "-1001,-1002,-1003"
+os.environ["REPORT_SCOPES"] = ""
+
+from database import init_db, claim_delivery, mark_delivered, release_delivery, delivered_chats, db_write_batch
+from config import REPORT_CHAT_IDS
+
+REPORT_CHATS = sorted(REPORT_CHAT_IDS)
+
+PROCESSES = 6
+CHAT_ID = -100123
+
+class FakeBot:
+    """
+    Вместо Telegram: каждая отправка, дошедшая до чата, попадает в очередь sends.
+    Отправка в fail_chat падает, как упавший запрос к Bot API.
+    """
+    def __init__(self, sends, fail_chat=None):
+        self.sends = sends
+        self.fail_chat = fail_chat
+
+    async def _send(self, chat_id):
+        # Пауза как у настоящего запроса: остальные процессы успевают дойти до своих отправок
+        await asyncio.sleep(0.05)
+        if chat_id == self.fail_chat:
+            raise RuntimeError("Bad Gateway")
+        self.sends.put(chat_id)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._send(chat_id)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        await self._send(chat_id)
+
+def _deliver(report: str, fail: bool, barrier, results):
+    async def run():
+        instance = f"pid{os.getpid()}"
+        barrier.wait()
+        if not await claim_delivery(report, CHAT_ID, instance):
+            return False
+        if fail:
+            await release_delivery(report, CHAT_ID, instance)
+            return False
+        await mark_delivered(report, CHAT_ID)
+        return True
+    results.put(asyncio.run(run()))
+
+def _race(report: str, fail: bool = False) -> list:
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(PROCESSES)
+    results = context.Queue()
+    processes = [context.Process(target=_deliver, args=(report, fail, barrier, results)) for _ in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    outcomes = [results.get(timeout=60) for _ in processes]
+    for process in processes:
+        process.join(timeout=60)
+    return outcomes
+
+def _send_report(shift_type: str, fail_chat, barrier, sends):
+    from reports import send_scheduled_report
+    barrier.wait()
+    asyncio.run(send_scheduled_report(shift_type, FakeBot(sends, fail_chat)))
+    sends.put(None)
+
+def _race_reports(shift_type: str, fail_chat=None) -> Counter:
+    """
+    PROCESSES процессов одновременно отправляют отчет за смену; результат — число отправок по чатам.
+    """
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(PROCESSES)
+    sends = context.Queue()
+    processes = [context.Process(target=_send_report, args=(shift_type, fail_chat, barrier, sends)) for _ in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    counts, finished = Counter(), 0
+    while finished < PROCESSES:
+        chat_id = sends.get(timeout=60)
+        if chat_id is None:
+            finished += 1
+        else:
+            counts[chat_id] += 1
+    for process in processes:
+        process.join(timeout=60)
+    return counts
+
+def _seed_shift(shift_type: str, message_id: int):
+    # Одна принятая строка в смене: отчет уходит книгой Excel, а не текстом "ничего не принято"
+    from reports import get_shift_time_range_for_report
+    start_time, _, _ = get_shift_time_range_for_report(shift_type)
+    accepted_at = (start_time + datetime.timedelta(minutes=5)).strftime("%Y-%m-%d %H:%M:%S")
+    return asyncio.run(db_write_batch([(f"TEST{message_id}", "Яндекс", 1, "user", "User", accepted_at, REPORT_CHATS[0], message_id, 0)]))
+
+class ExactlyOnceDeliveryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        asyncio.run(init_db())
+
+    def test_one_process_sends(self):
+        self.assertEqual(sum(_race("2024-07-16_evening")), 1)
+        self.assertEqual(asyncio.run(delivered_chats("2024-07-16_evening")), {CHAT_ID})
+        # Повторный запуск (перезапуск, новый лидер) отчет больше не отправляет
+        self.assertEqual(sum(_race("2024-07-16_evening")), 0)
+
+    def test_failed_send_can_be_retried(self):
+        self.assertEqual(sum(_race("2024-07-17_morning", fail=True)), 0)
+        self.assertEqual(asyncio.run(delivered_chats("2024-07-17_morning")), set())
+        self.assertEqual(sum(_race("2024-07-17_morning")), 1)
+
+    def test_scheduled_report_reaches_each_chat_once(self):
+        self.assertEqual(_seed_shift("morning", 1), 1)
+        self.assertEqual(_race_reports("morning"), Counter({chat_id: 1 for chat_id in REPORT_CHATS}))
+        self.assertEqual(_race_reports("morning"), Counter())
+
+    def test_failed_chat_gets_report_on_rerun(self):
+        self.assertEqual(_seed_shift("evening", 2), 1)
+        failing = REPORT_CHATS[1]
+        self.assertEqual(_race_reports("evening", fail_chat=failing), Counter({chat_id: 1 for chat_id in REPORT_CHATS if chat_id != failing}))
+        self.assertEqual(_race_reports("evening"), Counter({failing: 1}))
+
+if __name__ == "__main__":
+    unittest.main()
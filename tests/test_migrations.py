@@ -0,0 +1,77 @@
+# tests/test_migrations.py
+# Миграция 0001_message_identity удаляет повторы, записанные до ключа по сообщению:
+# повтором считается только строка в окне от первой оставшейся записи группы, а удаленные
+# строки сохраняются в отдельной таблице. Запуск: python -m unittest discover tests
+import os
+import sys
+import datetime
+import sqlite3
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "test")
+os.environ.setdefault("LOG_FILE", "")
+
+from database import _migrate_message_identity, DEDUPE_BACKUP_TABLE
+
+# Схема до ключа по сообщению: без message_id/item_index
+OLD_SCHEMA = '''
+    CREATE TABLE accepted_scooters (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        scooter_number TEXT NOT NULL,
+        service TEXT NOT NULL,
+        accepted_by_user_id INTEGER NOT NULL,
+        accepted_by_username TEXT,
+        accepted_by_fullname TEXT NOT NULL,
+        timestamp DATETIME NOT NULL,
+        chat_id INTEGER NOT NULL,
+        UNIQUE(scooter_number, accepted_by_user_id, timestamp)
+    )
+'''
+
+T0 = datetime.datetime(2024, 7, 16, 9, 0)
+
+class MessageIdentityMigrationTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:", isolation_level=None)
+        self.conn.execute(OLD_SCHEMA)
+        self.addCleanup(self.conn.close)
+
+    def _insert(self, number: str, minutes: int, chat_id: int = -100) -> int:
+        timestamp = (T0 + datetime.timedelta(minutes=minutes)).strftime("%Y-%m-%d %H:%M:%S")
+        return self.conn.execute(
+            "INSERT INTO accepted_scooters (scooter_number, service, accepted_by_user_id, accepted_by_username, accepted_by_fullname, timestamp, chat_id) VALUES (?, 'Яндекс', 1, 'user', 'User', ?, ?)",
+            (number, timestamp, chat_id)
+        ).lastrowid
+
+    def _remaining(self) -> set:
+        return {row[0] for row in self.conn.execute("SELECT id FROM accepted_scooters")}
+
+    def test_repeats_are_counted_from_first_kept_row(self):
+        # Записи через 9 минут: повторы первой — только строки в 10 минутах от нее,
+        # строка на 18-й минуте остается и начинает новое окно
+        first, at_9, at_18, at_25, at_40 = (self._insert("AB123", minutes) for minutes in (0, 9, 18, 25, 40))
+        outcome = _migrate_message_identity(self.conn)
+        self.assertEqual(self._remaining(), {first, at_18, at_40})
+        self.assertEqual({row[0] for row in self.conn.execute(f"SELECT id FROM {DEDUPE_BACKUP_TABLE}")}, {at_9, at_25})
+        self.assertIn("удалено повторов: 2", outcome)
+
+    def test_other_chats_and_batch_numbers_are_kept(self):
+        kept = {
+            self._insert("AB123", 0),
+            self._insert("AB123", 1, chat_id=-200),
+            self._insert("IMPORT_BATCH_1", 0),
+            self._insert("IMPORT_BATCH_1", 1),
+        }
+        self.assertEqual(_migrate_message_identity(self.conn), "удалено повторов: 0")
+        self.assertEqual(self._remaining(), kept)
+        # Без повторов таблица для удаленных строк не создается
+        self.assertIsNone(self.conn.execute("SELECT name FROM sqlite_master WHERE name = ?", (DEDUPE_BACKUP_TABLE,)).fetchone())
+
+    def test_message_columns_added(self):
+        _migrate_message_identity(self.conn)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(accepted_scooters)")}
+        self.assertTrue({"message_id", "item_index"} <= columns)
+
+if __name__ == "__main__":
+    unittest.main()
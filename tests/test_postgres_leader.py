@@ -0,0 +1,176 @@
+# tests/test_postgres_leader.py
+# Несколько процессов PostgreSQL-варианта бота (*.py поверх *.py.post): лидером выбирается
+# ровно один, после гибели лидера его место занимает другой, а отчет за смену, который
+# отправляют все процессы сразу, уходит в каждый чат один раз.
+# Нужен сервер PostgreSQL: тест запускается, только если задан DATABASE_URL, и работает
+# во временной базе на этом сервере (нужно право CREATEDB), данные бота не трогает.
+import os
+import sys
+import glob
+import time
+import uuid
+import queue
+import shutil
+import asyncio
+import datetime
+import tempfile
+import unittest
+import multiprocessing
+import urllib.parse
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+INSTANCES = 3
+PROCESSES = 6
+POLL_SECONDS = 0.2
+REPORT_CHATS = [-1001, -1002, -1003]
+
+def _use_postgres_tree(directory: str, database_url: str):
+    # Вызывается в дочернем процессе до первого импорта модулей бота
+    os.environ.update(
+        DATABASE_URL=database_url, DATABASE_REPLICA_URLS="", BOT_TOKEN="123456:TEST", LOG_FILE="",
+        REPORT_CHAT_IDS=",".join(map(str, REPORT_CHATS)), REPORT_SCOPES="", PYTHONDONTWRITEBYTECODE="1",
+    )
+    sys.path.insert(0, directory)
+
+def _run_instance(directory: str, database_url: str, events):
+    _use_postgres_tree(directory, database_url)
+    from config import LEADER_LOCK_KEY
+    from leader import LeaderElection
+
+    async def run():
+        election = LeaderElection(
+            LEADER_LOCK_KEY, POLL_SECONDS,
+            on_elected=lambda: events.put(("elected", os.getpid())),
+            on_lost=lambda: events.put(("lost", os.getpid())),
+        )
+        await election.run()
+    asyncio.run(run())
+
+def _seed_shift(directory: str, database_url: str, shift_type: str, done):
+    _use_postgres_tree(directory, database_url)
+    from database import init_db, db_write_batch
+    from reports import get_shift_time_range_for_report
+
+    async def run():
+        await init_db()
+        start_time, _, _ = get_shift_time_range_for_report(shift_type)
+        return await db_write_batch([("TEST1", "Яндекс", 1, "user", "User", start_time + datetime.timedelta(minutes=5), REPORT_CHATS[0], 1, 0)])
+    done.put(asyncio.run(run()))
+
+class FakeBot:
+    """
+    Вместо Telegram: каждая отправка, дошедшая до чата, попадает в очередь sends.
+    """
+    def __init__(self, sends):
+        self.sends = sends
+
+    async def _send(self, chat_id):
+        await asyncio.sleep(0.05)
+        self.sends.put(chat_id)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._send(chat_id)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        await self._send(chat_id)
+
+def _send_report(directory: str, database_url: str, shift_type: str, barrier, sends):
+    _use_postgres_tree(directory, database_url)
+    from database import init_db
+    from reports import send_scheduled_report
+
+    async def run():
+        await init_db()
+        await asyncio.to_thread(barrier.wait)
+        await send_scheduled_report(shift_type, FakeBot(sends))
+    asyncio.run(run())
+    sends.put(None)
+
+async def _admin(statement: str):
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        await conn.execute(statement)
+    finally:
+        await conn.close()
+
+@unittest.skipIf(asyncpg is None, "asyncpg не установлен")
+@unittest.skipUnless(DATABASE_URL, "DATABASE_URL не задан")
+class PostgresLeaderTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        for path in glob.glob(os.path.join(ROOT, "*.py")):
+            shutil.copy(path, cls.directory)
+        for path in glob.glob(os.path.join(ROOT, "*.py.post")):
+            shutil.copy(path, os.path.join(cls.directory, os.path.basename(path)[:-len(".post")]))
+        cls.database = f"scooters_test_{uuid.uuid4().hex[:12]}"
+        asyncio.run(_admin(f'CREATE DATABASE "{cls.database}"'))
+        cls.database_url = urllib.parse.urlsplit(DATABASE_URL)._replace(path=f"/{cls.database}").geturl()
+        cls.context = multiprocessing.get_context("spawn")
+
+    @classmethod
+    def tearDownClass(cls):
+        asyncio.run(_admin(f'DROP DATABASE IF EXISTS "{cls.database}" WITH (FORCE)'))
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def _start(self, target, *args):
+        process = self.context.Process(target=target, args=(self.directory, self.database_url, *args))
+        process.start()
+        self.addCleanup(process.join, 10)
+        self.addCleanup(process.kill)
+        return process
+
+    def _next_event(self, events, timeout: float):
+        try:
+            return events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def test_leader_takeover(self):
+        events = self.context.Queue()
+        instances = {process.pid: process for process in (self._start(_run_instance, events) for _ in range(INSTANCES))}
+
+        kind, leader = self._next_event(events, 60)
+        self.assertEqual(kind, "elected")
+        # Пока лидер жив, остальные блокировку не получают
+        self.assertIsNone(self._next_event(events, POLL_SECONDS * 10))
+
+        # Гибель без закрытия сессии: блокировку снимает сервер, когда закрывается соединение
+        instances[leader].kill()
+        instances[leader].join(10)
+        kind, successor = self._next_event(events, 60)
+        self.assertEqual(kind, "elected")
+        self.assertIn(successor, instances)
+        self.assertNotEqual(successor, leader)
+        self.assertIsNone(self._next_event(events, POLL_SECONDS * 10))
+
+    def test_scheduled_report_reaches_each_chat_once(self):
+        done = self.context.Queue()
+        self._start(_seed_shift, "morning", done)
+        self.assertEqual(done.get(timeout=60), 1)
+
+        for expected in (Counter({chat_id: 1 for chat_id in REPORT_CHATS}), Counter()):
+            barrier = self.context.Barrier(PROCESSES)
+            sends = self.context.Queue()
+            for _ in range(PROCESSES):
+                self._start(_send_report, "morning", barrier, sends)
+            counts, finished = Counter(), 0
+            while finished < PROCESSES:
+                chat_id = sends.get(timeout=60)
+                if chat_id is None:
+                    finished += 1
+                else:
+                    counts[chat_id] += 1
+            # Второй прогон (перезапуск, новый лидер) отчет больше не отправляет
+            self.assertEqual(counts, expected)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+# tests/test_postgres_variant.py
+# Развертывание с PostgreSQL — это *.py, поверх которых скопированы *.py.post.
+# Проверка, что в таком виде все модули бота импортируются (общий app.py не тянет
+# из config настроек, которых нет в config.py.post). Нужен установленный asyncpg.
+import os
+import sys
+import glob
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# backup.py — бэкап файла SQLite, main.py — старый однофайловый бот; в развертывание с PostgreSQL не входят
+SQLITE_ONLY = {"backup", "main"}
+
+try:
+    import asyncpg  # noqa: F401
+except ImportError:
+    asyncpg = None
+
+@unittest.skipIf(asyncpg is None, "asyncpg не установлен")
+class PostgresVariantImportTest(unittest.TestCase):
+    def test_modules_import(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for path in glob.glob(os.path.join(ROOT, "*.py")):
+                shutil.copy(path, directory)
+            for path in glob.glob(os.path.join(ROOT, "*.py.post")):
+                shutil.copy(path, os.path.join(directory, os.path.basename(path)[:-len(".post")]))
+            modules = sorted(
+                os.path.basename(path)[:-3] for path in glob.glob(os.path.join(directory, "*.py"))
+                if os.path.basename(path)[:-3] not in SQLITE_ONLY
+            )
+            env = dict(os.environ, BOT_TOKEN="123456:TEST", LOG_FILE="", PYTHONDONTWRITEBYTECODE="1")
+            result = subprocess.run(
+                [sys.executable, "-c", "import importlib, sys\nfor name in sys.argv[1:]:\n    importlib.import_module(name)", *modules],
+                cwd=directory, env=env, capture_output=True, text=True, timeout=120,
+            )
+            self.assertEqual(result.returncode, 0, result.stderr)
+
+if __name__ == "__main__":
+    unittest.main()
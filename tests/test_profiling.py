@@ -0,0 +1,48 @@
+# tests/test_profiling.py
+# timed как декоратор корутины замеряет ее выполнение целиком, а не только создание
+# объекта корутины. Запуск: python -m unittest discover tests
+import os
+import sys
+import asyncio
+import inspect
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "test")
+os.environ.setdefault("LOG_FILE", "")
+
+import profiling
+from profiling import timed
+
+def _durations(name: str) -> list:
+    return [seconds for _, sample_name, seconds in profiling._samples if sample_name == name]
+
+class TimedTest(unittest.TestCase):
+    def test_coroutine_is_measured_until_it_finishes(self):
+        @timed("test:coroutine")
+        async def work():
+            await asyncio.sleep(0.2)
+            return "done"
+
+        self.assertTrue(inspect.iscoroutinefunction(work))
+        self.assertEqual(asyncio.run(work()), "done")
+        self.assertGreaterEqual(_durations("test:coroutine")[-1], 0.2)
+
+    def test_failed_coroutine_is_measured(self):
+        @timed("test:failed_coroutine")
+        async def work():
+            await asyncio.sleep(0.1)
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(work())
+        self.assertGreaterEqual(_durations("test:failed_coroutine")[-1], 0.1)
+
+    def test_export_jobs_stay_coroutines(self):
+        # Декоратор не должен превращать выгрузки в синхронные функции, возвращающие корутину
+        from reports import export_csv_gzip_parts, export_monthly_zip_parts
+        self.assertTrue(inspect.iscoroutinefunction(export_csv_gzip_parts))
+        self.assertTrue(inspect.iscoroutinefunction(export_monthly_zip_parts))
+
+if __name__ == "__main__":
+    unittest.main()
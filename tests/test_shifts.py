@@ -0,0 +1,53 @@
+# tests/test_shifts.py
+# Ночные часы смен: bucket_timestamps и SQL-выражения sql_shift_columns (в SQLite)
+# должны раскладывать время одинаково. Запуск: python -m unittest discover tests
+import os
+import sys
+import datetime
+import sqlite3
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "test")
+os.environ.setdefault("LOG_FILE", "")
+os.environ["SHIFTS"] = "morning=07:00-15:00,evening=15:00-04:00"
+
+from shifts import bucket_timestamps, sql_shift_columns
+
+CASES = [
+    ("2024-07-16 00:00:00", (datetime.date(2024, 7, 15), "evening")),
+    ("2024-07-16 03:59:59", (datetime.date(2024, 7, 15), "evening")),
+    ("2024-07-16 04:00:00", None),
+    ("2024-07-16 06:59:59", None),
+    ("2024-07-16 07:00:00", (datetime.date(2024, 7, 16), "morning")),
+    ("2024-07-16 15:00:00", (datetime.date(2024, 7, 16), "evening")),
+    # Високосный день: ночь на 29.02 и ночь на 01.03
+    ("2024-02-29 03:00:00", (datetime.date(2024, 2, 28), "evening")),
+    ("2024-02-29 23:30:00", (datetime.date(2024, 2, 29), "evening")),
+    ("2024-03-01 00:30:00", (datetime.date(2024, 2, 29), "evening")),
+    ("2024-03-01 03:59:59", (datetime.date(2024, 2, 29), "evening")),
+]
+
+class NightHoursTest(unittest.TestCase):
+    def test_bucket_timestamps(self):
+        timestamps = [ts for ts, _ in CASES]
+        self.assertEqual(bucket_timestamps(timestamps), [expected for _, expected in CASES])
+
+    def test_bucket_timestamps_datetime(self):
+        timestamps = [datetime.datetime.fromisoformat(ts) for ts, _ in CASES]
+        self.assertEqual(bucket_timestamps(timestamps), [expected for _, expected in CASES])
+
+    def test_sql_shift_columns_sqlite(self):
+        date_expr, name_expr = sql_shift_columns("ts", "sqlite")
+        conn = sqlite3.connect(":memory:")
+        try:
+            for ts, expected in CASES:
+                with self.subTest(ts=ts):
+                    shift_date, name = conn.execute(f"SELECT {date_expr}, {name_expr} FROM (SELECT ? AS ts)", (ts,)).fetchone()
+                    actual = None if name is None else (datetime.date.fromisoformat(shift_date), name)
+                    self.assertEqual(actual, expected)
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    unittest.main()
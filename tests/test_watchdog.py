@@ -0,0 +1,94 @@
+# tests/test_watchdog.py
+# Контроль event loop: при зависании называется задача, которая держит цикл, а обработчик
+# исключений цикла считает сбоем фоновой задачи только исключения задач.
+# Запуск: python -m unittest discover tests
+import os
+import sys
+import time
+import asyncio
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "test")
+os.environ.setdefault("LOG_FILE", "")
+
+from watchdog import LoopWatchdog, BACKGROUND_TASK_FAILURES, _loop_exception_handler
+
+def _failures(name: str) -> float:
+    return BACKGROUND_TASK_FAILURES.labels(name).value
+
+class CurrentTaskTest(unittest.TestCase):
+    def test_names_task_blocking_the_loop(self):
+        watchdog = LoopWatchdog()
+        seen = []
+
+        def sample(loop_thread_id):
+            # Поток watchdog: снимок стека цикла, пока тот заблокирован
+            frame = sys._current_frames()[loop_thread_id]
+            seen.append(watchdog._current_task_name(frame))
+
+        async def blocking_job():
+            sampler = threading.Thread(target=sample, args=(threading.get_ident(),))
+            sampler.start()
+            sampler.join()
+            time.sleep(0.01)
+
+        async def main():
+            watchdog.loop = asyncio.get_running_loop()
+            idle = asyncio.create_task(asyncio.sleep(1), name="idle")
+            await asyncio.create_task(blocking_job(), name="report_job")
+            idle.cancel()
+
+        asyncio.run(main())
+        self.assertEqual(seen, ["report_job (CurrentTaskTest.test_names_task_blocking_the_loop.<locals>.blocking_job)"])
+
+    def test_callback_outside_task(self):
+        watchdog = LoopWatchdog()
+        seen = []
+
+        def callback():
+            seen.append(watchdog._current_task_name(sys._getframe()))
+
+        async def main():
+            watchdog.loop = asyncio.get_running_loop()
+            watchdog.loop.call_soon(callback)
+            await asyncio.sleep(0.01)
+
+        asyncio.run(main())
+        self.assertEqual(seen, ["вне задачи (колбэк цикла)"])
+
+class LoopExceptionHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_task_failure_is_counted(self):
+        async def job():
+            raise RuntimeError("boom")
+        task = self.loop.create_task(job(), name="leaderboard")
+        with self.assertRaises(RuntimeError):
+            self.loop.run_until_complete(task)
+        before = _failures("leaderboard")
+        with mock.patch.object(self.loop, "default_exception_handler") as default:
+            with self.assertLogs(level="ERROR"):
+                _loop_exception_handler(self.loop, {"message": "Task exception was never retrieved", "exception": task.exception(), "future": task})
+        self.assertEqual(_failures("leaderboard"), before + 1)
+        default.assert_not_called()
+
+    def test_other_contexts_go_to_default_handler(self):
+        future = self.loop.create_future()
+        contexts = (
+            {"message": "Exception in callback", "exception": RuntimeError("callback"), "handle": None},
+            {"message": "Future exception was never retrieved", "exception": RuntimeError("future"), "future": future},
+        )
+        before = {labels: child.value for labels, child in BACKGROUND_TASK_FAILURES._children.items()}
+        for context in contexts:
+            with mock.patch.object(self.loop, "default_exception_handler") as default:
+                _loop_exception_handler(self.loop, context)
+            default.assert_called_once_with(context)
+        self.assertEqual({labels: child.value for labels, child in BACKGROUND_TASK_FAILURES._children.items()}, before)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+# userstats.py
+# Итоги /my_stats: сколько курьер принял по сервисам за смену или месяц. Итоги кэшируются
+# на MY_STATS_TTL секунд, поэтому шквал запросов в конце смены стоит одного запроса к базе
+# на курьера; его новая запись сбрасывает кэш. Отвечает бот одному курьеру не чаще раза
+# в MY_STATS_INTERVAL секунд. Кэш живет в памяти процесса: другие процессы за
+# балансировщиком увидят новую запись не позже, чем через MY_STATS_TTL.
+from config import MY_STATS_TTL, MY_STATS_INTERVAL
+from metrics import MY_STATS_REQUESTS
+import asyncio
+import time
+
+class UserStatsCache:
+    """
+    Итоги по ключу (пользователь, период, начало периода); одновременные промахи по
+    одному ключу ждут один запрос.
+    """
+    def __init__(self, ttl: float, interval: float):
+        self.ttl = ttl
+        self.interval = interval
+        self._entries = {}
+        self._replied = {}
+
+    def allow(self, user_id: int) -> bool:
+        """
+        Можно ли ответить пользователю сейчас; разрешение засчитывается как ответ.
+        """
+        now = time.monotonic()
+        last = self._replied.get(user_id)
+        if last is not None and now - last < self.interval:
+            MY_STATS_REQUESTS.labels("limited").inc()
+            return False
+        self._replied[user_id] = now
+        return True
+
+    async def get(self, key: tuple, fetch) -> dict:
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        # Упавший запрос не кэшируется: следующий вызов повторит его
+        if entry is None or entry[0] <= now or (entry[1].done() and entry[1].exception() is not None):
+            MY_STATS_REQUESTS.labels("miss").inc()
+            self._prune(now)
+            entry = (now + self.ttl, asyncio.ensure_future(fetch()))
+            self._entries[key] = entry
+        else:
+            MY_STATS_REQUESTS.labels("hit").inc()
+        return await asyncio.shield(entry[1])
+
+    def invalidate(self, user_id: int = None):
+        """
+        Сбрасывает итоги пользователя (None — всех, например после импорта или удаления).
+        """
+        if user_id is None:
+            self._entries.clear()
+            return
+        for key in [key for key in self._entries if key[0] == user_id]:
+            del self._entries[key]
+
+    def _prune(self, now: float):
+        for key in [key for key, (expires, _) in self._entries.items() if expires <= now]:
+            del self._entries[key]
+        for user_id in [user_id for user_id, last in self._replied.items() if now - last >= self.interval]:
+            del self._replied[user_id]
+
+user_stats = UserStatsCache(MY_STATS_TTL, MY_STATS_INTERVAL)
@@ -0,0 +1,181 @@
+# watchdog.py
+# Контроль задержки event loop и реестр фоновых задач бота.
+from config import LOOP_LAG_THRESHOLD_MS, LOOP_LAG_INTERVAL
+from metrics import Counter, Gauge, Histogram
+from profiling import record
+from collections import defaultdict
+import asyncio
+import functools
+import logging
+import sys
+import threading
+import time
+import traceback
+
+LOOP_LAG_SECONDS = Histogram("scooter_bot_loop_lag_seconds", "Задержка event loop", buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+LOOP_STALLS = Counter("scooter_bot_loop_stalls_total", "Блокировки event loop дольше порога")
+BACKGROUND_TASKS = Gauge("scooter_bot_background_tasks", "Живые фоновые задачи по именам", ("name",))
+BACKGROUND_TASK_FAILURES = Counter("scooter_bot_background_task_failures_total", "Фоновые задачи, завершившиеся исключением", ("name",))
+ASYNCIO_TASKS = Gauge("scooter_bot_asyncio_tasks", "Все задачи asyncio в цикле")
+
+_tasks = defaultdict(set)
+
+def _task_done(name: str, task: asyncio.Task):
+    _tasks[name].discard(task)
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        BACKGROUND_TASK_FAILURES.labels(name).inc()
+        logging.error(f"❌ Фоновая задача {name} завершилась с ошибкой: {exc!r}", exc_info=(type(exc), exc, exc.__traceback__))
+
+def _ensure_gauge(name: str):
+    if name not in _tasks:
+        BACKGROUND_TASKS.labels(name).set_function(lambda: len(_tasks[name]))
+
+def _register(task: asyncio.Task, name: str):
+    _ensure_gauge(name)
+    _tasks[name].add(task)
+    task.add_done_callback(functools.partial(_task_done, name))
+
+def spawn(coro, name: str) -> asyncio.Task:
+    """
+    Запускает фоновую задачу с учетом в реестре: ее исключение будет залогировано,
+    а не потеряно с "Task exception was never retrieved".
+    """
+    task = asyncio.get_running_loop().create_task(coro, name=name)
+    _register(task, name)
+    return task
+
+def supervised(name: str):
+    """
+    Декоратор для корутин, которые запускает кто-то другой (например, APScheduler):
+    текущая задача попадает в реестр на время выполнения.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            task = asyncio.current_task()
+            _ensure_gauge(name)
+            _tasks[name].add(task)
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                BACKGROUND_TASK_FAILURES.labels(name).inc()
+                raise
+            finally:
+                _tasks[name].discard(task)
+        return wrapper
+    return decorator
+
+def live_task_counts() -> dict:
+    return {name: len(tasks) for name, tasks in _tasks.items() if tasks}
+
+def _loop_exception_handler(loop, context):
+    task = context.get('task') or context.get('future')
+    if not isinstance(task, asyncio.Task):
+        # Колбэки, транспорты, Future без задачи: сбоем фоновой задачи это не считается
+        loop.default_exception_handler(context)
+        return
+    name = task.get_name()
+    BACKGROUND_TASK_FAILURES.labels(name).inc()
+    exc = context.get('exception')
+    logging.error(
+        f"❌ Необработанное исключение в задаче {name}: {context.get('message')}",
+        exc_info=(type(exc), exc, exc.__traceback__) if exc else None
+    )
+
+class LoopWatchdog:
+    """
+    Корутина меряет задержку цикла, а отдельный поток при зависании снимает стек
+    потока цикла, пока тот еще заблокирован — так видно, какой код держит цикл.
+    """
+    def __init__(self, threshold_ms: int = LOOP_LAG_THRESHOLD_MS, interval: float = LOOP_LAG_INTERVAL):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval
+        self.loop = None
+        self.loop_thread_id = None
+        self.heartbeat = time.monotonic()
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._task = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.loop.set_exception_handler(_loop_exception_handler)
+        ASYNCIO_TASKS.set_function(lambda: len(asyncio.all_tasks(self.loop)))
+        self.heartbeat = time.monotonic()
+        self._task = spawn(self._measure(), "loop_watchdog")
+        self._thread = threading.Thread(target=self._sample_stalls, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logging.info(f"🐕 Контроль event loop запущен (порог {self.threshold * 1000:.0f} мс)")
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _measure(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.heartbeat = now
+            lag = max(0.0, now - started - self.interval)
+            LOOP_LAG_SECONDS.observe(lag)
+            record("loop:lag", lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self.stalls += 1
+                LOOP_STALLS.inc()
+                logging.warning(f"🐢 Event loop был заблокирован на {lag * 1000:.0f} мс")
+
+    def _current_task_name(self, frame) -> str:
+        # Задача, чья корутина есть в стеке потока цикла: у выполняемой корутины кадр
+        # cr_frame лежит в цепочке f_back от текущего кадра
+        stack_frames = set()
+        while frame is not None:
+            stack_frames.add(id(frame))
+            frame = frame.f_back
+        for task in asyncio.all_tasks(self.loop):
+            coro = task.get_coro()
+            if id(getattr(coro, 'cr_frame', None)) in stack_frames:
+                return f"{task.get_name()} ({coro.__qualname__})"
+        return "вне задачи (колбэк цикла)"
+
+    def _sample_stalls(self):
+        reported_heartbeat = None
+        samples_taken = 0
+        while not self._stop.wait(self.threshold / 2):
+            heartbeat = self.heartbeat
+            stalled_for = time.monotonic() - heartbeat - self.interval
+            if stalled_for < self.threshold:
+                continue
+            if heartbeat != reported_heartbeat:
+                reported_heartbeat = heartbeat
+                samples_taken = 0
+            # Не больше трех снимков на одно зависание
+            if samples_taken >= 3:
+                continue
+            samples_taken += 1
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame, limit=25))
+            logging.warning(
+                f"🧵 Цикл заблокирован уже {stalled_for * 1000:.0f} мс, задача: {self._current_task_name(frame)}\n{stack}"
+            )
+
+watchdog = LoopWatchdog()
+
+def format_status() -> list[str]:
+    lines = [f"\n<b>🐕 Event loop:</b> макс. задержка {watchdog.max_lag * 1000:.0f} мс, зависаний: {watchdog.stalls}"]
+    counts = live_task_counts()
+    if counts:
+        lines.append("Фоновые задачи: " + ", ".join(f"{name}={count}" for name, count in sorted(counts.items())))
+    if watchdog.loop is not None:
+        lines.append(f"Всего задач asyncio: {len(asyncio.all_tasks(watchdog.loop))}")
+    return lines